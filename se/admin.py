@@ -44,6 +44,8 @@ from .domain import Domain
 from .html_asset import HTMLAsset
 from .mime_plugin import MimePlugin
 from .models import AuthField, ExcludedUrl, Link, SearchEngine, WorkerStats
+from .saved_search import SavedSearch
+from .search_cache import SearchCache
 from .tag import Tag
 from .tag_field import TagField
 from .utils import mimetype_icon, reverse_no_escape
@@ -64,6 +66,7 @@ class SEAdminSite(admin.AdminSite):
         "MimePlugin": "🧩",
         "ExcludedUrl": "🔗",
         "SearchEngine": "🔍",
+        "SavedSearch": "🔔",
         "User": "👤",
         "Group": "👥",
     }
@@ -82,6 +85,7 @@ class SEAdminSite(admin.AdminSite):
                     "MimePlugin",
                     "ExcludedUrl",
                     "SearchEngine",
+                    "SavedSearch",
                     "HTMLAsset",
                 ),
             ),
@@ -410,12 +414,16 @@ def crawl_later(modeladmin, request, queryset):
 
 @admin.action(description="Switch hidden", permissions=["change"])
 def switch_hidden(modeladmin, request, queryset):
+    SearchCache.invalidate()
+    # The queryset may be filtered on the hidden state
+    doc_ids = list(queryset.values_list("id", flat=True))
     queryset.update(
         hidden=models.Case(
             models.When(hidden=True, then=models.Value(False)),
             models.When(hidden=False, then=models.Value(True)),
         )
     )
+    SavedSearch.percolate_documents(doc_ids)
 
 
 @admin.action(description="Trigger webhooks", permissions=["change"])
@@ -429,7 +437,11 @@ def trigger_webhooks(modeladmin, request, queryset):
 
 @admin.action(description="Clear tags", permissions=["change"])
 def clear_tags(modeladmin, request, queryset):
-    Document.tags.through.objects.filter(document__in=queryset).delete()
+    # Bulk changes of the through table do not send m2m_changed
+    doc_ids = list(queryset.values_list("id", flat=True))
+    Document.tags.through.objects.filter(document__in=doc_ids).delete()
+    SearchCache.invalidate()
+    SavedSearch.percolate_documents(doc_ids)
 
 
 @admin.action(description="Move to collection", permissions=["change"])
@@ -883,6 +895,8 @@ class DocumentAdmin(InlineActionModelAdmin, ActiveTagMixin):
     def delete_queryset(self, request, queryset):
         for obj in queryset.all():
             obj.delete_all()
+        # Document.delete() is not called by queryset deletions
+        SearchCache.invalidate()
         return super().delete_queryset(request, queryset)
 
 
@@ -996,6 +1010,7 @@ def collection_duplicate(modeladmin, request, queryset):
 
 @admin.action(description="Update doc tags", permissions=["document_change"])
 def update_doc_tags(modeladmin, request, queryset, clear_first=False):
+    updated = set()
     for obj in queryset:
         documents = Document.objects.wo_content().filter(url__regex=obj.unlimited_regex_pg)
 
@@ -1003,7 +1018,9 @@ def update_doc_tags(modeladmin, request, queryset, clear_first=False):
             Document.tags.through.objects.filter(document__in=documents).delete()
 
         tags = obj.tags.all()
-        documents_id = documents.values_list("id", flat=True)
+        documents_id = list(documents.values_list("id", flat=True))
+        if clear_first or tags:
+            updated.update(documents_id)
         new_tags = [(doc_id, tag.id) for doc_id in documents_id for tag in tags]
 
         if new_tags:
@@ -1012,6 +1029,10 @@ def update_doc_tags(modeladmin, request, queryset, clear_first=False):
                 ignore_conflicts=True,
             )
 
+    # Bulk changes of the through table do not send m2m_changed
+    SearchCache.invalidate()
+    SavedSearch.percolate_documents(sorted(updated))
+
 
 @admin.action(description="Clear & update doc tags", permissions=["document_change"])
 def clear_update_doc_tags(modeladmin, request, queryset):
@@ -1217,6 +1238,26 @@ class DomainAdmin(admin.ModelAdmin):
         )
 
 
+@admin.register(SavedSearch)
+class SavedSearchAdmin(admin.ModelAdmin):
+    list_display = ("name", "user", "enabled", "match_count", "feed")
+    list_filter = ("enabled",)
+    search_fields = ("name", "querystring")
+    fields = ("name", "user", "querystring", "enabled")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_match_count=models.Count("savedsearchmatch"))
+
+    @staticmethod
+    @admin.display(description="Matches", ordering="_match_count")
+    def match_count(obj):
+        return obj._match_count
+
+    @staticmethod
+    def feed(obj):
+        return format_html('<a href="{}">Atom feed</a>', obj.atom_url())
+
+
 class CookieForm(CharFieldForm):
     pass
 
@@ -1506,7 +1547,7 @@ if settings.DEBUG:
     class HTMLAssetAdmin(admin.ModelAdmin):
         list_display = ("url", "filename", "ref_count")
         search_fields = ("url", "filename")
-        ordering = ("url", "filename", "ref_count")
+        ordering = ("url", "filename", "blob__ref_count")
         form = HTMLAssetForm
         exclude = tuple()
 
@@ -13,24 +13,32 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
-import os
 from hashlib import md5
+from itertools import islice
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.db.models.functions import Substr
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.views.generic import View
 from lxml.etree import (  # nosec B410, ignore Bandit warning because lxml is only used for XML generation
     Element,
     tostring,
 )
 
-from .html_asset import HTMLAsset
+from .html_asset import HTMLAsset, html_asset_path
 from .models import SearchEngine
+from .saved_search import SavedSearch
 from .search import get_documents_from_request
 from .search_form import SearchForm
-from .utils import reverse_no_escape
+from .utils import http_date_format, reverse_no_escape
+
+# Number of characters of the content from which the summary of entries is taken
+SUMMARY_SIZE = 4096
+# Number of entries read from the database at once while the feed is streamed
+ENTRIES_CHUNK_SIZE = 50
 
 
 class AtomView(View):
@@ -53,11 +61,96 @@ class AtomView(View):
         if settings.SOSSE_ANONYMOUS_SEARCH:
             return True
 
-        if settings.SOSSE_ATOM_ACCESS_TOKEN:
-            if request.GET.get("token") == settings.SOSSE_ATOM_ACCESS_TOKEN:
-                return True
+        return self._token_is_valid(request)
+
+    def _token_is_valid(self, request):
+        return bool(settings.SOSSE_ATOM_ACCESS_TOKEN) and request.GET.get("token") == settings.SOSSE_ATOM_ACCESS_TOKEN
+
+    def _saved_search(self, request):
+        saved_search_id = request.GET.get("saved_search")
+        if not saved_search_id:
+            return None
+
+        try:
+            saved_search = SavedSearch.objects.get(pk=int(saved_search_id))
+        except (ValueError, SavedSearch.DoesNotExist):
+            raise Http404("Saved search not found")
+
+        if saved_search.user != request.user and not request.user.is_superuser and not self._token_is_valid(request):
+            raise PermissionDenied
+        return saved_search
+
+    def _entry_url(self, request, base_url, archive_page, doc, assets):
+        if archive_page == "0":
+            return doc.url
+
+        if settings.SOSSE_ATOM_ARCHIVE_BIN_PASSTHROUGH and (not doc.mimetype or not doc.mimetype.startswith("text/")):
+            asset = assets.get(doc.url)
+            if not asset or not html_asset_path(asset.filename):
+                return base_url + reverse_no_escape("www", args=[doc.url])
+            return request.build_absolute_uri(settings.SOSSE_HTML_SNAPSHOT_URL) + asset.filename
+
+        if doc.mimetype.startswith("text/"):
+            view_name = "www"
+        else:
+            view_name = "download"
+        return base_url + reverse_no_escape(view_name, args=[doc.url])
+
+    def _assets(self, archive_page, docs):
+        assets = {}
+        if archive_page != "0" and settings.SOSSE_ATOM_ARCHIVE_BIN_PASSTHROUGH:
+            urls = [doc.url for doc in docs if not doc.mimetype or not doc.mimetype.startswith("text/")]
+            # The last downloaded asset of each url is kept
+            for asset in HTMLAsset.objects.filter(url__in=urls).order_by("download_date", "id"):
+                assets[asset.url] = asset
+        return assets
+
+    def _feed(self, request, q, sort_key, updated, results):
+        base_url = request.META["REQUEST_SCHEME"] + "://" + request.META["HTTP_HOST"]
+        archive_page = request.GET.get("archive", "0")
+
+        feed = Element("feed")
+        feed.attrib["xmlns"] = "http://www.w3.org/2005/Atom"
+        feed.append(self._elem("title", f"Sosse · {q}"))
+        feed.append(self._elem("description", f"Sosse search results for {q}"))
+        url = base_url + reverse("search") + "?" + request.META["QUERY_STRING"]
+        feed.append(self._elem("link", None, href=url))
+        if updated:
+            feed.append(self._elem("updated", updated.isoformat()))
+        feed_id = "SOSSE" + request.META["QUERY_STRING"]
+        feed.append(self._elem("id", self._str_to_uuid(feed_id)))
+        feed.append(self._elem("icon", base_url + settings.STATIC_URL + "logo.svg"))
+
+        # The feed is sent without its closing tag, followed by the entries
+        feed = tostring(feed, pretty_print=True)
+        feed_end = b"</feed>\n"
+        yield feed[: -len(feed_end)]
+
+        docs = results.iterator(chunk_size=ENTRIES_CHUNK_SIZE)
+        while chunk := list(islice(docs, ENTRIES_CHUNK_SIZE)):
+            assets = self._assets(archive_page, chunk)
+            for doc in chunk:
+                entry = Element("entry")
+                entry.append(self._elem("title", doc.title))
+                url = self._entry_url(request, base_url, archive_page, doc, assets)
+                entry.append(self._elem("link", None, href=url))
+
+                sort_value = getattr(doc, sort_key)
+                if sort_key in ("crawl_first", "crawl_last", "modified_date"):
+                    sort_value = sort_value.isoformat()
+                entry.append(self._elem("id", self._str_to_uuid(f"{url}-{sort_value}")))
 
-        return False
+                if sort_key in ("crawl_first", "crawl_last", "modified_date"):
+                    entry.append(self._elem("updated", sort_value))
+
+                content = ""
+                lines = doc.summary.splitlines()
+                if lines:
+                    content = "\n".join(lines[:5])
+                entry.append(self._elem("summary", content))
+                yield tostring(entry, pretty_print=True)
+
+        yield feed_end
 
     def get(self, request):
         results = None
@@ -69,7 +162,8 @@ class AtomView(View):
         form = SearchForm(request.GET)
         if form.is_valid():
             q = form.cleaned_data["q"]
-            redirect_url = SearchEngine.should_redirect(q)
+            saved_search = self._saved_search(request)
+            redirect_url = None if saved_search else SearchEngine.should_redirect(q)
             if redirect_url:
                 return HttpResponse(
                     b"External search cannot be performed",
@@ -77,7 +171,12 @@ class AtomView(View):
                     status=400,
                 )
 
-            _, results, _ = get_documents_from_request(request, form)
+            if saved_search:
+                # Matches are recorded when documents are indexed
+                q = saved_search.name
+                results = saved_search.documents()
+            else:
+                _, results, _ = get_documents_from_request(request, form)
 
             sort_key = request.GET.get("s", "")
             if sort_key.startswith("-"):
@@ -90,58 +189,31 @@ class AtomView(View):
             results = results.exclude(**param)
             results = results.order_by("-" + sort_key)
 
-            base_url = request.META["REQUEST_SCHEME"] + "://" + request.META["HTTP_HOST"]
-            archive_page = request.GET.get("archive", "0")
-
-            feed = Element("feed")
-            feed.attrib["xmlns"] = "http://www.w3.org/2005/Atom"
-            feed.append(self._elem("title", f"Sosse · {q}"))
-            feed.append(self._elem("description", f"Sosse search results for {q}"))
-            url = base_url + reverse("search") + "?" + request.META["QUERY_STRING"]
-            feed.append(self._elem("link", None, href=url))
-            if len(results):
-                feed.append(self._elem("updated", getattr(results[0], sort_key).isoformat()))
-            feed_id = "SOSSE" + request.META["QUERY_STRING"]
-            feed.append(self._elem("id", self._str_to_uuid(feed_id)))
-            feed.append(self._elem("icon", base_url + settings.STATIC_URL + "logo.svg"))
-
-            for doc in results[: settings.SOSSE_ATOM_FEED_SIZE]:
-                entry = Element("entry")
-                entry.append(self._elem("title", doc.title))
-                if archive_page == "0":
-                    url = doc.url
-                else:
-                    if settings.SOSSE_ATOM_ARCHIVE_BIN_PASSTHROUGH and (
-                        not doc.mimetype or not doc.mimetype.startswith("text/")
-                    ):
-                        asset = HTMLAsset.objects.filter(url=doc.url).order_by("download_date").last()
-                        if not asset or not os.path.exists(settings.SOSSE_HTML_SNAPSHOT_DIR + asset.filename):
-                            url = base_url + reverse_no_escape("www", args=[doc.url])
-                        else:
-                            url = request.build_absolute_uri(settings.SOSSE_HTML_SNAPSHOT_URL) + asset.filename
-                    else:
-                        if doc.mimetype.startswith("text/"):
-                            view_name = "www"
-                        else:
-                            view_name = "download"
-                        url = base_url + reverse_no_escape(view_name, args=[doc.url])
-                entry.append(self._elem("link", None, href=url))
-
-                sort_value = getattr(doc, sort_key)
-                if sort_key in ("crawl_first", "crawl_last", "modified_date"):
-                    sort_value = sort_value.isoformat()
-                entry.append(self._elem("id", self._str_to_uuid(f"{url}-{sort_value}")))
-
-                if sort_key in ("crawl_first", "crawl_last", "modified_date"):
-                    entry.append(self._elem("updated", sort_value))
-
-                content = ""
-                lines = doc.content.splitlines()
-                if lines:
-                    content = "\n".join(lines[:5])
-                entry.append(self._elem("summary", content))
-                feed.append(entry)
-
-            return HttpResponse(tostring(feed, pretty_print=True), content_type="text/plain")
+            # Validators of conditional requests, checked before the feed is rendered, from the entries of
+            # the feed only
+            entries = list(results[: settings.SOSSE_ATOM_FEED_SIZE].values_list("id", "crawl_first", "crawl_last"))
+            updated = None
+            if entries:
+                updated = entries[0][1] if sort_key == "crawl_first" else entries[0][2]
+            last_modified = max((date for _, *dates in entries for date in dates if date), default=None)
+            etag = request.META["QUERY_STRING"] + "".join(f"-{entry}" for entry in entries)
+            etag = '"' + md5(etag.encode("utf-8"), usedforsecurity=False).hexdigest() + '"'
+            headers = {"ETag": etag}
+            if last_modified:
+                headers["Last-Modified"] = http_date_format(last_modified)
+                last_modified = int(last_modified.timestamp())
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                for key, value in headers.items():
+                    response.headers[key] = value
+                return response
+
+            # Only the first lines of the content are displayed
+            results = results.only("url", "title", "mimetype", sort_key).annotate(
+                summary=Substr("content", 1, SUMMARY_SIZE)
+            )
+            feed = self._feed(request, q, sort_key, updated, results[: settings.SOSSE_ATOM_FEED_SIZE])
+            return StreamingHttpResponse(feed, content_type="text/plain", headers=headers)
 
         return HttpResponse(b"Invalid query parameters", content_type="text/plain", status=400)
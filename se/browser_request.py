@@ -17,18 +17,21 @@
 import logging
 
 import requests
+import urllib3.util.connection
 import urllib3.util.url
 from django.conf import settings
-from requests.adapters import HTTPAdapter
 
 from .browser import AuthElemFailed, Browser, PageTooBig, TooManyRedirects
 from .browser_request_hack import _encode_invalid_chars
 from .cookie import Cookie
+from .dns_cache import create_connection
 from .domain import user_agent
+from .http_pool import HTTPPool
 from .page import Page
 from .url import absolutize_url, url_remove_fragment
 
 urllib3.util.url._encode_invalid_chars = _encode_invalid_chars
+urllib3.util.connection.create_connection = create_connection
 crawl_logger = logging.getLogger("crawler")
 
 
@@ -110,26 +113,17 @@ class BrowserRequest(Browser):
             }
         )
 
-    _session_cache = {}
-
     @classmethod
-    def _get_session(cls, url):
-        """Get or create a cached session for the given hostname."""
-        hostname = requests.utils.urlparse(url).hostname
-        if hostname not in cls._session_cache:
-            session = requests.Session()
-            adapter = HTTPAdapter(max_retries=0)
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
-            cls._session_cache[hostname] = session
-        return cls._session_cache[hostname]
+    def _requests_query(cls, method, url, max_file_size, **kwargs):
+        # The session is not closed by the pool while the response is read
+        with HTTPPool.use_session(url) as session:
+            return cls._session_query(session, method, url, max_file_size, **kwargs)
 
     @classmethod
-    def _requests_query(cls, method, url, max_file_size, **kwargs):
+    def _session_query(cls, session, method, url, max_file_size, **kwargs):
         jar = cls._get_cookies(url)
         crawl_logger.debug(f"from the jar: {jar}")
 
-        session = cls._get_session(url)
         session.cookies = jar
 
         func = getattr(session, method)
@@ -38,6 +38,7 @@ from .browser import (
 from .browser_request import BrowserRequest
 from .cookie import Cookie
 from .page import NAV_ELEMENTS, Page
+from .storage_usage import StorageUsage
 from .url import has_browsable_scheme, sanitize_url, urlparse
 
 crawl_logger = logging.getLogger("crawler")
@@ -458,7 +459,8 @@ class BrowserSelenium(Browser):
             with Image.open(thumb_png) as img:
                 img = img.convert("RGB")  # Remove alpha channel from the png
                 img.thumbnail((160, 100))
-                img.save(thumb_jpg, "jpeg")
+                with StorageUsage.writing(StorageUsage.SCREENSHOTS, thumb_jpg):
+                    img.save(thumb_jpg, "jpeg")
         finally:
             if os.path.exists(thumb_png):
                 os.unlink(thumb_png)
@@ -511,12 +513,13 @@ class BrowserSelenium(Browser):
 
             # For the last screenshot, we cannot scroll past the bottom
             # of the page, so we need to remove extra content from the screenshot
-            if missing_height > 0 and missing_height < img_height:
-                cropped_img = img.crop((0, missing_height, img_width, img_height))
-                cropped_img.save(screenshot_file, "PNG")
-            else:
-                with open(screenshot_file, "wb") as f:
-                    f.write(screenshot)
+            with StorageUsage.writing(StorageUsage.SCREENSHOTS, screenshot_file):
+                if missing_height > 0 and missing_height < img_height:
+                    cropped_img = img.crop((0, missing_height, img_width, img_height))
+                    cropped_img.save(screenshot_file, "PNG")
+                else:
+                    with open(screenshot_file, "wb") as f:
+                        f.write(screenshot)
 
         return img_no
 
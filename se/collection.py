@@ -20,6 +20,8 @@ from datetime import timedelta
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import DataError, connection, models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 
 from .browser import AuthElemFailed
 from .browser_chromium import BrowserChromium
@@ -27,6 +29,7 @@ from .browser_firefox import BrowserFirefox
 from .browser_request import BrowserRequest
 from .document import Document
 from .domain import Domain
+from .search_cache import SearchCache
 from .tag import Tag
 from .utils import build_multiline_re
 from .webhook import Webhook
@@ -402,3 +405,9 @@ class Collection(models.Model):
                 browser_str = domain.browse_mode
 
         return BROWSER_MAP[browser_str]
+
+
+@receiver(post_delete, sender=Collection)
+def collection_deleted(sender, **kwargs):
+    # Documents are deleted by the cascade, without calling Document.delete()
+    SearchCache.invalidate()
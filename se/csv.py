@@ -15,19 +15,32 @@
 
 import csv
 import datetime
-import io
-from copy import deepcopy
+from itertools import chain, islice
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.generic import View
 
 from .models import SearchEngine
 from .rest_api import SearchResult
-from .search import get_documents_from_request
+from .search import get_documents_from_request, load_content
 from .search_form import SearchForm
 
+# Number of rows read from the database at once
+CSV_CHUNK_SIZE = 500
+
+# Number of rows used to discover the metadata columns
+METADATA_SCAN_SIZE = 1000
+
+
+class EchoBuffer:
+    """File-like object returning what is written, to stream the lines of a
+    csv writer."""
+
+    def write(self, value):
+        return value
+
 
 class CsvView(View):
     def _csv_is_allowed(self, request):
@@ -42,6 +55,36 @@ class CsvView(View):
 
         return False
 
+    @staticmethod
+    def _csv_rows(head, docs):
+        # If all subelements of metadata are not structured, flatten it
+        is_structured = False
+        metadata_fields = set()
+        for doc in head:
+            for v in doc["metadata"].values():
+                if isinstance(v, list) or isinstance(v, dict):
+                    is_structured = True
+                    break
+            else:
+                metadata_fields |= set(doc["metadata"].keys())
+            if is_structured:
+                break
+
+        fieldnames = list(head[0].keys())
+        if not is_structured:
+            fieldnames.remove("metadata")
+            fieldnames += [f"metadata {field}" for field in sorted(metadata_fields)]
+
+        # Metadata fields not found in the first rows are ignored
+        writer = csv.DictWriter(EchoBuffer(), fieldnames=fieldnames, extrasaction="ignore")
+        yield writer.writeheader()
+        for doc in chain(head, docs):
+            if not is_structured:
+                metadata = doc.pop("metadata")
+                for field in metadata_fields:
+                    doc[f"metadata {field}"] = metadata.get(field, "")
+            yield writer.writerow(doc)
+
     def get(self, request):
         results = None
         q = None
@@ -72,59 +115,34 @@ class CsvView(View):
             param = {f"{sort_key}__isnull": True}
             results = results.exclude(**param)
             results = results.order_by("-" + sort_key)
-
-            is_structured = False
-            metadata_fields = set()
-
-            docs = []
-            for doc in results[: settings.SOSSE_CSV_EXPORT_SIZE]:
-                doc = SearchResult(instance=doc)
-                doc = deepcopy(doc.data)
-                doc.pop("content")
-                doc.pop("normalized_content")
-                doc.pop("vector")
-                doc.pop("vector_lang")
-
-                # If all subelements of metadata are not structured, flatten it
-                if not is_structured:
-                    for v in doc["metadata"].values():
-                        if isinstance(v, list) or isinstance(v, dict):
-                            is_structured = True
-                            break
-                    else:
-                        metadata_fields |= set(doc["metadata"].keys())
-
-                docs.append(doc)
-
-            if not is_structured:
-                for doc in docs:
-                    metadata = doc.pop("metadata")
-                    for field in sorted(metadata_fields):
-                        doc[f"metadata {field}"] = metadata.get(field, "")
+            results = load_content(results, ("error",)).prefetch_related("tags")
+            if settings.SOSSE_CSV_EXPORT_SIZE:
+                results = results[: settings.SOSSE_CSV_EXPORT_SIZE]
+            fields = [
+                field
+                for field in SearchResult().fields
+                if field not in ("content", "normalized_content", "vector", "vector_lang")
+            ]
+
+            # Rows are read with a server-side cursor
+            docs = (
+                SearchResult(instance=doc, fields=fields).data for doc in results.iterator(chunk_size=CSV_CHUNK_SIZE)
+            )
+            head = list(islice(docs, METADATA_SCAN_SIZE))
 
             filedate = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"search_{q}_{filedate}.csv"
-            if docs:
-                output = io.StringIO()
-                writer = csv.DictWriter(output, fieldnames=docs[0].keys())
-                writer.writeheader()
-                writer.writerows(docs)
-                return HttpResponse(
-                    output.getvalue(),
-                    content_type="text/csv",
-                    headers={
-                        "Content-Disposition": f'attachment; filename="{filename}"',
-                        "Cache-Control": "no-cache",
-                    },
-                )
-            else:
-                return HttpResponse(
-                    b"",
-                    content_type="text/csv",
-                    headers={
-                        "Content-Disposition": f'attachment; filename="{filename}"',
-                        "Cache-Control": "no-cache",
-                    },
-                )
+            headers = {
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Cache-Control": "no-cache",
+            }
+            if not head:
+                return HttpResponse(b"", content_type="text/csv", headers=headers)
+
+            return StreamingHttpResponse(
+                self._csv_rows(head, docs),
+                content_type="text/csv",
+                headers=headers,
+            )
 
         return HttpResponse(b"Invalid query parameters", content_type="text/plain", status=400)
@@ -0,0 +1,125 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import socket
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import urllib3.util.connection
+from django.conf import settings
+
+DNS_CACHE_MAX_ENTRIES = 4096
+
+_create_connection = urllib3.util.connection.create_connection
+
+
+def system_resolver(host, port):
+    """Resolve ``host`` with the system resolver, it returns the address infos."""
+    family = urllib3.util.connection.allowed_gai_family()
+    return socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+
+
+class DNSCache:
+    """Resolutions are kept for ``dns_cache_expiry`` seconds, the TTL of DNS
+    records is not provided by the system resolver. Entries are evicted in
+    LRU order when the cache is full."""
+
+    resolver = staticmethod(system_resolver)
+
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+    _hits = 0
+    _negative_hits = 0
+    _misses = 0
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries = OrderedDict()
+            cls._hits = 0
+            cls._negative_hits = 0
+            cls._misses = 0
+
+    @classmethod
+    def _store(cls, key, now, expiry, value):
+        cls._entries.pop(key, None)
+        if len(cls._entries) >= DNS_CACHE_MAX_ENTRIES:
+            cls._entries = OrderedDict((k, v) for k, v in cls._entries.items() if v[0] > now)
+        while len(cls._entries) >= DNS_CACHE_MAX_ENTRIES:
+            # Drop the least recently used entry
+            cls._entries.popitem(last=False)
+        cls._entries[key] = (now + expiry, value)
+
+    @classmethod
+    def resolve(cls, host, port):
+        key = (host, port)
+        now = monotonic()
+
+        with cls._lock:
+            expires, value = cls._entries.get(key, (None, None))
+            if expires is not None and expires > now:
+                cls._entries.move_to_end(key)
+                if isinstance(value, socket.gaierror):
+                    cls._negative_hits += 1
+                    raise socket.gaierror(*value.args)
+                cls._hits += 1
+                return value
+            cls._misses += 1
+
+        try:
+            addrinfos = cls.resolver(host, port)
+        except socket.gaierror as e:
+            with cls._lock:
+                cls._store(key, now, settings.SOSSE_DNS_CACHE_NEGATIVE_EXPIRY, e)
+            raise
+
+        with cls._lock:
+            cls._store(key, now, settings.SOSSE_DNS_CACHE_EXPIRY, addrinfos)
+        return addrinfos
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            lookups = cls._hits + cls._negative_hits + cls._misses
+            hit_ratio = 0.0
+            if lookups:
+                hit_ratio = (cls._hits + cls._negative_hits) / lookups
+            return {
+                "entries": len(cls._entries),
+                "hits": cls._hits,
+                "negative_hits": cls._negative_hits,
+                "misses": cls._misses,
+                "hit_ratio": hit_ratio,
+            }
+
+
+def create_connection(address, *args, **kwargs):
+    """Replacement of urllib3's ``create_connection`` going through the
+    :class:`DNSCache` when the ``dns_cache`` option is enabled."""
+    host, port = address
+    if not settings.SOSSE_DNS_CACHE or host is None:
+        return _create_connection(address, *args, **kwargs)
+
+    err = None
+    for _, _, _, _, sockaddr in DNSCache.resolve(host.strip("[]"), port):
+        try:
+            return _create_connection((sockaddr[0], port), *args, **kwargs)
+        except OSError as e:
+            err = e
+
+    if err is not None:
+        raise err
+    raise OSError("getaddrinfo returns an empty list")
@@ -27,6 +27,8 @@ from django.conf import settings
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 from django.db import connection, models
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django.template.loader import get_template
 from django.utils.html import format_html
 from django.utils.timezone import now
@@ -37,9 +39,13 @@ from PIL import Image
 from .browser import AuthElemFailed, SkipIndexing
 from .document_meta import DocumentMeta
 from .domain import Domain
+from .html_asset import html_asset_path
 from .html_cache import HTMLAsset, HTMLCache
 from .html_snapshot import HTMLSnapshot
+from .image_blob import SCREENSHOT_BLOB_DIR, THUMBNAIL_BLOB_DIR, ImageBlob
 from .mime_plugin import MimePlugin
+from .search_cache import SearchCache
+from .storage_usage import StorageUsage
 from .tag import Tag
 from .url import url_beautify, validate_url
 from .utils import reverse_no_escape
@@ -80,6 +86,24 @@ def extern_link_flags():
     return format_html(opt)
 
 
+# Fields used to select and sort search results, the search cache is invalidated when they change
+SEARCH_FIELDS = (
+    "url",
+    "normalized_url",
+    "title",
+    "normalized_title",
+    "content",
+    "normalized_content",
+    "lang_iso_639_1",
+    "vector_lang",
+    "mimetype",
+    "hidden",
+    "collection_id",
+    "crawl_first",
+    "modified_date",
+)
+
+
 class DocumentManager(models.Manager):
     def count(self):
         return super().get_queryset().count()
@@ -91,6 +115,7 @@ class DocumentManager(models.Manager):
         return super().get_queryset().create(*args, **kwargs)
 
     def update(self, *args, **kwargs):
+        SearchCache.invalidate()
         return super().get_queryset().update(*args, **kwargs)
 
     def w_content(self):
@@ -110,6 +135,13 @@ class Document(models.Model):
         (SCREENSHOT_PNG, SCREENSHOT_PNG),
         (SCREENSHOT_JPG, SCREENSHOT_JPG),
     )
+    ARCHIVE_ROUTE = (
+        ("screenshot", "Screenshots"),
+        ("html", "HTML snapshot"),
+        ("download", "Download"),
+        ("www", "Text"),
+        ("words", "Words"),
+    )
     DISPLAY_QUEUE_SIZE = 10
 
     # Document info
@@ -132,6 +164,8 @@ class Document(models.Model):
     favicon = models.ForeignKey("FavIcon", null=True, blank=True, on_delete=models.SET_NULL)
     robotstxt_rejected = models.BooleanField(default=False, verbose_name="Rejected by robots.txt")
     has_html_snapshot = models.BooleanField(default=False)
+    # View of the archive, computed when the document is indexed
+    archive_route = models.CharField(max_length=10, choices=ARCHIVE_ROUTE, null=True, blank=True)
 
     # HTTP status
     redirect_url = models.TextField(null=True, blank=True)
@@ -140,8 +174,11 @@ class Document(models.Model):
     screenshot_count = models.PositiveIntegerField(default=0)
     screenshot_format = models.CharField(max_length=3, choices=SCREENSHOT_FORMAT)
     screenshot_size = models.CharField(max_length=16)
+    # Digests of the screenshots, empty for screenshots named after the url
+    screenshot_digests = models.JSONField(default=list, blank=True)
 
     has_thumbnail = models.BooleanField(default=False)
+    thumbnail_digest = models.CharField(max_length=64, null=True, blank=True)
 
     # Crawling info
     crawl_first = models.DateTimeField(blank=True, null=True, verbose_name="Crawled first")
@@ -189,24 +226,67 @@ class Document(models.Model):
     def __str__(self):
         return self.url
 
-    def get_absolute_url(self):
-        # Construct URL with collection prefix
-        url_arg = f"{self.collection.id}/{self.url}"
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        doc = super().from_db(db, field_names, values)
+        doc._search_values = doc._loaded_search_values()
+        return doc
+
+    def _loaded_search_values(self):
+        deferred = self.get_deferred_fields()
+        return {name: getattr(self, name) for name in SEARCH_FIELDS if name not in deferred}
+
+    def _search_fields_changed(self):
+        search_values = getattr(self, "_search_values", None)
+        if search_values is None:
+            return True
 
+        deferred = self.get_deferred_fields()
+        for name in SEARCH_FIELDS:
+            if name in deferred:
+                continue
+            # Deferred fields that were assigned are not part of the loaded values
+            if name not in search_values or search_values[name] != getattr(self, name):
+                return True
+        return False
+
+    def save(self, *args, **kwargs):
+        # Crawler bookkeeping (scheduling, workers, errors) does not change search results
+        search_changed = self._search_fields_changed()
+        super().save(*args, **kwargs)
+        if search_changed:
+            SearchCache.invalidate()
+        self._search_values = self._loaded_search_values()
+
+    def delete(self, *args, **kwargs):
+        res = super().delete(*args, **kwargs)
+        SearchCache.invalidate()
+        return res
+
+    def _archive_route(self):
         if self.screenshot_count or self.redirect_url:
-            return reverse_no_escape("screenshot", args=(url_arg,))
+            return "screenshot"
 
         if self.has_html_snapshot:
             asset = HTMLAsset.objects.filter(url=self.url).first()
-            if asset and os.path.exists(settings.SOSSE_HTML_SNAPSHOT_DIR + asset.filename):
+            if asset and html_asset_path(asset.filename):
                 if self.mimetype.startswith("text/"):
-                    return reverse_no_escape("html", args=(url_arg,))
+                    return "html"
                 else:
-                    return reverse_no_escape("download", args=(url_arg,))
+                    return "download"
+
+        # has_content is set by search results, which do not load the content
+        has_content = getattr(self, "has_content", None)
+        if has_content is None:
+            has_content = bool(self.content)
+        if has_content:
+            return "www"
+        return "words"
 
-        if self.content:
-            return reverse_no_escape("www", args=(url_arg,))
-        return reverse_no_escape("words", args=(url_arg,))
+    def get_absolute_url(self):
+        # Construct URL with collection prefix
+        url_arg = f"{self.collection_id}/{self.url}"
+        return reverse_no_escape(self.archive_route or self._archive_route(), args=(url_arg,))
 
     def get_source_link(self):
         link = '🌍&nbsp<a href="{}"'
@@ -226,6 +306,51 @@ class Document(models.Model):
             self._image_name = os.path.join(base_dir, filename)
         return self._image_name
 
+    def _screenshot_filenames(self):
+        if self.screenshot_digests:
+            return [
+                ImageBlob.blob_filename(SCREENSHOT_BLOB_DIR, digest, self.screenshot_format)
+                for digest in self.screenshot_digests
+            ]
+        # Screenshots taken before they were deduplicated
+        return [f"{self.image_name()}_{i}.{self.screenshot_format}" for i in range(self.screenshot_count)]
+
+    def screenshot_urls(self):
+        return [settings.SOSSE_SCREENSHOTS_URL + filename for filename in self._screenshot_filenames()]
+
+    def thumbnail_url(self):
+        if self.thumbnail_digest:
+            return settings.SOSSE_SCREENSHOTS_URL + ImageBlob.blob_filename(
+                THUMBNAIL_BLOB_DIR, self.thumbnail_digest, "jpg"
+            )
+        return f"{settings.SOSSE_THUMBNAILS_URL}{self.image_name()}.jpg"
+
+    def thumbnail_file(self):
+        if self.thumbnail_digest:
+            return settings.SOSSE_SCREENSHOTS_DIR + ImageBlob.blob_filename(
+                THUMBNAIL_BLOB_DIR, self.thumbnail_digest, "jpg"
+            )
+        return os.path.join(settings.SOSSE_THUMBNAILS_DIR, self.image_name()) + ".jpg"
+
+    def store_thumbnail(self):
+        """Moves the thumbnail written for the url to a file shared by the
+        documents having the same thumbnail."""
+        path = os.path.join(settings.SOSSE_THUMBNAILS_DIR, self.image_name()) + ".jpg"
+        if not os.path.exists(path):
+            return
+
+        prev_digest = self.thumbnail_digest
+        self.thumbnail_digest = ImageBlob.store(path, THUMBNAIL_BLOB_DIR, "jpg")
+        if prev_digest:
+            ImageBlob.remove_refs([ImageBlob.blob_filename(THUMBNAIL_BLOB_DIR, prev_digest, "jpg")])
+
+    def _store_screenshots(self):
+        d = os.path.join(settings.SOSSE_SCREENSHOTS_DIR, self.image_name())
+        self.screenshot_digests = [
+            ImageBlob.store(f"{d}_{i}.{self.screenshot_format}", SCREENSHOT_BLOB_DIR, self.screenshot_format)
+            for i in range(self.screenshot_count)
+        ]
+
     @classmethod
     def get_supported_langs(cls):
         if cls.supported_langs is not None:
@@ -305,6 +430,7 @@ class Document(models.Model):
         stats["prev"] = n
 
     def _clear_base_content(self):
+        self.archive_route = None
         self.redirect_url = None
         self.too_many_redirects = False
         self.content = ""
@@ -421,7 +547,7 @@ class Document(models.Model):
             self._schedule_next(False, self.collection)
 
             crawl_logger.debug(f"skipping {self.url} due to mimetype {self.mimetype}")
-            return
+            return False
 
         links = page.dom_walk(self.collection, False, None)
         self.content = links["text"]
@@ -452,7 +578,7 @@ class Document(models.Model):
             ):
                 Webhook.trigger(self.collection.webhooks.filter(trigger_condition__in=webhook_trigger_cond), self)
                 crawl_logger.debug(f"{self.url} has not changed, skipping indexing (content hash {self.content_hash})")
-                return
+                return False
         if current_hash != self.content_hash:
             self.modified_date = n
 
@@ -486,6 +612,9 @@ class Document(models.Model):
                 if DocumentMeta.preview_file_from_url(self.url, self.image_name()):
                     self.has_thumbnail = True
 
+        if self.has_thumbnail:
+            self.store_thumbnail()
+
         if self.mimetype.startswith("text/"):
             from .models import FavIcon
 
@@ -493,8 +622,7 @@ class Document(models.Model):
             self._index_log("favicon", stats, verbose)
 
             if self.collection.snapshot_html:
-                if self.collection.remove_nav_elements == Collection.REMOVE_NAV_FROM_ALL:
-                    page.remove_nav_elements()
+                # Navigation elements are removed by the snapshot, depending on the collection
                 snapshot = HTMLSnapshot(page, self.collection)
                 snapshot.snapshot()
                 self.has_html_snapshot = True
@@ -522,19 +650,30 @@ class Document(models.Model):
             self.title = self.url
 
         self.retries = 0
+        self.archive_route = self._archive_route()
+        return True
 
     def convert_to_jpg(self):
         d = os.path.join(settings.SOSSE_SCREENSHOTS_DIR, self.image_name())
+        filenames = self._screenshot_filenames()
 
-        for i in range(self.screenshot_count):
-            src = f"{d}_{i}.png"
+        for i, filename in enumerate(filenames):
+            src = settings.SOSSE_SCREENSHOTS_DIR + filename
             dst = f"{d}_{i}.jpg"
             crawl_logger.debug(f"Converting {src} to {dst}")
 
             img = Image.open(src)
             img = img.convert("RGB")  # Remove alpha channel from the png
-            img.save(dst, "jpeg")
-            os.unlink(src)
+            with StorageUsage.writing(StorageUsage.SCREENSHOTS, dst):
+                img.save(dst, "jpeg")
+            if not self.screenshot_digests:
+                StorageUsage.unlink(StorageUsage.SCREENSHOTS, src)
+
+        self.screenshot_format = Document.SCREENSHOT_JPG
+        if self.screenshot_digests:
+            # The png files may be shared with other documents
+            self._store_screenshots()
+            ImageBlob.remove_refs(filenames)
 
     def screenshot_index(self, links):
         from .collection import Collection
@@ -550,12 +689,14 @@ class Document(models.Model):
         img_count = browser.take_screenshots(self.collection, self.image_name())
         crawl_logger.debug(f"took {img_count} screenshots for {self.url} with {browser}")
         self.screenshot_count = img_count
-        self.screenshot_format = self.collection.screenshot_format
+        # Screenshots are taken as png files, converted below when required
+        self.screenshot_format = Document.SCREENSHOT_PNG
         w, h = browser.screen_size()
         self.screenshot_size = f"{w}x{h}"
 
         if self.collection.screenshot_format == Document.SCREENSHOT_JPG:
             self.convert_to_jpg()
+        self._store_screenshots()
 
         browser.scroll_to_page(0)
         for i, link in enumerate(links):
@@ -714,6 +855,7 @@ class Document(models.Model):
     @staticmethod
     def crawl(worker_no):
         from .models import Link, WorkerStats
+        from .saved_search import SavedSearch
 
         doc = Document.pick_queued(worker_no)
         if doc is None:
@@ -784,8 +926,10 @@ class Document(models.Model):
 
                     if page.url == doc.url:
                         doc.set_error("")
-                        doc.index(page)
+                        indexed = doc.index(page)
                         doc.save()
+                        if indexed:
+                            SavedSearch.percolate(doc)
                         Link.objects.filter(extern_url=doc.url).update(extern_url=None, doc_to=doc)
                         break
                     else:
@@ -953,22 +1097,32 @@ class Document(models.Model):
                 for asset in HTMLAsset.objects.filter(url=self.url):
                     asset.remove_ref()
             self.has_html_snapshot = False
+            self.archive_route = None
 
     def delete_screenshot(self):
         if self.screenshot_count:
-            d = os.path.join(settings.SOSSE_SCREENSHOTS_DIR, self.image_name())
+            if self.screenshot_digests:
+                ImageBlob.remove_refs(self._screenshot_filenames())
+                self.screenshot_digests = []
+            else:
+                d = os.path.join(settings.SOSSE_SCREENSHOTS_DIR, self.image_name())
 
-            for i in range(self.screenshot_count):
-                filename = f"{d}_{i}.{self.screenshot_format}"
-                if os.path.exists(filename):
-                    os.unlink(filename)
+                for i in range(self.screenshot_count):
+                    filename = f"{d}_{i}.{self.screenshot_format}"
+                    if os.path.exists(filename):
+                        StorageUsage.unlink(StorageUsage.SCREENSHOTS, filename)
             self.screenshot_count = 0
+            self.archive_route = None
 
     def delete_thumbnail(self):
         if self.has_thumbnail:
-            f = os.path.join(settings.SOSSE_THUMBNAILS_DIR, self.image_name()) + ".jpg"
-            if os.path.exists(f):
-                os.unlink(f)
+            if self.thumbnail_digest:
+                ImageBlob.remove_refs([ImageBlob.blob_filename(THUMBNAIL_BLOB_DIR, self.thumbnail_digest, "jpg")])
+                self.thumbnail_digest = None
+            else:
+                f = os.path.join(settings.SOSSE_THUMBNAILS_DIR, self.image_name()) + ".jpg"
+                if os.path.exists(f):
+                    StorageUsage.unlink(StorageUsage.SCREENSHOTS, f)
             self.has_thumbnail = False
 
     def delete_all(self):
@@ -993,8 +1147,12 @@ class Document(models.Model):
         if self.has_html_snapshot:
             asset = HTMLAsset.objects.filter(url=self.url).first()
             if asset:
-                asset_path = settings.SOSSE_HTML_SNAPSHOT_DIR + asset.filename
-                if os.path.exists(asset_path):
-                    return asset_path
+                return html_asset_path(asset.filename)
 
         return None
+
+
+@receiver(m2m_changed, sender=Document.tags.through)
+def document_tags_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        SearchCache.invalidate()
@@ -24,6 +24,7 @@ from PIL import Image, UnidentifiedImageError
 
 from .browser_request import BrowserRequest
 from .page import Page
+from .storage_usage import StorageUsage
 from .url import absolutize_url
 
 
@@ -88,7 +89,8 @@ class DocumentMeta:
                 # Remove alpha channel from the png
                 img = img.convert("RGB")
                 img.thumbnail((160, 100))
-                img.save(thumb_jpg, "jpeg")
+                with StorageUsage.writing(StorageUsage.SCREENSHOTS, thumb_jpg):
+                    img.save(thumb_jpg, "jpeg")
         except UnidentifiedImageError:
             return
 
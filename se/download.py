@@ -13,14 +13,13 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
-import os
 from urllib.parse import unquote
 
 from django.conf import settings
 from django.views.generic import TemplateView
 
 from .archive import ArchiveMixin
-from .html_asset import HTMLAsset
+from .html_asset import HTMLAsset, html_asset_path, html_asset_size
 from .utils import mimetype_icon
 from .views import RedirectException
 
@@ -33,11 +32,10 @@ class DownloadView(ArchiveMixin, TemplateView):
         url = self._url_from_request()
         asset = HTMLAsset.objects.filter(url=url).order_by("download_date").last()
 
-        if not asset or not os.path.exists(settings.SOSSE_HTML_SNAPSHOT_DIR + asset.filename):
+        asset_path = asset and html_asset_path(asset.filename)
+        if not asset_path:
             raise RedirectException(self.doc.get_absolute_url())
 
-        asset_path = settings.SOSSE_HTML_SNAPSHOT_DIR + asset.filename
-
         filename = url.rstrip("/").rsplit("/", 1)[1]
         filename = unquote(filename)
         if "." in filename:
@@ -50,7 +48,7 @@ class DownloadView(ArchiveMixin, TemplateView):
         return context | {
             "url": self.request.build_absolute_uri(settings.SOSSE_HTML_SNAPSHOT_URL) + asset.filename,
             "filename": filename,
-            "filesize": os.path.getsize(asset_path),
+            "filesize": html_asset_size(asset_path),
             "icon": mimetype_icon(self.doc.mimetype),
             "mimebase": self.doc.mimetype.split("/", 1)[0],
         }
@@ -13,14 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
-import os
-
 from django.conf import settings
 from django.views.generic import TemplateView
 
 from .archive import ArchiveMixin
 from .collection import Collection
-from .html_asset import HTMLAsset
+from .html_asset import HTMLAsset, html_asset_path
 from .views import RedirectException, UserView
 
 
@@ -35,7 +33,7 @@ class HTMLView(ArchiveMixin, TemplateView):
         url = self._url_from_request()
         asset = HTMLAsset.objects.filter(url=url).order_by("download_date").last()
 
-        if not asset or not os.path.exists(settings.SOSSE_HTML_SNAPSHOT_DIR + asset.filename):
+        if not asset or not html_asset_path(asset.filename):
             raise RedirectException(self.doc.get_absolute_url())
 
         context = super().get_context_data()
@@ -13,28 +13,63 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import gzip
 import logging
 import os
 from datetime import timedelta
 
 from bs4 import BeautifulSoup
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
+from .html_pack import HTMLPack
+from .storage_usage import StorageUsage
 from .url import sanitize_url
 from .utils import http_date_parser
 
 logger = logging.getLogger("html_snapshot")
 
 
-def remove_html_asset_file(fn):
+def html_asset_path(filename):
+    """Returns the path of an archived file, with a ``.gz`` suffix when it is
+    compressed, or None when it does not exist."""
+    fn = settings.SOSSE_HTML_SNAPSHOT_DIR + filename
+    for path in (fn, fn + ".gz"):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def html_asset_size(path):
+    """Returns the size of the content of the archived file ``path``, the
+    uncompressed size when it is a ``.gz`` file."""
+    if not path.endswith(".gz"):
+        return os.path.getsize(path)
+
+    # The gzip trailer ends with the size of the content modulo 2^32
+    with open(path, "rb") as fd:
+        fd.seek(-4, os.SEEK_END)
+        return int.from_bytes(fd.read(4), "little")
+
+
+def read_html_asset(filename):
+    fn = settings.SOSSE_HTML_SNAPSHOT_DIR + filename
     try:
-        logger.debug(f"deleting {fn}")
-        os.unlink(fn)
-    except OSError:
-        # should not happen
-        pass
+        with open(fn, "rb") as fd:
+            return fd.read()
+    except FileNotFoundError:
+        with gzip.open(fn + ".gz", "rb") as fd:
+            return fd.read()
+
+
+def remove_html_asset_file(fn):
+    logger.debug(f"deleting {fn}")
+    for path in (fn, fn + ".gz"):
+        try:
+            StorageUsage.unlink(StorageUsage.HTML, path)
+        except OSError:
+            pass
     try:
         dn = os.path.dirname(fn)
         logger.debug(f"rmdir start {dn}")
@@ -47,29 +82,88 @@ def remove_html_asset_file(fn):
         pass
 
 
+class HTMLBlob(models.Model):
+    """A file of the HTML archive, shared by all the urls having the same
+    content."""
+
+    filename = models.TextField(unique=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    ref_count = models.PositiveBigIntegerField(default=0)
+    # Location of the content when it is stored in a pack file
+    pack_segment = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    pack_offset = models.PositiveBigIntegerField(null=True, blank=True)
+    pack_length = models.PositiveIntegerField(null=True, blank=True)
+    mimetype = models.CharField(max_length=128, null=True, blank=True)
+
+    @staticmethod
+    def from_content(content_hash, extension):
+        """Returns the blob storing a content with the same hash and
+        extension, if any."""
+        return HTMLBlob.objects.filter(content_hash=content_hash, filename__endswith=extension).first()
+
+
 class HTMLAsset(models.Model):
     url = models.TextField()
     filename = models.TextField()
-    ref_count = models.PositiveBigIntegerField(default=0)
+    blob = models.ForeignKey(HTMLBlob, on_delete=models.CASCADE, null=True, blank=True)
     download_date = models.DateTimeField(blank=True, null=True)
     last_modified = models.DateTimeField(blank=True, null=True)
     max_age = models.PositiveBigIntegerField(blank=True, null=True)
     has_cache_control = models.BooleanField(default=False)
     etag = models.CharField(max_length=128, null=True, blank=True)
+    # Filenames of the assets referenced by an HTML snapshot
+    manifest = models.JSONField(null=True, blank=True)
+    # Filenames of the assets referenced by a stylesheet, the references are held by the snapshots
+    nested = models.JSONField(null=True, blank=True)
 
     class Meta:
         unique_together = (("url", "filename"),)
 
-    def init_ref_count(self):
-        # TODO: fix the race condition below
-        max_ref_count = HTMLAsset.objects.filter(filename=self.filename).aggregate(models.Max("ref_count"))
-        max_ref_count = max_ref_count.get("ref_count__max") or 0
-        HTMLAsset.objects.filter(id=self.id).update(ref_count=max_ref_count)
+    @property
+    def ref_count(self):
+        if self.blob is None:
+            return 0
+        return self.blob.ref_count
+
+    def init_ref_count(self, content_hash=None):
+        # The blob is shared with other urls pointing to the same file
+        self.blob, _ = HTMLBlob.objects.get_or_create(filename=self.filename, defaults={"content_hash": content_hash})
+        HTMLAsset.objects.filter(id=self.id).update(blob=self.blob)
         logger.debug(f"refcount initialized for {self.url}")
 
     def increment_ref(self):
-        count = HTMLAsset.objects.filter(filename=self.filename).update(ref_count=models.F("ref_count") + 1)
+        """Takes a reference on the file of the asset, returns False when the
+        file has been removed by another worker."""
+        count = HTMLBlob.objects.filter(filename=self.filename).update(ref_count=models.F("ref_count") + 1)
         logger.debug(f"{count} refcount incremented for {self.filename}")
+        return count > 0
+
+    @staticmethod
+    def increment_refs(filenames):
+        """Takes references on files, ``filenames`` maps a filename to the
+        number of references to add. Returns the filenames that have been
+        removed by another worker."""
+        if not filenames:
+            return set()
+
+        with transaction.atomic():
+            # Lock the blobs so that a concurrent removal cannot delete them before the update
+            found = set(
+                HTMLBlob.objects.select_for_update()
+                .filter(filename__in=filenames.keys())
+                .order_by("id")
+                .values_list("filename", flat=True)
+            )
+
+            by_count = {}
+            for filename in found:
+                by_count.setdefault(filenames[filename], []).append(filename)
+
+            for count, _filenames in by_count.items():
+                HTMLBlob.objects.filter(filename__in=_filenames).update(ref_count=models.F("ref_count") + count)
+
+        logger.debug(f"refcount incremented for {len(found)} files")
+        return set(filenames.keys()) - found
 
     def update_values(self, **kwargs):
         HTMLAsset.objects.filter(id=self.id).update(**kwargs)
@@ -81,36 +175,71 @@ class HTMLAsset(models.Model):
             asset.html_delete()
 
     def html_delete(self):
-        fn = settings.SOSSE_HTML_SNAPSHOT_DIR + self.filename
-        try:
-            content = open(fn, "rb").read()
-            assets = HTMLAsset.html_extract_assets(content)
-            for asset in assets:
-                HTMLAsset.remove_file_ref(asset)
-        except OSError:
-            pass
+        if self.manifest is not None:
+            HTMLAsset.remove_file_refs(self.manifest)
+        else:
+            # Snapshots made before manifests were recorded
+            try:
+                content = read_html_asset(self.filename)
+                HTMLAsset.remove_file_refs(HTMLAsset.html_extract_assets(content))
+            except OSError:
+                pass
 
         self.remove_ref()
 
     def remove_ref(self):
-        # TODO: fix the race condition below
         logger.debug(f"removing ref on url {self.url}")
         HTMLAsset.remove_file_ref(self.filename)
 
     @staticmethod
     def remove_file_ref(filename):
-        logger.debug(f"removing ref on {filename}")
-        # TODO: fix the race condition below
-        HTMLAsset.objects.filter(filename=filename, ref_count__gt=0).update(ref_count=models.F("ref_count") - 1)
-        refs_count = HTMLAsset.objects.filter(filename=filename).aggregate(models.Sum("ref_count"))
-        refs_count = refs_count.get("ref_count__sum")
-
-        # refs_count is None when HTMLAsset.objects.filter(...) returns an empty set
-        if refs_count is None or refs_count <= 0:
-            logger.debug(f"removing file {filename}")
-            remove_html_asset_file(settings.SOSSE_HTML_SNAPSHOT_DIR + filename)
+        HTMLAsset.remove_file_refs([filename])
 
-        HTMLAsset.objects.filter(filename=filename, ref_count=0).delete()
+    @staticmethod
+    def remove_file_refs(filenames):
+        """Removes one reference for each item of ``filenames``, a filename
+        appearing multiple times loses as many references."""
+        counts = {}
+        for filename in filenames:
+            counts[filename] = counts.get(filename, 0) + 1
+        if not counts:
+            return
+
+        logger.debug(f"removing refs on {len(counts)} files")
+        with transaction.atomic():
+            # Lock the blobs so that concurrent workers see the decrement and the deletion at once,
+            # rows are locked in a consistent order to prevent deadlocks
+            blobs = HTMLBlob.objects.select_for_update().filter(filename__in=counts.keys()).order_by("id")
+
+            by_count = {}
+            to_delete = set(counts.keys())
+            packed = {}
+            for blob in blobs:
+                count = counts[blob.filename]
+                if blob.ref_count > count:
+                    by_count.setdefault(count, []).append(blob.id)
+                    to_delete.remove(blob.filename)
+                elif blob.pack_segment is not None:
+                    packed[blob.filename] = blob.pack_segment
+
+            for count, ids in by_count.items():
+                HTMLBlob.objects.filter(id__in=ids).update(ref_count=models.F("ref_count") - count)
+
+            if not to_delete:
+                return
+
+            # Urls pointing to the files are removed by the cascade
+            HTMLBlob.objects.filter(filename__in=to_delete).delete()
+            HTMLAsset.objects.filter(filename__in=to_delete).delete()
+
+            # Files are removed before the lock is released, so that a worker
+            # writing the same file waits for the removal to be done
+            for filename in sorted(to_delete - packed.keys()):
+                logger.debug(f"removing file {filename}")
+                remove_html_asset_file(settings.SOSSE_HTML_SNAPSHOT_DIR + filename)
+
+            if packed:
+                HTMLPack.remove_unused_segments(set(packed.values()))
 
     @staticmethod
     def html_extract_assets(content):
@@ -151,8 +280,8 @@ class HTMLAsset(models.Model):
                     assets.add(filename)
 
                     if url.endswith(".css"):
-                        filename = settings.SOSSE_HTML_SNAPSHOT_DIR + filename
-                        assets |= css_parser().css_extract_assets(open(filename, encoding="utf-8").read(), False)
+                        css = read_html_asset(filename).decode("utf-8")
+                        assets |= css_parser().css_extract_assets(css, False)
 
         return assets
 
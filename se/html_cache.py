@@ -13,18 +13,22 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import gzip
 import logging
 import os
 from datetime import timedelta
-from hashlib import md5
-from mimetypes import guess_extension
+from hashlib import md5, sha256
+from mimetypes import guess_extension, guess_type
 from urllib.parse import quote, unquote_plus
 
 from django.conf import settings
+from django.db import models, transaction
 from django.utils import timezone
 
 from .browser_request import BrowserRequest
-from .html_asset import HTMLAsset
+from .html_asset import HTMLAsset, HTMLBlob
+from .html_pack import HTMLPack
+from .storage_usage import StorageUsage
 from .url import sanitize_url
 from .utils import http_date_format
 
@@ -33,6 +37,7 @@ logger = logging.getLogger("html_snapshot")
 # https://developer.mozilla.org/en-US/docs/Web/HTTP/Caching#heuristic_caching
 HEURISTIC_CACHE_THRESHOLD_PERCENT = 10
 HTML_SNAPSHOT_HASH_LEN = 10
+GZIP_EXTENSIONS = (".css", ".htm", ".html", ".js", ".json", ".svg", ".txt", ".xml")
 
 
 def max_filename_size():
@@ -115,8 +120,21 @@ class HTMLCache:
                 raise CacheMiss()
 
     @staticmethod
-    def _cache_check(url, collection, referer, max_file_size):
-        asset = HTMLAsset.objects.filter(url=url).order_by("download_date").last()
+    def cache_entries(urls):
+        """Returns the cache entry of each url in ``urls``, in a single query.
+        Urls that are not cached are mapped to ``None``."""
+        entries = dict.fromkeys(urls)
+        for asset in HTMLAsset.objects.filter(url__in=entries.keys()).order_by("download_date"):
+            # Keep the last one, as ``_cache_check`` does
+            entries[asset.url] = asset
+        return entries
+
+    @staticmethod
+    def _cache_check(url, collection, referer, max_file_size, cache_entries=None):
+        if cache_entries is not None and url in cache_entries:
+            asset = cache_entries[url]
+        else:
+            asset = HTMLAsset.objects.filter(url=url).order_by("download_date").last()
 
         if not asset:
             logger.debug("cache miss, asset does not exist")
@@ -132,17 +150,22 @@ class HTMLCache:
         raise CacheMiss()
 
     @staticmethod
-    def download(url, collection, referer, max_file_size):
+    def fetch(url, collection, referer, max_file_size, cache_entries=None):
+        """Same as ``download()``, without taking a reference on the cached
+        asset on cache hits. ``cache_entries`` may hold entries preloaded with
+        ``cache_entries()``."""
         try:
-            HTMLCache._cache_check(url, collection, referer, max_file_size)
-        except CacheHit as e:
-            e.asset.increment_ref()
-            raise
+            HTMLCache._cache_check(url, collection, referer, max_file_size, cache_entries)
         except CacheRefresh as e:
             return e.page
         except CacheMiss:
             pass
 
+        return HTMLCache.request(url, collection, referer, max_file_size)
+
+    @staticmethod
+    def request(url, collection, referer, max_file_size):
+        """Downloads ``url`` without looking up the cache."""
         page = BrowserRequest.get(
             url,
             collection,
@@ -156,21 +179,61 @@ class HTMLCache:
         return page
 
     @staticmethod
-    def create_cache_entry(url, filename, page=None):
-        asset, created = HTMLAsset.objects.get_or_create(url=url, filename=filename)
-
-        if created:
-            asset.init_ref_count()
+    def download(url, collection, referer, max_file_size):
+        try:
+            return HTMLCache.fetch(url, collection, referer, max_file_size)
+        except CacheHit as e:
+            if e.asset.increment_ref():
+                raise
+        logger.debug(f"cache entry of {url} removed after the cache hit")
+        return HTMLCache.request(url, collection, referer, max_file_size)
 
-        asset.increment_ref()
+    @staticmethod
+    def create_cache_entry(url, filename, page=None, content_hash=None, manifest=None, nested=None):
+        with transaction.atomic():
+            # The blob is locked so that it cannot be removed by another worker before the reference is
+            # taken, it is created again when it was removed since the file was looked up
+            blob, _ = HTMLBlob.objects.select_for_update().get_or_create(
+                filename=filename, defaults={"content_hash": content_hash}
+            )
+            asset, _ = HTMLAsset.objects.get_or_create(url=url, filename=filename)
+            if asset.blob_id != blob.id:
+                HTMLAsset.objects.filter(id=asset.id).update(blob=blob)
+            HTMLBlob.objects.filter(id=blob.id).update(ref_count=models.F("ref_count") + 1)
+            asset.blob = blob
 
         if page:
             asset.update_from_page(page)
 
+        if manifest is not None:
+            asset.update_values(manifest=manifest)
+
+        if nested is not None:
+            asset.update_values(nested=nested)
+            asset.nested = nested
+
         return asset
 
     @staticmethod
-    def write_asset(url, content, page, extension=None, mimetype=None):
+    def write_asset(
+        url,
+        content,
+        page,
+        extension=None,
+        mimetype=None,
+        content_addressed=False,
+        manifest=None,
+        filename=None,
+        nested=None,
+    ):
+        """Writes ``content`` in the archive and returns its cache entry.
+
+        When ``content_addressed`` is set, a file having the same content
+        is reused instead of writing a new one. ``manifest`` lists the
+        files referenced by an HTML snapshot, ``nested`` the ones referenced
+        by a stylesheet. ``filename`` forces the name of the file, so that
+        references already pointing to it stay valid.
+        """
         if not isinstance(content, bytes):
             raise ValueError("content must be bytes")
 
@@ -194,16 +257,52 @@ class HTMLCache:
                     extension = f".{ext}"
 
         url = sanitize_url(url)
-        filename_url = HTMLCache.html_filename(url, _hash, extension)
+        blob = None
+        content_hash = None
+        if content_addressed:
+            content_hash = sha256(content).hexdigest()
+            if filename is None:
+                blob = HTMLBlob.from_content(content_hash, extension)
+
+        if filename is not None:
+            filename_url = filename
+        elif blob is None:
+            filename_url = HTMLCache.html_filename(url, _hash, extension)
+        else:
+            logger.debug(f"{url} has the same content as {blob.filename}")
+            filename_url = blob.filename
+
+        # The reference is taken before writing, so that the file cannot be removed by another worker
+        asset = HTMLCache.create_cache_entry(url, filename_url, page, content_hash, manifest, nested)
+
         dest = os.path.join(settings.SOSSE_HTML_SNAPSHOT_DIR, filename_url)
-        if not os.path.isfile(dest):
+        exists = os.path.isfile(dest) or os.path.isfile(dest + ".gz")
+        if content_addressed and HTMLPack.should_pack(content):
+            if asset.blob.pack_segment is None and not exists:
+
+                def _record(segment, offset):
+                    # When another worker packed the same content first, the bytes appended are left unused
+                    HTMLBlob.objects.filter(id=asset.blob_id, pack_segment__isnull=True).update(
+                        pack_segment=segment,
+                        pack_offset=offset,
+                        pack_length=len(content),
+                        mimetype=guess_type(filename_url)[0] or mimetype or "application/octet-stream",
+                    )
+
+                HTMLPack.append(content, _record)
+        elif not exists:
             dest_dir, _ = dest.rsplit("/", 1)
             os.makedirs(dest_dir, 0o755, exist_ok=True)
 
-            with open(dest, "wb") as fd:
-                fd.write(content)
+            if settings.SOSSE_HTML_GZIP and dest.endswith(GZIP_EXTENSIONS):
+                # Served by the web server with gzip_static
+                with StorageUsage.writing(StorageUsage.HTML, dest + ".gz"), gzip.open(dest + ".gz", "wb") as fd:
+                    fd.write(content)
+            else:
+                with StorageUsage.writing(StorageUsage.HTML, dest), open(dest, "wb") as fd:
+                    fd.write(content)
 
-        return HTMLCache.create_cache_entry(url, filename_url, page)
+        return asset
 
     @staticmethod
     def html_filename(url, _hash, extension):
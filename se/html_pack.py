@@ -0,0 +1,243 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import fcntl
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.db import models
+from django.http import Http404, HttpResponse
+from django.views.generic import View
+
+from .storage_usage import StorageUsage
+
+logger = logging.getLogger("html_snapshot")
+
+# Urls of the archive start with their scheme, so the directory cannot clash with them
+PACK_DIR = ".packs/"
+RANGE_RE = re.compile(r"^bytes=([0-9]*)-([0-9]*)$")
+
+
+class HTMLPack:
+    """Stores small assets of the HTML archive in append-only pack files.
+
+    The location of an asset (pack file number, offset, length and
+    mimetype) is recorded on its ``HTMLBlob``."""
+
+    @staticmethod
+    def should_pack(content):
+        return settings.SOSSE_HTML_PACK_MAX_SIZE > 0 and len(content) <= settings.SOSSE_HTML_PACK_MAX_SIZE
+
+    @staticmethod
+    def segment_path(segment):
+        return os.path.join(settings.SOSSE_HTML_SNAPSHOT_DIR, PACK_DIR, f"{segment:08d}.pack")
+
+    @staticmethod
+    def segments():
+        try:
+            filenames = os.listdir(os.path.join(settings.SOSSE_HTML_SNAPSHOT_DIR, PACK_DIR))
+        except FileNotFoundError:
+            return []
+        return sorted(int(fn[:-5]) for fn in filenames if fn.endswith(".pack") and fn[:-5].isdigit())
+
+    @staticmethod
+    def _is_full(size):
+        return size >= settings.SOSSE_HTML_PACK_SEGMENT_SIZE * 1024 * 1024
+
+    @staticmethod
+    def current_segment():
+        """Returns the pack file receiving new assets, other pack files are
+        never written to."""
+        segments = HTMLPack.segments()
+        if not segments:
+            return 1
+        last = segments[-1]
+        if HTMLPack._is_full(os.path.getsize(HTMLPack.segment_path(last))):
+            return last + 1
+        return last
+
+    @staticmethod
+    def _removed(fd, path):
+        # The pack file was deleted after it was opened
+        try:
+            return os.fstat(fd.fileno()).st_ino != os.stat(path).st_ino
+        except FileNotFoundError:
+            return True
+
+    @staticmethod
+    def append(content, record=None):
+        """Appends ``content`` to the current pack file, returns the pack file
+        number and the offset of the content.
+
+        ``record`` is called with the pack file number and the offset before
+        the lock of the pack file is released, so that the location of the
+        content is saved before the pack file can be seen as unused."""
+        os.makedirs(os.path.join(settings.SOSSE_HTML_SNAPSHOT_DIR, PACK_DIR), 0o755, exist_ok=True)
+        while True:
+            segment = HTMLPack.current_segment()
+            path = HTMLPack.segment_path(segment)
+            with open(path, "ab") as fd:
+                # The lock is shared with the other crawlers appending to the same file
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                offset = fd.seek(0, os.SEEK_END)
+                if offset and HTMLPack._is_full(offset):
+                    # Filled by another crawler in the meantime
+                    continue
+                if HTMLPack._removed(fd, path):
+                    continue
+                fd.write(content)
+                fd.flush()
+                StorageUsage.add(StorageUsage.HTML, len(content))
+                logger.debug(f"{len(content)} bytes packed in {segment} at {offset}")
+                if record:
+                    record(segment, offset)
+                return segment, offset
+
+    @staticmethod
+    def read(blob, start=0, length=None):
+        if length is None:
+            length = blob.pack_length - start
+        with open(HTMLPack.segment_path(blob.pack_segment), "rb") as fd:
+            fd.seek(blob.pack_offset + start)
+            return fd.read(length)
+
+    @staticmethod
+    def remove_unused_segments(segments):
+        """Deletes the pack files of ``segments`` that do not hold any asset
+        anymore."""
+        from .html_asset import HTMLBlob
+
+        current = HTMLPack.current_segment()
+        used = set(HTMLBlob.objects.filter(pack_segment__in=segments).values_list("pack_segment", flat=True).distinct())
+        for segment in sorted(set(segments) - used - {current}):
+            path = HTMLPack.segment_path(segment)
+            try:
+                with open(path, "rb") as fd:
+                    # Content appended but not recorded yet is seen under the lock. The lock is not waited for,
+                    # since the caller may hold locks on blobs the appending worker is about to update: a pack
+                    # file still being written is left to compact()
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    if HTMLPack._removed(fd, path) or HTMLBlob.objects.filter(pack_segment=segment).exists():
+                        continue
+                    logger.debug(f"removing pack file {segment}")
+                    StorageUsage.unlink(StorageUsage.HTML, path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def compact(min_unused_ratio, dry_run=False):
+        """Rewrites the assets of pack files having more than
+        ``min_unused_ratio`` of unused bytes to the current pack file, and
+        deletes them.
+
+        Returns the number of bytes reclaimed."""
+        from .html_asset import HTMLBlob
+
+        reclaimed = 0
+        current = HTMLPack.current_segment()
+        for segment in HTMLPack.segments():
+            if segment >= current:
+                continue
+
+            path = HTMLPack.segment_path(segment)
+            try:
+                fd = open(path, "rb")
+            except FileNotFoundError:
+                continue
+
+            with fd:
+                # Wait for a worker still recording content it appended
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if HTMLPack._removed(fd, path):
+                    continue
+
+                size = os.fstat(fd.fileno()).st_size
+                used = (
+                    HTMLBlob.objects.filter(pack_segment=segment).aggregate(used=models.Sum("pack_length"))["used"] or 0
+                )
+                if size == 0 or (size - used) / size < min_unused_ratio:
+                    continue
+
+                logger.info(f"compacting pack file {segment}, {size - used} / {size} bytes unused")
+                reclaimed += size - used
+                if dry_run:
+                    continue
+
+                for blob in HTMLBlob.objects.filter(pack_segment=segment).order_by("pack_offset").iterator():
+
+                    def _move(new_segment, new_offset, blob=blob):
+                        # Blobs removed while compacting are not moved
+                        HTMLBlob.objects.filter(id=blob.id, pack_segment=blob.pack_segment).update(
+                            pack_segment=new_segment, pack_offset=new_offset
+                        )
+
+                    HTMLPack.append(HTMLPack.read(blob), _move)
+                StorageUsage.unlink(StorageUsage.HTML, path)
+        return reclaimed
+
+    @staticmethod
+    def response(request, blob):
+        """Builds the response serving ``blob``, a single byte range can be
+        requested."""
+        start = 0
+        end = blob.pack_length - 1
+        status = 200
+
+        match = RANGE_RE.match(request.headers.get("Range", "").replace(" ", ""))
+        if match and (match[1] or match[2]):
+            if match[1]:
+                start = int(match[1])
+                if match[2]:
+                    end = min(int(match[2]), end)
+            else:
+                start = max(blob.pack_length - int(match[2]), 0)
+
+            if start > end:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{blob.pack_length}"
+                return response
+            status = 206
+
+        response = HttpResponse(HTMLPack.read(blob, start, end - start + 1), content_type=blob.mimetype, status=status)
+        response["Accept-Ranges"] = "bytes"
+        if status == 206:
+            response["Content-Range"] = f"bytes {start}-{end}/{blob.pack_length}"
+        if blob.content_hash:
+            response["ETag"] = f'"{blob.content_hash}"'
+        return response
+
+
+class HTMLPackView(View):
+    """Serves the assets stored in pack files, other files of the archive
+    are served by the web server."""
+
+    def get(self, request, filename):
+        from .html_asset import HTMLBlob
+
+        for _ in range(2):
+            blob = HTMLBlob.objects.filter(filename=filename, pack_segment__isnull=False).first()
+            if blob is None:
+                break
+            try:
+                return HTMLPack.response(request, blob)
+            except FileNotFoundError:
+                # The pack file was compacted meanwhile
+                continue
+        raise Http404()
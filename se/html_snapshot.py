@@ -15,28 +15,97 @@
 
 import logging
 import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from traceback import format_exc
+from urllib.parse import urlparse
 
 import cssutils
 from bs4 import NavigableString
 from django.conf import settings
+from django.db import connection
 from django.shortcuts import reverse
 from django.utils.html import format_html
 
 from .browser import SkipIndexing
+from .html_asset import HTMLAsset
 from .html_cache import CacheHit, HTMLCache
+from .page import NAV_ELEMENTS, Page
 from .url import absolutize_url, has_browsable_scheme
 
 logger = logging.getLogger("html_snapshot")
 
 
+# Attributes that may reference assets
+ASSET_ATTRS = ("style", "srcset", "src", "href")
+
+# Comments and strings are matched so that ``url(`` inside them is not rewritten
+CSS_TOKEN_RE = re.compile(
+    r"""
+    /\*.*?(?:\*/|\Z)
+    |@import\s*(?P<import_quote>["'])(?P<import>(?:\\.|(?!(?P=import_quote))[^\\])*)(?P=import_quote)
+    |url\(\s*(?:
+        (?P<quote>["'])(?P<quoted>(?:\\.|(?!(?P=quote))[^\\])*)(?P=quote)
+        |(?P<unquoted>(?:\\[0-9a-fA-F]{1,6}[ \t\n\r\f]?|\\.|[^)\s"'\\])*)
+    )\s*\)
+    |"(?:\\.|[^"\\])*"
+    |'(?:\\.|[^'\\])*'
+    """,
+    re.VERBOSE | re.DOTALL | re.IGNORECASE,
+)
+CSS_ESCAPE_RE = re.compile(r"\\(?:([0-9a-fA-F]{1,6})[ \t\n\r\f]?|(.))", re.DOTALL)
+
+
 def css_parser():
     if settings.SOSSE_CSS_PARSER == "internal":
         return InternalCSSParser
+    elif settings.SOSSE_CSS_PARSER == "stream":
+        return StreamCSSParser
     else:
         return CSSUtilsParser
 
 
+def _css_unescape_char(match):
+    if match[1]:
+        codepoint = int(match[1], 16)
+        if codepoint == 0 or codepoint > 0x10FFFF or 0xD800 <= codepoint <= 0xDFFF:
+            return "\ufffd"
+        return chr(codepoint)
+    if match[2] == "\n":
+        # Escaped newlines are line continuations
+        return ""
+    return match[2]
+
+
+def stream_css_url(css):
+    """Same as ``extract_css_url``, urls of ``@import`` rules are also
+    extracted, and ``url()`` inside comments and strings are ignored."""
+    prev = 0
+    for match in CSS_TOKEN_RE.finditer(css):
+        if match["import"] is not None:
+            url = match["import"]
+        elif match["quoted"] is not None:
+            url = match["quoted"]
+        elif match["unquoted"] is not None:
+            url = match["unquoted"]
+        else:
+            # comment or string
+            continue
+
+        url = CSS_ESCAPE_RE.sub(_css_unescape_char, url)
+        if not url or not has_browsable_scheme(url):
+            continue
+
+        if match.start() > prev:
+            yield False, css[prev : match.start()]
+        if match["import"] is not None:
+            yield False, "@import "
+        yield True, url
+        prev = match.end()
+
+    yield False, css[prev:]
+
+
 def extract_css_url(css):
     prev = 0
     current = 0
@@ -117,6 +186,12 @@ class InternalCSSParser:
 
         return css
 
+    @staticmethod
+    def css_urls(content, _):
+        for is_url, segment in extract_css_url(content):
+            if is_url:
+                yield segment
+
     @staticmethod
     def css_extract_assets(content, _):
         assets = set()
@@ -128,6 +203,50 @@ class InternalCSSParser:
         return assets
 
 
+class StreamCSSParser:
+    @staticmethod
+    def handle_css(snapshot, base_url, content, inline_css):
+        if inline_css:
+            if not isinstance(content, str):
+                raise ValueError(f"content is not str: {content.__class__.__name__}")
+        else:
+            if not isinstance(content, (bytes, NavigableString)):
+                raise ValueError(f"content is not bytes or NavigableString: {content.__class__.__name__}")
+            if isinstance(content, bytes):
+                content = content.decode("utf-8")
+
+        css = []
+        for is_url, segment in stream_css_url(content):
+            if is_url:
+                url = absolutize_url(base_url, segment)
+                force_mime = None
+                if url.endswith(".css"):
+                    # Force the mime since because libmagic sometimes fails to identify it correctly
+                    force_mime = "text/css"
+                url = snapshot.download_asset(url, base_url, force_mime)
+                css.append(f'url("{url}")')
+            else:
+                css.append(segment)
+
+        return "".join(css)
+
+    @staticmethod
+    def css_urls(content, _):
+        for is_url, segment in stream_css_url(content):
+            if is_url:
+                yield segment
+
+    @staticmethod
+    def css_extract_assets(content, _):
+        assets = set()
+
+        for is_url, segment in stream_css_url(content):
+            if is_url and segment.startswith(settings.SOSSE_HTML_SNAPSHOT_URL):
+                assets.add(segment[len(settings.SOSSE_HTML_SNAPSHOT_URL) :])
+
+        return assets
+
+
 class CSSUtilsParser:
     @staticmethod
     def css_declarations(content, inline_css):
@@ -172,6 +291,14 @@ class CSSUtilsParser:
             raise ValueError(f"css is not str: {css.__class__.__name__}")
         return css
 
+    @staticmethod
+    def css_urls(content, inline_css):
+        declarations, _ = CSSUtilsParser.css_declarations(content, inline_css)
+        for prop in declarations:
+            for is_url, segment in extract_css_url(prop.value):
+                if is_url:
+                    yield segment
+
     @staticmethod
     def css_extract_assets(content, inline_css):
         assets = set()
@@ -190,13 +317,30 @@ class HTMLSnapshot:
         self.page = page
         self.collection = collection
         self.assets = set()
-        self.assets = set()
         self.asset_urls = set()
         self.base_url = page.base_url()
+        self._prefetched = {}
+        self._asset_elems = None
+        self._cache_entries = None
+        self._pending_refs = {}
+        # References on files of stylesheets coming from the cache
+        self._nested_refs = []
+        # Files referenced by the stylesheets being processed
+        self._nested = []
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
 
     def _clear_assets(self):
-        for asset in self.assets:
-            asset.remove_ref()
+        filenames = []
+        for filename in [asset.filename for asset in self.assets] + self._nested_refs:
+            if self._pending_refs.get(filename):
+                # The reference was not taken yet
+                self._pending_refs[filename].pop()
+                continue
+            filenames.append(filename)
+        HTMLAsset.remove_file_refs(filenames)
+        self._pending_refs = {}
+        self._nested_refs = []
         self.assets = set()
         self.asset_urls = set()
 
@@ -204,6 +348,10 @@ class HTMLSnapshot:
         self.assets.add(asset)
         self.asset_urls.add(asset.url)
 
+    def manifest(self):
+        # One entry per reference taken
+        return sorted([asset.filename for asset in self.assets] + self._nested_refs)
+
     def snapshot(self):
         from .browser_chromium import BrowserChromium
         from .browser_firefox import BrowserFirefox
@@ -213,8 +361,11 @@ class HTMLSnapshot:
             if self.page.browser in (BrowserChromium, BrowserFirefox):
                 self.build_style()
             self.sanitize()
+            self.prefetch_assets()
             self.handle_assets()
-            HTMLCache.write_asset(self.page.url, self.page.dump_html(), self.page, extension=".html")
+            HTMLCache.write_asset(
+                self.page.url, self.page.dump_html(), self.page, extension=".html", manifest=self.manifest()
+            )
         except Exception as e:  # noqa
             if getattr(settings, "TEST_MODE", False) and not getattr(settings, "TEST_HTML_ERROR_HANDLING", False):
                 raise
@@ -222,46 +373,51 @@ class HTMLSnapshot:
             content = f"An error occured while downloading {self.page.url}:\n{format_exc()}"
             content = format_html("<pre>{}</pre>", content)
             content = content.encode("utf-8")
-            HTMLCache.write_asset(self.page.url, content, self.page, extension=".html")
+            HTMLCache.write_asset(self.page.url, content, self.page, extension=".html", manifest=[])
             self._clear_assets()
 
         logger.debug(f"html_snapshot of {self.page.url} done")
 
     def sanitize(self):
+        from .collection import Collection
+
         logger.debug(f"html_sanitize of {self.page.url}")
-        soup = self.page.get_soup()
+        remove_nav = self.collection.remove_nav_elements == Collection.REMOVE_NAV_FROM_ALL
+        self._visit(sanitize=True, remove_nav=remove_nav)
 
-        # Drop <script>
-        for elem in soup.find_all("script"):
+    def _sanitize_elem(self, elem, remove_nav):
+        # Returns False when the element is dropped
+        if elem.name == "script" or (remove_nav and elem.name in NAV_ELEMENTS):
             elem.extract()
+            return False
 
         # Drop event handlers on*
-        for elem in soup.find_all(True):
-            to_drop = []
-            for attr in elem.attrs.keys():
-                if attr.startswith("on"):
-                    to_drop.append(attr)
-            for attr in to_drop:
-                elem.attrs.pop(attr)
+        to_drop = []
+        for attr in elem.attrs.keys():
+            if attr.startswith("on"):
+                to_drop.append(attr)
+        for attr in to_drop:
+            elem.attrs.pop(attr)
 
-            if "nonce" in elem.attrs:
-                del elem.attrs["nonce"]
+        if "nonce" in elem.attrs:
+            del elem.attrs["nonce"]
 
         # Drop base elements
-        for elem in soup.find_all("base"):
+        if elem.name == "base":
             elem.extract()
+            return False
 
         # Drop favicon
-        for elem in soup.find_all("link"):
+        if elem.name == "link":
             if elem.attrs.get("itemprop"):
                 elem.extract()
-                continue
+                return False
 
             if elem.attrs.get("href", "").endswith(".js"):
                 # Javascript files may be referenced as <link rel="prefetch" href="script.js" /> elements
                 # (prefetch, preload, preconnect, etc.)
                 elem.extract()
-                continue
+                return False
 
             rel = " ".join(elem.attrs.get("rel", []))
             # We don't want to download element pointed by these
@@ -271,15 +427,38 @@ class HTMLSnapshot:
             for val in ("icon", "canonical", "alternate"):
                 if val in rel:
                     elem.extract()
-                    break
+                    return False
 
-    def handle_assets(self):
-        logger.debug(f"html_handle_assets for {self.page.url}")
+        return True
 
+    def _visit(self, sanitize, remove_nav=False):
+        # Single pass on the page, to sanitize it and to find the elements that reference assets
+        self._asset_elems = []
+        dropped = set()
         for elem in self.page.get_soup().find_all(True):
+            if id(elem) in dropped:
+                continue
+
+            if sanitize and not self._sanitize_elem(elem, remove_nav):
+                dropped.update(id(child) for child in elem.descendants)
+                continue
+
             if elem.name == "base":
                 continue
 
+            if elem.name == "style" or any(attr in elem.attrs for attr in ASSET_ATTRS):
+                self._asset_elems.append(elem)
+
+    def _asset_elements(self):
+        if self._asset_elems is None:
+            self._visit(sanitize=False)
+        return self._asset_elems
+
+    def handle_assets(self):
+        logger.debug(f"html_handle_assets for {self.page.url}")
+        self._load_cache_entries()
+
+        for elem in self._asset_elements():
             if elem.name == "style":
                 logger.debug(f"handle_css of {self.page.url} (<style>)")
                 if elem.string:
@@ -290,29 +469,10 @@ class HTMLSnapshot:
                 elem.attrs["style"] = css_parser().handle_css(self, self.base_url, elem.attrs["style"], True)
 
             if "srcset" in elem.attrs:
-                urls = elem.attrs["srcset"].strip()
-                urls = urls.split(",")
-
                 _urls = []
-                for url in urls:
-                    url = url.strip()
-                    params = ""
-                    if " " in url:
-                        url, params = url.split(" ", 1)
-                        params = " " + params
-
-                    if url.startswith("blob:"):
-                        url = url[5:]
-
-                    if not (
-                        url.startswith("file:")
-                        or url.startswith("blob:")
-                        or url.startswith("about:")
-                        or url.startswith("data:")
-                    ):
-                        if self.collection.snapshot_exclude_element_re and re.match(
-                            self.collection.snapshot_exclude_element_re, elem.name
-                        ):
+                for url, params, downloadable in self._srcset_entries(elem.attrs["srcset"]):
+                    if downloadable:
+                        if self._is_excluded_element(elem):
                             logger.debug(
                                 f"download_asset {url} excluded because it matches the element ({elem.name}) exclude regexp"
                             )
@@ -327,43 +487,231 @@ class HTMLSnapshot:
                 urls = ", ".join(_urls)
                 elem["srcset"] = urls
 
-            for attr in ("src", "href"):
-                if attr not in elem.attrs:
-                    continue
+            for attr, url, force_mime in self._element_urls(elem):
+                if self._is_link(elem):
+                    elem.attrs[attr] = "/html/" + url
+                elif self._is_excluded_element(elem):
+                    logger.debug(
+                        f"download_asset {url} excluded because it matches the element ({elem.name}) exclude regexp"
+                    )
+                    elem.attrs[attr] = reverse("html_excluded", args=(self.collection.id, "element"))
+                else:
+                    logger.debug(f"downloading asset from {attr} attribute / {elem.name}")
+                    elem.attrs[attr] = self.download_asset(url, self.base_url, force_mime)
+
+        self._flush_refs()
+
+    def _load_cache_entries(self):
+        # Load the cache entries of all assets of the page at once, instead of one query per asset
+        if self._cache_entries is None:
+            urls = [url for url, _ in self.collect_assets() if not self._is_excluded_url(url)]
+            self._cache_entries = HTMLCache.cache_entries(urls)
+
+    def _flush_refs(self):
+        # Take the references on cached assets in a single update, files removed by another worker since
+        # the cache lookup are downloaded again under the same name, since the page already points to them
+        while self._pending_refs:
+            pending = self._pending_refs
+            self._pending_refs = {}
+            missing = HTMLAsset.increment_refs({filename: len(refs) for filename, refs in pending.items() if refs})
+            for filename in missing:
+                for url, referer, force_mime, nested in pending[filename]:
+                    logger.debug(f"cache entry of {url} removed after the cache hit")
+                    if nested:
+                        self._nested_refs.remove(filename)
+                    else:
+                        self.assets = {asset for asset in self.assets if asset.url != url}
+                        self.asset_urls.discard(url)
 
-                url = elem.attrs[attr]
-                if url.startswith("blob:"):
-                    url = url[5:]
+                    asset = self._fetch_asset(url, referer, force_mime, filename, cached=False)
+                    if isinstance(asset, str):
+                        continue
+                    if nested:
+                        self._nested_refs.append(asset.filename)
+                    else:
+                        self._add_asset(asset)
 
-                if not has_browsable_scheme(url):
-                    continue
+    def _is_excluded_element(self, elem):
+        return self.collection.snapshot_exclude_element_re and re.match(
+            self.collection.snapshot_exclude_element_re, elem.name
+        )
 
-                url = absolutize_url(self.base_url, url)
+    def _is_excluded_url(self, url):
+        return self.collection.snapshot_exclude_url_re and re.match(self.collection.snapshot_exclude_url_re, url)
 
-                if elem.name in ("a", "frame", "iframe"):
-                    elem.attrs[attr] = "/html/" + url
-                    break
-                else:
-                    if url == self.page.url:
+    @staticmethod
+    def _css_asset_urls(base_url, content, inline_css):
+        """Returns the ``(url, forced mimetype)`` of assets referenced by a
+        stylesheet, an empty list when it cannot be parsed."""
+        try:
+            segments = list(css_parser().css_urls(content, inline_css))
+        except Exception as e:  # noqa
+            # The error is handled when the stylesheet is processed by handle_css()
+            logger.debug(f"could not list the assets of a stylesheet from {base_url}: {e}")
+            return []
+
+        assets = []
+        for segment in segments:
+            if has_browsable_scheme(segment):
+                url = absolutize_url(base_url, segment)
+                force_mime = None
+                if url.endswith(".css"):
+                    force_mime = "text/css"
+                assets.append((url, force_mime))
+        return assets
+
+    @staticmethod
+    def _is_link(elem):
+        return elem.name in ("a", "frame", "iframe")
+
+    @staticmethod
+    def _srcset_entries(srcset):
+        """Returns the ``(url, descriptor, downloadable)`` entries of a
+        ``srcset`` attribute."""
+        entries = []
+        for url in srcset.strip().split(","):
+            url = url.strip()
+            params = ""
+            if " " in url:
+                url, params = url.split(" ", 1)
+                params = " " + params
+
+            if url.startswith("blob:"):
+                url = url[5:]
+
+            downloadable = not url.startswith(("file:", "blob:", "about:", "data:"))
+            entries.append((url, params, downloadable))
+        return entries
+
+    def _element_urls(self, elem):
+        """Yields the ``(attribute, absolute url, forced mimetype)`` of the
+        ``src`` and ``href`` attributes of an element that point to an asset,
+        or to a page for links."""
+        for attr in ("src", "href"):
+            if attr not in elem.attrs:
+                continue
+
+            url = elem.attrs[attr]
+            if url.startswith("blob:"):
+                url = url[5:]
+
+            if not has_browsable_scheme(url):
+                continue
+
+            url = absolutize_url(self.base_url, url)
+
+            if self._is_link(elem):
+                yield attr, url, None
+                return
+
+            if url == self.page.url:
+                continue
+
+            force_mime = None
+            if elem.name == "link" and ("stylesheet" in elem.attrs.get("rel", []) or elem.attrs.get("as") == "style"):
+                # Force the mime since because libmagic sometimes fails to identify it correctly
+                force_mime = "text/css"
+            yield attr, url, force_mime
+
+    def collect_assets(self):
+        """Returns the ``(url, forced mimetype)`` of assets that ``handle_assets``
+        will download, in document order."""
+        assets = []
+        for elem in self._asset_elements():
+            if elem.name == "style" and elem.string:
+                assets += self._css_asset_urls(self.base_url, elem.string, False)
+
+            if elem.attrs.get("style"):
+                assets += self._css_asset_urls(self.base_url, elem.attrs["style"], True)
+
+            if "srcset" in elem.attrs and not self._is_excluded_element(elem):
+                for url, _, downloadable in self._srcset_entries(elem.attrs["srcset"]):
+                    if downloadable:
+                        assets.append((absolutize_url(self.base_url, url), None))
+
+            if self._is_link(elem) or self._is_excluded_element(elem):
+                continue
+
+            for _, url, force_mime in self._element_urls(elem):
+                assets.append((url, force_mime))
+        return assets
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).hostname
+        with self._host_semaphores_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(settings.SOSSE_HTML_ASSET_DOWNLOAD_PER_HOST)
+            return self._host_semaphores[host]
+
+    def _prefetch_asset(self, url, referer, force_mime):
+        nested = []
+        try:
+            with self._host_semaphore(url):
+                result = HTMLCache.fetch(
+                    url, self.collection, referer, settings.SOSSE_MAX_HTML_ASSET_SIZE, self._cache_entries
+                )
+
+            if isinstance(result, Page) and (force_mime or result.mimetype) == "text/css":
+                content = result.content
+                if isinstance(content, bytes):
+                    content = content.decode("utf-8", errors="replace")
+                nested = self._css_asset_urls(url, content, False)
+        except Exception as e:  # noqa
+            # The exception is raised again when the asset is processed by download_asset()
+            result = e
+        finally:
+            # Each worker thread opens its own database connection
+            connection.close()
+        return url, result, nested
+
+    def prefetch_assets(self):
+        """Download assets concurrently, before ``handle_assets`` rewrites the
+        page.
+
+        Only network transfers are done here, cache references and asset
+        files are handled by ``download_asset`` as if the assets were
+        downloaded sequentially.
+        """
+        threads = settings.SOSSE_HTML_ASSET_DOWNLOAD_THREADS
+        if threads <= 1:
+            return
+
+        logger.debug(f"prefetch assets of {self.page.url}")
+        self._load_cache_entries()
+        queued = set()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = set()
+
+            def _queue(assets, referer):
+                for url, force_mime in assets:
+                    if url in queued or self._is_excluded_url(url):
                         continue
-                    if self.collection.snapshot_exclude_element_re and re.match(
-                        self.collection.snapshot_exclude_element_re, elem.name
-                    ):
-                        logger.debug(
-                            f"download_asset {url} excluded because it matches the element ({elem.name}) exclude regexp"
-                        )
-                        filename_url = reverse("html_excluded", args=(self.collection.id, "element"))
-                    else:
-                        force_mime = None
-                        if elem.name == "link" and (
-                            "stylesheet" in elem.attrs.get("rel", []) or elem.attrs.get("as") == "style"
-                        ):
-                            # Force the mime since because libmagic sometimes fails to identify it correctly
-                            force_mime = "text/css"
+                    queued.add(url)
+                    pending.add(executor.submit(self._prefetch_asset, url, referer, force_mime))
+
+            _queue(self.collect_assets(), self.base_url)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    url, result, nested = future.result()
+                    self._prefetched[url] = result
+                    _queue(nested, url)
+        logger.debug(f"prefetched {len(self._prefetched)} assets of {self.page.url}")
+
+    def _download(self, url, referer):
+        result = self._prefetched.pop(url, None)
+        if result is None:
+            try:
+                return HTMLCache.fetch(
+                    url, self.collection, referer, settings.SOSSE_MAX_HTML_ASSET_SIZE, self._cache_entries
+                )
+            except CacheHit as e:
+                result = e
 
-                        logger.debug(f"downloading asset from {attr} attribute / {elem.name}")
-                        filename_url = self.download_asset(url, self.base_url, force_mime)
-                    elem.attrs[attr] = filename_url
+        if isinstance(result, Exception):
+            raise result
+        return result
 
     def download_asset(self, url, referer, force_mime=None):
         if getattr(settings, "TEST_HTML_ERROR_HANDLING", False) and url == "http://127.0.0.1/test-exception":
@@ -376,16 +724,41 @@ class HTMLSnapshot:
         if url in self.asset_urls:
             for asset in self.assets:
                 if asset.url == url:
+                    self._add_nested(asset)
                     return settings.SOSSE_HTML_SNAPSHOT_URL + asset.filename
             raise Exception("asset not found")
 
+        asset = self._fetch_asset(url, referer, force_mime)
+        if isinstance(asset, str):
+            return asset
+
+        self._add_asset(asset)
+        self._add_nested(asset)
+        return settings.SOSSE_HTML_SNAPSHOT_URL + asset.filename
+
+    def _add_nested(self, asset):
+        # Files referenced by the stylesheet being processed, including the ones of its own stylesheets
+        if self._nested:
+            self._nested[-1] |= {asset.filename} | set(asset.nested or [])
+
+    def _fetch_asset(self, url, referer, force_mime, filename=None, cached=True):
+        """Returns the cache entry of ``url``, or the url to point to when it
+        is not stored as an asset.
+
+        ``filename`` forces the name of the file written, ``cached`` is unset
+        to download it without looking up the cache.
+        """
         logger.debug(f"download_asset {url} (forced mime {force_mime})")
         mimetype = None
         extension = None
         page = None
+        nested = None
 
         try:
-            page = HTMLCache.download(url, self.collection, referer, settings.SOSSE_MAX_HTML_ASSET_SIZE)
+            if cached:
+                page = self._download(url, referer)
+            else:
+                page = HTMLCache.request(url, self.collection, referer, settings.SOSSE_MAX_HTML_ASSET_SIZE)
             content = page.content
             mimetype = force_mime or page.mimetype
 
@@ -402,12 +775,28 @@ class HTMLSnapshot:
 
             if mimetype == "text/css":
                 logger.debug(f"handle_css of {url} due to mimetype")
-                content = css_parser().handle_css(self, url, content, False).encode("utf-8")
+                self._nested.append(set())
+                try:
+                    content = css_parser().handle_css(self, url, content, False).encode("utf-8")
+                finally:
+                    nested = sorted(self._nested.pop())
 
         except CacheHit as e:
+            nested_urls = {}
+            if e.asset.nested:
+                nested_urls = dict(HTMLAsset.objects.filter(filename__in=e.asset.nested).values_list("filename", "url"))
+                if set(e.asset.nested) - nested_urls.keys():
+                    logger.debug(f"files referenced by the cached {url} were removed")
+                    return self._fetch_asset(url, referer, force_mime, cached=False)
+
             logger.debug(f"CACHE HIT {url}")
-            self._add_asset(e.asset)
-            return settings.SOSSE_HTML_SNAPSHOT_URL + e.asset.filename
+            # The references are taken by _flush_refs(), the page also keeps the files referenced by the
+            # stylesheet since they are not downloaded again
+            self._pending_refs.setdefault(e.asset.filename, []).append((url, referer, force_mime, False))
+            for nested_filename, nested_url in nested_urls.items():
+                self._nested_refs.append(nested_filename)
+                self._pending_refs.setdefault(nested_filename, []).append((nested_url, url, None, True))
+            return e.asset
         except SkipIndexing as e:
             content = f"An error occured while downloading {url}:\n{e.args[0]}"
             content = content.encode("utf-8")
@@ -421,12 +810,19 @@ class HTMLSnapshot:
 
         if not isinstance(content, bytes):
             raise ValueError(f"content is not bytes: {content.__class__.__name__}")
-        asset = HTMLCache.write_asset(url, content, page, extension=extension, mimetype=mimetype)
+        asset = HTMLCache.write_asset(
+            url,
+            content,
+            page,
+            extension=extension,
+            mimetype=mimetype,
+            content_addressed=True,
+            filename=filename,
+            nested=nested,
+        )
         if extension == ".html":
             return settings.SOSSE_HTML_SNAPSHOT_URL + asset
-
-        self._add_asset(asset)
-        return settings.SOSSE_HTML_SNAPSHOT_URL + asset.filename
+        return asset
 
     def get_asset_urls(self):
         return self.asset_urls
@@ -0,0 +1,170 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import monotonic
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+crawl_logger = logging.getLogger("crawler")
+
+
+class HTTPPool:
+    """Per-host cache of ``requests`` sessions.
+
+    Sessions are kept in LRU order, hosts idle for more than
+    ``http_pool_idle_timeout`` seconds or exceeding ``http_pool_max_hosts``
+    are closed to release their sockets. Sessions checked out with
+    ``use_session()`` are closed once they are released.
+    """
+
+    _sessions = OrderedDict()
+    # Number of users of checked out sessions, and evicted sessions waiting to be released
+    _users = {}
+    _closing = {}
+    _lock = threading.RLock()
+    _closed_requests = 0
+    _closed_connections = 0
+    _evictions = 0
+
+    @classmethod
+    def _new_session(cls):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            max_retries=0,
+            pool_connections=2,  # one pool for http, one for https
+            pool_maxsize=settings.SOSSE_HTTP_POOL_MAXSIZE,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @staticmethod
+    def _connection_pools(session):
+        for adapter in session.adapters.values():
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                if manager is None:
+                    continue
+                # The container of pools cannot be iterated, keys() returns a copy taken under its lock
+                for key in manager.pools.keys():  # noqa: SIM118
+                    pool = manager.pools.get(key)
+                    if pool is not None:
+                        yield pool
+
+    @classmethod
+    def _close(cls, hostname, session):
+        if cls._users.get(session):
+            crawl_logger.debug(f"http pool: {hostname} in use, closing it once released")
+            cls._closing[session] = hostname
+            return
+
+        # Account for the counters of the pools before they are dropped
+        for pool in set(cls._connection_pools(session)):
+            cls._closed_requests += pool.num_requests
+            cls._closed_connections += pool.num_connections
+        session.close()
+        cls._evictions += 1
+        crawl_logger.debug(f"http pool: closed connections to {hostname}")
+
+    @classmethod
+    def _evict(cls, now):
+        while cls._sessions:
+            hostname, (session, last_used) = next(iter(cls._sessions.items()))
+            too_many = len(cls._sessions) > settings.SOSSE_HTTP_POOL_MAX_HOSTS
+            idle = settings.SOSSE_HTTP_POOL_IDLE_TIMEOUT and now - last_used > settings.SOSSE_HTTP_POOL_IDLE_TIMEOUT
+            if not too_many and not idle:
+                break
+            cls._sessions.popitem(last=False)
+            cls._close(hostname, session)
+
+    @classmethod
+    def get_session(cls, url):
+        """Get or create the session used to connect to the hostname of ``url``."""
+        hostname = requests.utils.urlparse(url).hostname
+        now = monotonic()
+
+        with cls._lock:
+            if hostname in cls._sessions:
+                session, _ = cls._sessions.pop(hostname)
+            else:
+                session = cls._new_session()
+            cls._sessions[hostname] = (session, now)
+            cls._evict(now)
+        return session
+
+    @classmethod
+    @contextmanager
+    def use_session(cls, url):
+        """Same as ``get_session()``, the session is not closed by evictions
+        until the block exits."""
+        with cls._lock:
+            session = cls.get_session(url)
+            cls._users[session] = cls._users.get(session, 0) + 1
+        try:
+            yield session
+        finally:
+            with cls._lock:
+                cls._users[session] -= 1
+                if not cls._users[session]:
+                    del cls._users[session]
+                    hostname = cls._closing.pop(session, None)
+                    if hostname is not None:
+                        cls._close(hostname, session)
+
+    @classmethod
+    def has_sessions(cls):
+        with cls._lock:
+            return bool(cls._sessions)
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            while cls._sessions:
+                hostname, (session, _) = cls._sessions.popitem(last=False)
+                cls._close(hostname, session)
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            req_count = cls._closed_requests
+            conn_count = cls._closed_connections
+            open_sockets = 0
+
+            for session, _ in cls._sessions.values():
+                for pool in set(cls._connection_pools(session)):
+                    req_count += pool.num_requests
+                    conn_count += pool.num_connections
+                    for conn in list(pool.pool.queue) if pool.pool else []:
+                        if conn is not None and getattr(conn, "sock", None) is not None:
+                            open_sockets += 1
+
+            reuse_ratio = 0.0
+            if req_count:
+                reuse_ratio = max(0.0, 1.0 - conn_count / req_count)
+
+            return {
+                "hosts": len(cls._sessions),
+                "requests": req_count,
+                "connections": conn_count,
+                "reuse_ratio": reuse_ratio,
+                "open_sockets": open_sockets,
+                "evictions": cls._evictions,
+            }
@@ -0,0 +1,93 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+from hashlib import sha256
+
+from django.conf import settings
+from django.db import models, transaction
+
+from .storage_usage import StorageUsage
+
+crawl_logger = logging.getLogger("crawler")
+
+# Directories relative to SOSSE_SCREENSHOTS_DIR
+SCREENSHOT_BLOB_DIR = "blob/"
+THUMBNAIL_BLOB_DIR = "thumb/blob/"
+
+
+class ImageBlob(models.Model):
+    """A screenshot or thumbnail file, shared by all the documents having
+    the same image."""
+
+    filename = models.TextField(unique=True)
+    ref_count = models.PositiveBigIntegerField(default=0)
+
+    @staticmethod
+    def blob_filename(blob_dir, digest, extension):
+        return f"{blob_dir}{digest[:2]}/{digest}.{extension}"
+
+    @staticmethod
+    def store(path, blob_dir, extension):
+        """Moves the image ``path`` to a file named after its content, and
+        takes a reference on it.
+
+        Returns the digest of the content."""
+        with open(path, "rb") as fd:
+            digest = sha256(fd.read()).hexdigest()
+
+        filename = ImageBlob.blob_filename(blob_dir, digest, extension)
+        dest = settings.SOSSE_SCREENSHOTS_DIR + filename
+        with transaction.atomic():
+            # The lock prevents the file from being removed by another worker
+            blob, _ = ImageBlob.objects.select_for_update().get_or_create(filename=filename)
+            if os.path.exists(dest):
+                crawl_logger.debug(f"{path} has the same content as {filename}")
+                StorageUsage.unlink(StorageUsage.SCREENSHOTS, path)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(path, dest)
+            ImageBlob.objects.filter(id=blob.id).update(ref_count=models.F("ref_count") + 1)
+        return digest
+
+    @staticmethod
+    def remove_refs(filenames):
+        """Removes one reference for each item of ``filenames``, files that
+        are not referenced anymore are deleted."""
+        counts = {}
+        for filename in filenames:
+            counts[filename] = counts.get(filename, 0) + 1
+        if not counts:
+            return
+
+        with transaction.atomic():
+            blobs = ImageBlob.objects.select_for_update().filter(filename__in=counts.keys()).order_by("id")
+
+            to_delete = []
+            for blob in blobs:
+                count = counts[blob.filename]
+                if blob.ref_count > count:
+                    ImageBlob.objects.filter(id=blob.id).update(ref_count=models.F("ref_count") - count)
+                else:
+                    to_delete.append(blob.filename)
+
+            ImageBlob.objects.filter(filename__in=to_delete).delete()
+            for filename in to_delete:
+                crawl_logger.debug(f"removing image {filename}")
+                try:
+                    StorageUsage.unlink(StorageUsage.SCREENSHOTS, settings.SOSSE_SCREENSHOTS_DIR + filename)
+                except OSError:
+                    pass
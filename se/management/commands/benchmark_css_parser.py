@@ -0,0 +1,118 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from pathlib import Path
+from time import perf_counter
+
+import cssutils
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...html_snapshot import CSSUtilsParser, InternalCSSParser, StreamCSSParser
+
+PARSERS = {
+    "internal": InternalCSSParser,
+    "stream": StreamCSSParser,
+    "cssutils": CSSUtilsParser,
+}
+
+# Bundles usually embed fonts or images as data urls
+CSS_FONT = """@font-face {{
+    font-family: "Embedded";
+    src: url(data:font/woff2;base64,{data}) format("woff2");
+}}
+"""
+CSS_RULE = """.rule-{no} {{
+    color: #{no:06x};
+    background: url("../img/image-{no}.png") no-repeat, url(data:image/png;base64,iVBORw0KGgo=);
+    font-family: "Police {no}", sans-serif;
+}}
+"""
+
+
+class NoDownloadSnapshot:
+    """Stands for an ``HTMLSnapshot``, urls are rewritten without being
+    downloaded."""
+
+    def __init__(self):
+        self.urls = 0
+
+    def download_asset(self, url, referer, force_mime=None):
+        self.urls += 1
+        return settings.SOSSE_HTML_SNAPSHOT_URL + "benchmark.png"
+
+
+class Command(BaseCommand):
+    help = "Measures the time taken by the CSS parsers to rewrite urls."
+    doc = """This command runs the CSS parsers that can be set with the :ref:`css parser <conf_option_css_parser>` option on a stylesheet, without downloading the assets it references. When no file is provided, a stylesheet is generated."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=1024,
+            help="Size of the generated stylesheet (in kB).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of runs of each parser, the fastest one is reported.",
+        )
+        parser.add_argument(
+            "--parser",
+            action="append",
+            choices=PARSERS.keys(),
+            help="Parser to benchmark, can be used multiple times (defaults to all).",
+        )
+        parser.add_argument(
+            "files",
+            nargs="*",
+            type=str,
+            help="Stylesheets to parse.",
+        )
+
+    def _generate(self, size):
+        css = [CSS_FONT.format(data="A" * (size * 1024 // 10))]
+        css_len = len(css[0])
+        no = 0
+        while css_len < size * 1024:
+            rule = CSS_RULE.format(no=no)
+            css.append(rule)
+            css_len += len(rule)
+            no += 1
+        return "".join(css).encode("utf-8")
+
+    def handle(self, *args, **options):
+        # Do not report invalid properties
+        cssutils.log.setLevel(logging.CRITICAL)
+
+        if options["files"]:
+            stylesheets = [(filename, Path(filename).read_bytes()) for filename in options["files"]]
+        else:
+            stylesheets = [("<generated>", self._generate(options["size"]))]
+
+        for name, content in stylesheets:
+            self.stdout.write(f"{name} ({len(content) // 1024} kB):")
+            for parser_name in options["parser"] or PARSERS.keys():
+                parser = PARSERS[parser_name]
+                durations = []
+                for _ in range(options["repeat"]):
+                    snapshot = NoDownloadSnapshot()
+                    start = perf_counter()
+                    parser.handle_css(snapshot, "http://127.0.0.1/css/", content, False)
+                    durations.append(perf_counter() - start)
+                self.stdout.write(f"  {parser_name:<10} {min(durations):8.3f}s ({snapshot.urls} urls)")
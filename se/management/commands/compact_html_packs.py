@@ -0,0 +1,43 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand
+
+from ...html_pack import HTMLPack
+
+
+class Command(BaseCommand):
+    help = "Reclaims the space of unused assets in HTML pack files."
+    doc = """Assets of the HTML archive smaller than the :ref:`html pack max size <conf_option_html_pack_max_size>` are appended to pack files. When an asset is not referenced anymore, its space in the pack file is left unused until all the assets of the pack file are unused. This command rewrites the assets of pack files having a large share of unused space."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-unused",
+            type=int,
+            default=50,
+            help="Minimum share of unused space (in percent) for a pack file to be compacted.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Prints the space that would be reclaimed.",
+        )
+
+    def handle(self, *args, **options):
+        reclaimed = HTMLPack.compact(options["min_unused"] / 100, options["dry_run"])
+        if options["dry_run"]:
+            self.stdout.write(f"{reclaimed} bytes would be reclaimed")
+        else:
+            self.stdout.write(f"{reclaimed} bytes reclaimed")
@@ -31,8 +31,11 @@ from django.utils.timezone import now
 from ...browser_chromium import BrowserChromium
 from ...browser_firefox import BrowserFirefox
 from ...collection import Collection
+from ...dns_cache import DNSCache
 from ...document import Document
+from ...http_pool import HTTPPool
 from ...models import MINUTELY, CrawlerStats, WorkerStats
+from ...storage_usage import StorageUsage
 
 crawl_logger = logging.getLogger("crawler")
 wake_event = None
@@ -108,6 +111,16 @@ class Command(BaseCommand):
         global wake_event
         wake_event.set()
 
+    @staticmethod
+    def reconcile_storage_usage():
+        # Runs in its own thread, so that walking the archive does not stop the crawler
+        try:
+            StorageUsage.reconcile()
+        except Exception:
+            crawl_logger.error(format_exc())
+        finally:
+            connection.close()
+
     @staticmethod
     def process(worker_no, options):
         crawl_logger.info(f"Crawler {worker_no} initializing")
@@ -130,6 +143,12 @@ class Command(BaseCommand):
 
         worker_stats = WorkerStats.get_worker(worker_no)
         next_stat = Command.next_stat()
+        next_pool_stat = now() + timedelta(minutes=1)
+        # Storage counters are computed on first start, and corrected daily
+        next_storage_usage = now()
+        if StorageUsage.objects.exists():
+            next_storage_usage += timedelta(days=1)
+        storage_usage_thread = None
 
         while True:
             if worker_no == 0:
@@ -137,6 +156,16 @@ class Command(BaseCommand):
                 if next_stat <= t:
                     CrawlerStats.create(t)
                     next_stat = Command.next_stat()
+                if next_storage_usage <= t and not (storage_usage_thread and storage_usage_thread.is_alive()):
+                    storage_usage_thread = threading.Thread(target=Command.reconcile_storage_usage, daemon=True)
+                    storage_usage_thread.start()
+                    next_storage_usage = t + timedelta(days=1)
+
+            if next_pool_stat <= now():
+                crawl_logger.info(f"Crawler {worker_no} http pool stats: {HTTPPool.stats()}")
+                if settings.SOSSE_DNS_CACHE:
+                    crawl_logger.info(f"Crawler {worker_no} dns cache stats: {DNSCache.stats()}")
+                next_pool_stat = now() + timedelta(minutes=1)
 
             worker_stats.refresh_from_db()
             try:
@@ -146,11 +175,13 @@ class Command(BaseCommand):
                     if worker_stats.state == "running":
                         worker_stats.update_state("idle")
 
-                    if BrowserChromium.inited or BrowserFirefox.inited:
+                    if BrowserChromium.inited or BrowserFirefox.inited or HTTPPool.has_sessions():
                         next_doc = Command.next_doc()
                         if next_doc is None or next_doc > settings.SOSSE_BROWSER_IDLE_EXIT_TIME:
                             BrowserChromium.destroy()
                             BrowserFirefox.destroy()
+                            # Release sockets kept alive while the worker sleeps
+                            HTTPPool.close_all()
 
                     if worker_stats.state == "paused" and worker_no == 0:
                         next_stat = Command.next_stat()
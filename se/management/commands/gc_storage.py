@@ -0,0 +1,251 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.functions import MD5, Collate
+
+from ...document import Document
+from ...html_asset import HTMLBlob, remove_html_asset_file
+from ...html_pack import PACK_DIR, HTMLPack
+from ...image_blob import SCREENSHOT_BLOB_DIR, THUMBNAIL_BLOB_DIR, ImageBlob
+from ...storage_usage import StorageUsage
+from ...utils import human_filesize
+
+BATCH_SIZE = 1000
+# Files named after the md5 of the document url, see Document.image_name()
+LEGACY_SCREENSHOT_RE = re.compile(r"^([0-9a-f]{2})/(\1[0-9a-f]{30})_([0-9]+)\.(png|jpg)$")
+LEGACY_THUMBNAIL_RE = re.compile(r"^([0-9a-f]{2})/(\1[0-9a-f]{30})\.jpg$")
+
+
+def scan_files(root, exclude=()):
+    """Yields the files below ``root`` as (path relative to ``root``,
+    ``os.DirEntry``), directories and files are visited in sorted
+    order."""
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(root + rel_dir) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+
+        dirs = []
+        for entry in entries:
+            rel = rel_dir + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if rel + "/" not in exclude:
+                    dirs.append(rel + "/")
+            elif entry.is_file(follow_symlinks=False):
+                yield rel, entry
+        stack.extend(reversed(dirs))
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def legacy_references(queryset, fields, filenames):
+    """Yields (md5 of the url, set of filenames) sorted by md5, using a server
+    side cursor. ``filenames`` returns the filenames referenced by the
+    ``fields`` of a row of ``queryset``."""
+    rows = (
+        queryset.annotate(image_hash=Collate(MD5("url"), "C"))
+        .order_by("image_hash")
+        .values_list("image_hash", *fields)
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+    current, names = None, set()
+    for image_hash, *values in rows:
+        if image_hash != current:
+            if current is not None:
+                yield current, names
+            current, names = image_hash, set()
+        names |= filenames(image_hash, *values)
+    if current is not None:
+        yield current, names
+
+
+def screenshot_filenames(image_hash, screenshot_count, screenshot_format):
+    return {f"{image_hash}_{i}.{screenshot_format}" for i in range(screenshot_count)}
+
+
+def thumbnail_filenames(image_hash):
+    return {f"{image_hash}.jpg"}
+
+
+class Command(BaseCommand):
+    help = "Deletes files of the HTML archive, screenshots and thumbnails that are not referenced anymore."
+    doc = """This command scans the :ref:`HTML snapshot <conf_option_html_snapshot_dir>` and :ref:`screenshots <conf_option_screenshots_dir>` directories, and deletes files that no document references, like files left behind by a crawler that was killed. Files are checked against the database by batches, so that memory usage stays bounded on large archives."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Prints the space that would be reclaimed without deleting files.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=60,
+            help="Files modified less than this number of minutes ago are kept, since they may be in use by a crawler.",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=8,
+            help="Number of files deleted in parallel.",
+        )
+
+    def _old_enough(self, files):
+        for rel, entry in files:
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime < self.max_mtime:
+                    yield rel, entry
+            except FileNotFoundError:
+                pass
+
+    def _unreferenced_blobs(self, files, model, prefix="", suffix=""):
+        """Yields the files having no row of ``model`` with a matching
+        filename, with or without ``suffix``."""
+        for batch in batched(files, BATCH_SIZE):
+            names = {}
+            for rel, entry in batch:
+                names[rel] = {prefix + rel}
+                if suffix and rel.endswith(suffix):
+                    names[rel].add(prefix + rel[: -len(suffix)])
+
+            filenames = set().union(*names.values())
+            referenced = set(model.objects.filter(filename__in=filenames).values_list("filename", flat=True))
+            for rel, entry in batch:
+                if not names[rel] & referenced:
+                    yield rel, entry
+
+    def _unreferenced_legacy(self, files, regexp, references):
+        """Merges the files, sorted by name, with the references sorted by
+        md5. Files not matching ``regexp`` are not yielded."""
+        reference = next(references, None)
+        for rel, entry in files:
+            match = regexp.match(rel)
+            if not match:
+                continue
+
+            image_hash = match[2]
+            while reference is not None and reference[0] < image_hash:
+                reference = next(references, None)
+
+            if reference is not None and reference[0] == image_hash and entry.name in reference[1]:
+                continue
+            yield rel, entry
+
+    def _remove_image(self, path):
+        StorageUsage.unlink(StorageUsage.SCREENSHOTS, path)
+
+    @staticmethod
+    def _remove_files(remove, paths):
+        # Runs in a worker thread, the storage counters are updated with its own database connection
+        try:
+            for path in paths:
+                remove(path)
+        finally:
+            connection.close()
+
+    def _delete(self, name, root, files, remove):
+        count = 0
+        size = 0
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for batch in batched(files, BATCH_SIZE):
+                for rel, entry in batch:
+                    size += entry.stat(follow_symlinks=False).st_size
+                    count += 1
+                    if self.verbosity > 1:
+                        self.stdout.write(f"{name}: {rel}")
+                if not self.dry_run:
+                    paths = [root + rel for rel, _ in batch]
+                    chunks = [paths[no :: self.jobs] for no in range(self.jobs)]
+                    list(executor.map(lambda chunk: self._remove_files(remove, chunk), chunks))
+
+        self.stdout.write(f"{name}: {count} files, {human_filesize(size)}")
+        return size
+
+    def _remove_pack_files(self):
+        current = HTMLPack.current_segment()
+        used = set(
+            HTMLBlob.objects.filter(pack_segment__isnull=False).values_list("pack_segment", flat=True).distinct()
+        )
+        unused = [segment for segment in HTMLPack.segments() if segment not in used and segment != current]
+        size = sum(os.path.getsize(HTMLPack.segment_path(segment)) for segment in unused)
+        if not self.dry_run:
+            HTMLPack.remove_unused_segments(unused)
+        self.stdout.write(f"HTML pack files: {len(unused)} files, {human_filesize(size)}")
+        return size
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        self.jobs = options["jobs"]
+        self.verbosity = options["verbosity"]
+        self.max_mtime = time() - options["min_age"] * 60
+
+        html_dir = settings.SOSSE_HTML_SNAPSHOT_DIR
+        screenshots_dir = settings.SOSSE_SCREENSHOTS_DIR
+        thumbnails_dir = settings.SOSSE_THUMBNAILS_DIR
+        thumbnails_subdir = thumbnails_dir[len(screenshots_dir) :]
+
+        reclaimed = 0
+        files = self._old_enough(scan_files(html_dir, exclude=(PACK_DIR,)))
+        files = self._unreferenced_blobs(files, HTMLBlob, suffix=".gz")
+        reclaimed += self._delete("HTML archive", html_dir, files, remove_html_asset_file)
+        reclaimed += self._remove_pack_files()
+
+        for name, blob_dir in (("Screenshots", SCREENSHOT_BLOB_DIR), ("Thumbnails", THUMBNAIL_BLOB_DIR)):
+            root = screenshots_dir + blob_dir
+            files = self._old_enough(scan_files(root))
+            files = self._unreferenced_blobs(files, ImageBlob, prefix=blob_dir)
+            reclaimed += self._delete(name, root, files, self._remove_image)
+
+        # Screenshots and thumbnails taken before they were deduplicated
+        references = legacy_references(
+            Document.objects.wo_content().filter(screenshot_count__gt=0, screenshot_digests=[]),
+            ("screenshot_count", "screenshot_format"),
+            screenshot_filenames,
+        )
+        files = scan_files(screenshots_dir, exclude=(SCREENSHOT_BLOB_DIR, thumbnails_subdir))
+        files = self._old_enough(self._unreferenced_legacy(files, LEGACY_SCREENSHOT_RE, references))
+        reclaimed += self._delete("Screenshots (by url)", screenshots_dir, files, self._remove_image)
+
+        references = legacy_references(
+            Document.objects.wo_content().filter(has_thumbnail=True, thumbnail_digest__isnull=True),
+            (),
+            thumbnail_filenames,
+        )
+        files = scan_files(thumbnails_dir, exclude=(THUMBNAIL_BLOB_DIR[len(thumbnails_subdir) :],))
+        files = self._old_enough(self._unreferenced_legacy(files, LEGACY_THUMBNAIL_RE, references))
+        reclaimed += self._delete("Thumbnails (by url)", thumbnails_dir, files, self._remove_image)
+
+        if self.dry_run:
+            self.stdout.write(f"{human_filesize(reclaimed)} would be reclaimed")
+        else:
+            self.stdout.write(f"{human_filesize(reclaimed)} reclaimed")
@@ -0,0 +1,72 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+# Trigram indexes used by the advanced search filters
+TRGM_INDEXES = {
+    "se_document_url_trgm": "url",
+    "se_document_normalized_title_trgm": "normalized_title",
+    "se_document_normalized_content_trgm": "normalized_content",
+}
+
+
+class Command(BaseCommand):
+    help = "Creates the trigram indexes used by the advanced search filters."
+    doc = """Creates `pg_trgm <https://www.postgresql.org/docs/current/pgtrgm.html>`_ indexes on the URL, the title and the content of documents, to speed up the ``Contain``, ``Equal`` and ``Regexp`` filters of the :doc:`advanced search <user/search>`. The ``pg_trgm`` extension is created if required, which requires the database user to be allowed to do so.
+
+Indexes are built concurrently, so that crawlers can keep running, but the build can take a long time and use significant disk space on large databases."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drops the indexes instead of creating them.",
+        )
+
+    @staticmethod
+    def _index_valid(cursor, name):
+        cursor.execute(
+            "SELECT indisvalid FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE relname = %s",
+            [name],
+        )
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            if options["drop"]:
+                for name in TRGM_INDEXES:
+                    self.stdout.write(f"Dropping {name}")
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                return
+
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except DatabaseError as e:
+                raise CommandError(f"Could not create the pg_trgm extension: {e}")
+
+            for name, column in TRGM_INDEXES.items():
+                valid = self._index_valid(cursor, name)
+                if valid:
+                    self.stdout.write(f"{name} already exists")
+                    continue
+                if valid is False:
+                    # Left by an interrupted build
+                    cursor.execute(f"DROP INDEX CONCURRENTLY {name}")
+
+                self.stdout.write(f"Creating {name}")
+                cursor.execute(f"CREATE INDEX CONCURRENTLY {name} ON se_document USING gin ({column} gin_trgm_ops)")
@@ -0,0 +1,28 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand
+
+from ...storage_usage import StorageUsage
+from ...utils import human_filesize
+
+
+class Command(BaseCommand):
+    help = "Recomputes the disk space used by screenshots and the HTML archive."
+    doc = """The disk space displayed in the :doc:`analytics <crawl/analytics>` page is updated when files are written or deleted. This command walks the :ref:`HTML snapshot <conf_option_html_snapshot_dir>` and :ref:`screenshots <conf_option_screenshots_dir>` directories to correct it. This is also done daily by the crawlers, in the background."""
+
+    def handle(self, *args, **options):
+        for category, size in StorageUsage.reconcile().items():
+            self.stdout.write(f"{category}: {human_filesize(size)}")
@@ -0,0 +1,67 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+# Generated by Django 4.2.23 on 2025-10-20 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_blobs(apps, schema_editor):
+    HTMLAsset = apps.get_model("se", "HTMLAsset")
+    HTMLBlob = apps.get_model("se", "HTMLBlob")
+
+    # Rows sharing a filename held the same refcount
+    for entry in HTMLAsset.objects.values("filename").annotate(ref_count=models.Max("ref_count")).iterator():
+        blob = HTMLBlob.objects.create(filename=entry["filename"], ref_count=entry["ref_count"])
+        HTMLAsset.objects.filter(filename=entry["filename"]).update(blob=blob)
+
+
+def restore_ref_counts(apps, schema_editor):
+    HTMLAsset = apps.get_model("se", "HTMLAsset")
+    HTMLBlob = apps.get_model("se", "HTMLBlob")
+
+    for blob in HTMLBlob.objects.iterator():
+        HTMLAsset.objects.filter(filename=blob.filename).update(ref_count=blob.ref_count)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("se", "0025_alter_collection_queue_to_any_collection_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HTMLBlob",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("filename", models.TextField(unique=True)),
+                ("content_hash", models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ("ref_count", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="htmlasset",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to="se.htmlblob"
+            ),
+        ),
+        migrations.RunPython(create_blobs, restore_ref_counts),
+        migrations.RemoveField(
+            model_name="htmlasset",
+            name="ref_count",
+        ),
+    ]
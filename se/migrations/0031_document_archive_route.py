@@ -0,0 +1,43 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+# Generated by Django 4.2.23 on 2025-10-20 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("se", "0030_storage_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="archive_route",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("screenshot", "Screenshots"),
+                    ("html", "HTML snapshot"),
+                    ("download", "Download"),
+                    ("www", "Text"),
+                    ("words", "Words"),
+                ],
+                max_length=10,
+                null=True,
+            ),
+        ),
+    ]
@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import gzip
 import json
 import logging
 import os
@@ -26,6 +27,7 @@ from django.db import models
 from PIL import Image
 
 from .builtin import BuiltinModel
+from .storage_usage import StorageUsage
 from .utils import build_multiline_re, validate_multiline_re
 
 crawl_logger = logging.getLogger("crawler")
@@ -116,10 +118,18 @@ class MimePlugin(BuiltinModel):
         try:
             # Write the content from the page if necessary
             content_file = doc.get_content_file()
+            content = None
             if not content_file:
+                content = page.content
+            elif content_file.endswith(".gz"):
+                # Scripts receive the file as it was downloaded
+                with gzip.open(content_file, "rb") as fd:
+                    content = fd.read()
+
+            if content is not None:
                 extension = guess_extension(doc.mimetype)
                 with tempfile.NamedTemporaryFile(mode="wb+", suffix=f".{extension}", delete=False) as temp_file:
-                    temp_file.write(page.content)
+                    temp_file.write(content)
                     temp_file.flush()
                     temp_content_path = temp_file.name
                     content_file = temp_content_path
@@ -169,7 +179,8 @@ class MimePlugin(BuiltinModel):
                                             )
                                             dir_name = os.path.dirname(thumb_jpg)
                                             os.makedirs(dir_name, exist_ok=True)
-                                            img.save(thumb_jpg, "jpeg")
+                                            with StorageUsage.writing(StorageUsage.SCREENSHOTS, thumb_jpg):
+                                                img.save(thumb_jpg, "jpeg")
                                     else:
                                         raise Exception(f"Preview file {preview} does not exist")
                                 serializer = DocumentSerializer(doc, data=data, partial=True)
@@ -177,6 +188,7 @@ class MimePlugin(BuiltinModel):
                                 serializer.update(doc, serializer.validated_data)
                                 if preview:
                                     doc.has_thumbnail = True
+                                    doc.store_thumbnail()
                         except Exception as e:
                             doc.error = f"{doc.error or ''}\n{handler.name} processing error: {e}".strip()
                             doc.mime_plugins_result += f"{handler.name}:\n{stderr}\n\n"
@@ -35,6 +35,7 @@ from .builtin import BuiltinModel
 from .crawl_policy_backup import AuthFieldBackup, CrawlPolicyBackup  # noqa: F401
 from .document import Document
 from .online import online_status
+from .saved_search import SavedSearch, SavedSearchMatch  # noqa: F401
 from .url import absolutize_url, url_remove_fragment, url_remove_query_string
 
 crawl_logger = logging.getLogger("crawler")
@@ -94,12 +94,6 @@ class Page:
             base_url = url_remove_fragment(base_url)
         return base_url
 
-    def remove_nav_elements(self):
-        soup = self.get_soup()
-        for elem_type in NAV_ELEMENTS:
-            for elem in soup.find_all(elem_type):
-                elem.extract()
-
     def _get_elem_text(self, elem, recurse=False):
         s = ""
         if elem.name is None:
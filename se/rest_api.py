@@ -22,6 +22,7 @@ from django.db.models.functions import Coalesce
 from django.http import HttpResponse
 from drf_spectacular.utils import (
     OpenApiExample,
+    OpenApiParameter,
     OpenApiTypes,
     extend_schema,
     extend_schema_field,
@@ -40,9 +41,12 @@ from .collection import Collection
 from .document import Document, example_doc
 from .mime_plugin import MimePlugin
 from .models import CrawlerStats, WorkerStats
+from .rest_pagination import ScrollPagination
 from .rest_permissions import DjangoModelPermissionsRW, IsSuperUserOrStaff
-from .search import get_documents
+from .saved_search import SavedSearch
+from .search import get_documents, load_content
 from .search_form import FILTER_FIELDS, SORT, SearchForm
+from .storage_usage import StorageUsage
 from .tag import Tag
 from .url import sanitize_url, validate_url
 from .utils import mimetype_icon
@@ -75,16 +79,6 @@ class HddStatsSerializer(serializers.Serializer):
 class HddStatsViewSet(viewsets.ViewSet):
     permission_classes = [IsSuperUserOrStaff]
 
-    def dir_size(self, d):
-        # https://stackoverflow.com/questions/1392413/calculating-a-directorys-size-using-python
-        size = 0
-        for dirpath, dirnames, filenames in os.walk(d):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if not os.path.islink(fp):
-                    size += os.path.getsize(fp)
-        return size
-
     @extend_schema(
         description="HDD analytics",
         responses={
@@ -100,8 +94,9 @@ class HddStatsViewSet(viewsets.ViewSet):
         hdd_size = statvfs.f_frsize * statvfs.f_blocks
         hdd_free = statvfs.f_frsize * statvfs.f_bavail
 
-        screenshot_size = self.dir_size(settings.SOSSE_SCREENSHOTS_DIR)
-        html_size = self.dir_size(settings.SOSSE_HTML_SNAPSHOT_DIR)
+        sizes = StorageUsage.sizes()
+        screenshot_size = sizes[StorageUsage.SCREENSHOTS]
+        html_size = sizes[StorageUsage.HTML]
         hdd_other = hdd_size - hdd_free - db_size - screenshot_size - html_size
         return Response(
             {
@@ -267,12 +262,15 @@ class DocumentSerializer(serializers.ModelSerializer):
             "favicon",
             "robotstxt_rejected",
             "has_html_snapshot",
+            "archive_route",
             "redirect_url",
             "too_many_redirects",
             "screenshot_count",
             "screenshot_format",
             "screenshot_size",
+            "screenshot_digests",
             "has_thumbnail",
+            "thumbnail_digest",
             "crawl_first",
             "crawl_last",
             "crawl_next",
@@ -296,7 +294,8 @@ class DocumentSerializer(serializers.ModelSerializer):
     def get_tags_str(self, obj):
         if obj.id:
             # Accessing obj.tags thru many-to-many relation requires the object to exist
-            return ", ".join([tag.name for tag in obj.tags.order_by("name")])
+            # Sorted in Python to use the tags prefetched by the CSV export
+            return ", ".join(sorted(tag.name for tag in obj.tags.all()))
         return ""
 
     def user_doc_update(self, ctx_msg):
@@ -325,10 +324,15 @@ class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.w_content()
     serializer_class = DocumentSerializer
     permission_classes = [DjangoModelPermissionsRW]
+    pagination_class = ScrollPagination
 
     def create(self, request, *args, **kwargs):
         raise MethodNotAllowed("POST")
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        SavedSearch.percolate(serializer.instance)
+
 
 class SearchAdvancedQuery(serializers.Serializer):
     field = serializers.ChoiceField(choices=FILTER_FIELDS, default="doc", help_text="Field to filter on")
@@ -419,20 +423,53 @@ class SearchResult(DocumentSerializer):
         allow_null=True, help_text="Score of the document for provided search terms"
     )
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field in set(self.fields) - set(fields):
+                self.fields.pop(field)
+
     @extend_schema_field(OpenApiTypes.FLOAT)
     def get_score(self, obj):
         return getattr(obj, "rank", 1.0)
 
 
 class SearchViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
+    pagination_class = ScrollPagination
+
     @extend_schema(
         request=SearchQuery,
         description="Search queries",
+        parameters=[
+            OpenApiParameter(
+                "fields",
+                OpenApiTypes.STR,
+                description="Comma separated list of the fields of the results to return, like `id,url,title,score`",
+            ),
+            OpenApiParameter(
+                ScrollPagination.scroll_query_param,
+                OpenApiTypes.BOOL,
+                description="Enables the scroll mode: the next page is fetched by posting the same query to the `next` "
+                "link, which holds a cursor instead of an offset. The number of results is not returned in this mode.",
+            ),
+            OpenApiParameter(
+                ScrollPagination.cursor_query_param,
+                OpenApiTypes.STR,
+                description="The pagination cursor value, in scroll mode.",
+            ),
+        ],
         responses={
             200: SearchResult(many=True),
         },
     )
     def create(self, request, *args, **kwargs):
+        fields = None
+        if request.query_params.get("fields"):
+            fields = [field.strip() for field in request.query_params["fields"].split(",") if field.strip()]
+            unknown = set(fields) - set(SearchResult().fields)
+            if unknown:
+                raise ValidationError({"fields": f"Unknown fields: {', '.join(sorted(unknown))}"})
+
         query = SearchQuery(data=request.data)
         query.is_valid(raise_exception=True)
         f = SearchForm(
@@ -445,9 +482,12 @@ class SearchViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
             }
         )
         f.is_valid()
-        _, documents, _ = get_documents(request, query.validated_data["adv_params"], f, False)
+        # Cached results are ordered by their position in the cache, which cannot be used as a cursor
+        scroll = bool(request.query_params.get(ScrollPagination.scroll_query_param))
+        _, documents, _ = get_documents(request, query.validated_data["adv_params"], f, False, cache=not scroll)
+        documents = load_content(documents, fields)
         page = self.paginate_queryset(documents)
-        serializer = SearchResult(page, many=True)
+        serializer = SearchResult(page, many=True, fields=fields)
         return self.get_paginated_response(serializer.data)
 
 
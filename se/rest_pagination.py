@@ -0,0 +1,152 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ScrollPagination(LimitOffsetPagination):
+    """Limit/offset pagination, with a scroll mode enabled by the ``scroll``
+    query parameter.
+
+    In scroll mode, pages are selected with an opaque cursor holding the
+    sort key of the last result of the previous page and its id. Fetching
+    a page has a constant cost whatever its position, and results are not
+    shifted when documents are added or removed in previous pages."""
+
+    scroll_query_param = "scroll"
+    cursor_query_param = "cursor"
+    max_scroll_limit = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.scroll = bool(request.query_params.get(self.scroll_query_param))
+        if not self.scroll:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = min(self.get_limit(request) or self.max_scroll_limit, self.max_scroll_limit)
+        self.ordering = self._get_ordering(queryset)
+
+        values = self._decode_cursor(request, self.ordering)
+        if values is not None:
+            try:
+                queryset = queryset.filter(self._after(self.ordering, values))
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset.order_by(*self.ordering)[: self.limit + 1])
+        self.next_values = None
+        if len(results) > self.limit:
+            results = results[: self.limit]
+            self.next_values = [getattr(results[-1], field.lstrip("-")) for field in self.ordering]
+        return results
+
+    @staticmethod
+    def _get_ordering(queryset):
+        # The id is appended to make the sort key unique
+        ordering = [field for field in queryset.query.order_by if field not in ("id", "-id", "pk", "-pk")]
+        for field in ordering:
+            if not isinstance(field, str):
+                raise ValidationError({"scroll": "Scroll mode is not supported with this sort order"})
+        return [*ordering, "id"]
+
+    @staticmethod
+    def _after(ordering, values):
+        """Returns a filter on results sorted after ``values``, NULLs being
+        sorted last in ascending order and first in descending order, like
+        PostgreSQL does."""
+        after = None
+        for field, value in reversed(list(zip(ordering, values))):
+            name = field.lstrip("-")
+            descending = field.startswith("-")
+
+            if value is None:
+                greater = models.Q(**{f"{name}__isnull": False}) if descending else None
+                equal = models.Q(**{f"{name}__isnull": True})
+            else:
+                greater = models.Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+                if not descending and name != "id":
+                    greater |= models.Q(**{f"{name}__isnull": True})
+                equal = models.Q(**{name: value})
+
+            if after is not None:
+                equal &= after
+                after = equal if greater is None else greater | equal
+            else:
+                after = greater if greater is not None else models.Q(pk__in=[])
+        return after
+
+    def _encode_cursor(self, ordering, values):
+        # Dates are serialized with str() to keep their microseconds
+        cursor = json.dumps({"o": ordering, "v": values}, default=str)
+        return urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, request, ordering):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(cursor.encode("ascii")))
+            if cursor["o"] != ordering or len(cursor["v"]) != len(ordering):
+                raise ValueError("Ordering mismatch")
+            for value in cursor["v"]:
+                if value is not None and not isinstance(value, (str, int, float)):
+                    raise TypeError(f"Invalid cursor value {value!r}")
+            return cursor["v"]
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.scroll:
+            return super().get_next_link()
+
+        if self.next_values is None:
+            return None
+        cursor = self._encode_cursor(self.ordering, self.next_values)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if not self.scroll:
+            return super().get_paginated_response(data)
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            *super().get_schema_operation_parameters(view),
+            {
+                "name": self.scroll_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Enables the scroll mode: results are paginated with the cursor returned in the `next` "
+                "link, instead of an offset. The number of results is not returned in this mode.",
+                "schema": {"type": "boolean"},
+            },
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value, in scroll mode.",
+                "schema": {"type": "string"},
+            },
+        ]
@@ -0,0 +1,143 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import reverse
+from django.utils.timezone import now
+
+from .document import Document
+
+crawl_logger = logging.getLogger("crawler")
+
+# Documents checked by each query of percolate_documents()
+PERCOLATE_BATCH_SIZE = 1000
+
+
+class SavedSearch(models.Model):
+    """Search evaluated against documents when they are indexed, the
+    matching documents are recorded to be read by feeds."""
+
+    name = models.CharField(max_length=512)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    querystring = models.TextField(help_text="Query string of the search, as found in the URL of the search page")
+    enabled = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "saved searches"
+
+    def __str__(self):
+        return self.name
+
+    def _request(self):
+        request = HttpRequest()
+        request.GET = QueryDict(self.querystring)
+        request.user = self.user
+        return request
+
+    def _parse(self):
+        """Returns the request and the advanced search filters and form of
+        the search, or None when its query string is not valid."""
+        from .search import request_filters
+        from .search_form import SearchForm
+
+        request = self._request()
+        form = SearchForm(request.GET)
+        if not form.is_valid():
+            return None
+        return request, request_filters(request), form
+
+    @staticmethod
+    def _matching(parsed, doc_ids):
+        """Returns the ids among ``doc_ids`` of the documents part of the
+        results of the search ``parsed`` by _parse()."""
+        from .search import get_documents
+
+        if parsed is None:
+            return set()
+
+        request, params, form = parsed
+        documents = Document.objects.wo_content().filter(pk__in=doc_ids)
+        _, results, _ = get_documents(request, params, form, True, documents=documents)
+        return set(results.values_list("id", flat=True))
+
+    def matches(self, doc):
+        """Returns True when ``doc`` is part of the results of the search.
+
+        Only the filters of the search are checked, documents matching the
+        search terms with a low rank are not excluded."""
+        return doc.pk in self._matching(self._parse(), [doc.pk])
+
+    def documents(self):
+        """Returns the documents that matched the search."""
+        return Document.objects.wo_content().filter(savedsearchmatch__saved_search=self)
+
+    def atom_url(self):
+        return reverse("atom") + f"?saved_search={self.pk}"
+
+    @staticmethod
+    def percolate(doc):
+        """Records the saved searches matching ``doc``, and removes the
+        matches it does not satisfy anymore. Called when the document has
+        been indexed."""
+        SavedSearch.percolate_documents([doc.pk])
+
+    @staticmethod
+    def percolate_documents(doc_ids):
+        """Same as percolate() for the documents of ``doc_ids``, called when
+        documents are modified from the administration interface or the API.
+        Each saved search is parsed once and checked with one query per
+        batch of documents."""
+        saved_searches = [
+            (saved_search, saved_search._parse())
+            for saved_search in SavedSearch.objects.filter(enabled=True).select_related("user")
+        ]
+        if not saved_searches:
+            return
+
+        doc_ids = list(doc_ids)
+        for start in range(0, len(doc_ids), PERCOLATE_BATCH_SIZE):
+            batch = doc_ids[start : start + PERCOLATE_BATCH_SIZE]
+            for saved_search, parsed in saved_searches:
+                try:
+                    with transaction.atomic():
+                        matched = SavedSearch._matching(parsed, batch)
+                except Exception as e:  # noqa
+                    crawl_logger.error(f"Saved search {saved_search.name} failed on {len(batch)} documents: {e}")
+                    continue
+
+                date = now()
+                SavedSearchMatch.objects.bulk_create(
+                    [SavedSearchMatch(saved_search=saved_search, document_id=doc_id, date=date) for doc_id in matched],
+                    update_conflicts=True,
+                    unique_fields=("saved_search", "document"),
+                    update_fields=("date",),
+                )
+                SavedSearchMatch.objects.filter(saved_search=saved_search, document_id__in=batch).exclude(
+                    document_id__in=matched
+                ).delete()
+
+
+class SavedSearchMatch(models.Model):
+    saved_search = models.ForeignKey(SavedSearch, on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE)
+    date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("saved_search", "document")
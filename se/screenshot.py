@@ -13,7 +13,6 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
-from django.conf import settings
 from django.views.generic import TemplateView
 
 from .archive import ArchiveMixin
@@ -47,10 +46,8 @@ class ScreenshotFullView(ArchiveMixin, TemplateView):
             link.extern_url = self.request.build_absolute_uri("/html/" + link.extern_url)
 
         return context | {
-            "screenshot": settings.SOSSE_SCREENSHOTS_URL + "/" + self.doc.image_name(),
             "screenshot_size": self.doc.screenshot_size.split("x"),
-            "screenshot_format": self.doc.screenshot_format,
             "screenshot_mime": ("image/png" if self.doc.screenshot_format == "png" else "image/jpeg"),
             "links": links,
-            "screens": range(self.doc.screenshot_count),
+            "screens": self.doc.screenshot_urls(),
         }
@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import json
 import logging
 import re
 import uuid
@@ -22,15 +23,18 @@ from urllib.parse import urlparse, urlunparse
 from django.conf import settings
 from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
 from django.core.paginator import Paginator
-from django.db import models
+from django.db import connection, models
+from django.db.models.functions import Cast
 from django.http import QueryDict
+from django.utils.functional import cached_property
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
 from .collection import Collection
 from .document import Document, extern_link_flags, remove_accent
 from .html_asset import HTMLAsset
-from .models import SearchEngine, SearchHistory
+from .models import FavIcon, SearchEngine, SearchHistory
+from .search_cache import TOO_MANY_RESULTS, SearchCache
 from .search_form import FILTER_FIELDS, SearchForm
 from .tag import Tag
 from .utils import human_nb
@@ -38,7 +42,13 @@ from .views import RedirectException, UserView
 
 logger = logging.getLogger("web")
 
+# Columns without accents, searched by the advanced search filters, trigram indexed when pg_trgm is available
+NORMALIZED_FIELDS = {
+    "content": "normalized_content",
+    "title": "normalized_title",
+}
 FILTER_RE = "(ft|ff|fo|fv|fc)[0-9]+$"
+CONTENT_FIELDS = ("content", "normalized_content", "vector", "error")
 
 
 def remove_query_param(request, key, value=None):
@@ -77,7 +87,8 @@ def add_query_param(request, key, value):
     return urlunparse(url_parts)
 
 
-def get_documents_from_request(request, form, stats_call=False):
+def request_filters(request):
+    """Returns the advanced search filters of the query string of ``request``."""
     filters = {}
     for key, val in request.GET.items():
         if not re.match(FILTER_RE, key):
@@ -88,34 +99,111 @@ def get_documents_from_request(request, form, stats_call=False):
         f[key[:2]] = val
         filters[filter_no] = f
     keys = sorted(filters.keys())
-    params = [filters[k] for k in keys]
-    return get_documents(request, params, form, stats_call)
+    return [filters[k] for k in keys]
 
 
-def get_documents(request, params, form, stats_call):
+def get_documents_from_request(request, form, stats_call=False, documents=None):
+    params = request_filters(request)
+    return get_documents(request, params, form, stats_call, documents=documents)
+
+
+def load_content(results, fields=None):
+    """Loads the content columns listed in ``fields`` (all of them when
+    None) of documents returned by get_documents()."""
+    results = results.defer(None)
+    if fields is not None:
+        results = results.defer(*[field for field in CONTENT_FIELDS if field not in fields])
+    return results
+
+
+def get_documents(request, params, form, stats_call, cache=True, documents=None):
+    """Returns the documents matching a search, among ``documents`` when set
+    or among all documents otherwise."""
+    if stats_call or not cache or documents is not None or not SearchCache.enabled():
+        return _get_documents(request, params, form, stats_call, documents)
+
+    key = SearchCache.key(request, params, form)
+    cached = SearchCache.get(key)
+    if cached == TOO_MANY_RESULTS:
+        return _get_documents(request, params, form, stats_call)
+
+    if cached is None:
+        has_query, results, query = _get_documents(request, params, form, stats_call)
+        rows = list(results.values_list("id", "rank")[: settings.SOSSE_SEARCH_CACHE_MAX_RESULTS + 1])
+        if len(rows) > settings.SOSSE_SEARCH_CACHE_MAX_RESULTS:
+            SearchCache.set(key, TOO_MANY_RESULTS)
+            return has_query, results, query
+        SearchCache.set(key, (has_query, rows))
+    else:
+        has_query, rows = cached
+        query = search_query(form)
+    return has_query, SearchCache.queryset(rows), query
+
+
+def search_query(form):
+    q = remove_accent(form.cleaned_data.get("q", ""))
+    if not q:
+        return None
+    return SearchQuery(q, config=form.cleaned_data["l"], search_type="websearch")
+
+
+def filter_lookup(operator, case, value):
+    """Returns the lookup and the value matching an advanced search filter.
+
+    Case-insensitive matches are done with a regexp, Django's ``icontains``
+    and ``iexact`` lookups wrap the column in ``UPPER()`` which prevents the
+    use of the trigram indexes."""
+    if operator == "contain" and case:
+        return "__contains", value
+    elif operator == "contain" and not case:
+        return "__iregex", re.escape(value)
+    elif operator == "regexp" and case:
+        return "__regex", value
+    elif operator == "regexp" and not case:
+        return "__iregex", value
+    elif operator == "equal" and case:
+        return "__exact", value
+    elif operator == "equal" and not case:
+        return "__iregex", f"^{re.escape(value)}$"
+    raise Exception(f"Unknown operation {operator}")
+
+
+def document_text_filter(field, operator, case, value):
+    """Filter on the content or the title of documents, using their
+    normalized column which is indexed."""
+    param, pattern = filter_lookup(operator, case, value)
+    if case and operator == "regexp":
+        # A pattern may not match the text once accents are removed
+        return models.Q(**{field + param: pattern})
+
+    normalized_param, normalized_pattern = filter_lookup(operator, case, remove_accent(value))
+    qf = models.Q(**{NORMALIZED_FIELDS[field] + normalized_param: normalized_pattern})
+    if case:
+        # The normalized column selects the candidates through its index, accents are then checked on the original column
+        qf &= models.Q(**{field + param: pattern})
+    return qf
+
+
+def _get_documents(request, params, form, stats_call, documents=None):
     REQUIRED_KEYS = ("ft", "ff", "fo", "fv")
 
-    results = Document.objects.w_content().annotate(rank=models.Value(1.0))
+    # The content is not loaded, headlines are computed by add_headlines()
+    if documents is None:
+        documents = Document.objects.wo_content()
+    results = documents.annotate(rank=models.Value(1.0))
     has_query = False
 
-    q = form.cleaned_data.get("q", "")
-    q = remove_accent(q)
-    query = None
-    if q:
+    query = search_query(form)
+    if query is not None:
         has_query = True
-        lang = form.cleaned_data["l"]
-
-        query = SearchQuery(q, config=lang, search_type="websearch")
-        all_results = (
-            Document.objects.w_content()
-            .filter(vector=query)
-            .annotate(
-                rank=SearchRank(models.F("vector"), query),
-            )
+        # ts_rank() returns a float4, it is cast so that the rank of the
+        # scroll cursor compares equal when sent back
+        all_results = documents.filter(vector=query).annotate(
+            rank=Cast(SearchRank(models.F("vector"), query), models.FloatField()),
         )
         results = all_results.exclude(rank__lte=0.01)
 
-        if results.count() == 0:
+        if not results.exists():
             results = all_results
 
     include_hidden = form.cleaned_data.get("i", False) and True
@@ -145,30 +233,20 @@ def get_documents(request, params, form, stats_call):
         value = f["fv"]
         case = f.get("fc", False) and True
 
-        if operator == "contain" and case:
-            param = "__contains"
-        elif operator == "contain" and not case:
-            param = "__icontains"
-        elif operator == "regexp" and case:
-            param = "__regex"
-        elif operator == "regexp" and not case:
-            param = "__iregex"
-        elif operator == "equal" and case:
-            param = "__exact"
-        elif operator == "equal" and not case:
-            param = "__iexact"
-        else:
-            raise Exception(f"Unknown operation {operator}")
-
         if field not in list(dict(FILTER_FIELDS).keys()):
             fields = list(dict(FILTER_FIELDS).keys())
             raise Exception(f"Invalid FILTER_FIELDS {field} / {fields}")
 
+        param, pattern = filter_lookup(operator, case, value)
+
         if field == "doc":
-            content_param = {"content" + param: value}
-            title_param = {"title" + param: value}
-            url_param = {"url" + param: value}
-            qf = models.Q(**content_param) | models.Q(**title_param) | models.Q(**url_param)
+            qf = (
+                document_text_filter("content", operator, case, value)
+                | document_text_filter("title", operator, case, value)
+                | models.Q(**{"url" + param: pattern})
+            )
+        elif field in NORMALIZED_FIELDS:
+            qf = document_text_filter(field, operator, case, value)
         elif field in ("lto_url", "lto_txt", "lby_url", "lby_txt"):
             field, rel_field = field.split("_")
             subfield = "doc_to" if field == "lto" else "doc_from"
@@ -176,19 +254,15 @@ def get_documents(request, params, form, stats_call):
             if rel_field == "url":
                 key1 = f"{field}__{subfield}__url{param}"
                 key2 = f"{field}__extern_url{param}"
-                qf = models.Q(**{key1: value}) | models.Q(**{key2: value})
+                qf = models.Q(**{key1: pattern}) | models.Q(**{key2: pattern})
             else:
                 key = f"{field}__text{param}"
-                qf = models.Q(**{key: value})
+                qf = models.Q(**{key: pattern})
         elif field == "tag":
             key = f"name{param}"
-            _tags = Tag.objects.filter(**{key: value})
-            tags = set()
-            for tag in _tags:
-                tags |= set(Tag.get_tree(tag))
-            qf = models.Q(tags__in=tags)
+            qf = Tag.tree_filter(Tag.objects.filter(**{key: pattern}).only("path"))
         else:
-            qparams = {field + param: value}
+            qparams = {field + param: pattern}
             qf = models.Q(**qparams)
 
         if ftype == "exc":
@@ -203,7 +277,7 @@ def get_documents(request, params, form, stats_call):
 
     tags = form.cleaned_data.get("tag", [])
     for tag in tags:
-        results = results.filter(tags__in=Tag.get_tree(tag))
+        results = results.filter(Tag.tree_filter([tag]))
 
     doc_lang = form.cleaned_data.get("doc_lang")
     if doc_lang:
@@ -229,64 +303,123 @@ def get_documents(request, params, form, stats_call):
     return has_query, results, query
 
 
-def fallback_headline(doc):
-    lines = doc.content.splitlines()
-    if lines:
-        return lines[0]
-    return ""
+def estimate_count(queryset):
+    """Returns the number of rows of ``queryset`` estimated by the query
+    planner, without running the query."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class SearchPaginator(Paginator):
+    """Paginator counting at most ``SOSSE_SEARCH_COUNT_LIMIT`` results, pages
+    past the limit are not reachable."""
+
+    @cached_property
+    def _count(self):
+        limit = settings.SOSSE_SEARCH_COUNT_LIMIT
+        if not limit:
+            return self.object_list.count()
+        # Counting stops at the first result past the limit
+        return self.object_list[: limit + 1].count()
+
+    @property
+    def is_capped(self):
+        return bool(settings.SOSSE_SEARCH_COUNT_LIMIT) and self._count > settings.SOSSE_SEARCH_COUNT_LIMIT
+
+    @cached_property
+    def count(self):
+        if self.is_capped:
+            return settings.SOSSE_SEARCH_COUNT_LIMIT
+        return self._count
+
+    def human_count(self):
+        if not self.is_capped:
+            return human_nb(self.count)
+        if settings.SOSSE_SEARCH_COUNT_ESTIMATE:
+            return "~" + human_nb(max(estimate_count(self.object_list), self.count))
+        return human_nb(self.count) + "+"
+
+
+# Locates the headline computed on the normalized content in the non-normalized content, the
+# inner query is not flattened so that the headline is computed once
+HEADLINE_SQL = """SELECT id, headline, first_line,
+    SUBSTRING(content, NULLIF(STRPOS(normalized_content, {plain}), 0), LENGTH({plain})),
+    content <> ''
+FROM ({inner} OFFSET 0) AS h"""
+HEADLINE_PLAIN_SQL = "REPLACE(REPLACE(headline, %s, ''), %s, '')"
+
+
+def build_headline(pg_headline, content, first_line, rnd):
+    """Rebuilds the headline computed by Postgres on the normalized content,
+    ``content`` is the matching part of the non-normalized content."""
+    if content is None or "s" + rnd not in pg_headline or "e" + rnd not in pg_headline:
+        return first_line or ""
+
+    headline_idx = 0
+    src = pg_headline
+    dest = escape("")
+    while src:
+        txt, src = src.split("s" + rnd, 1)
+        dest += escape(content[headline_idx : headline_idx + len(txt)])
+        headline_idx += len(txt)
+
+        match, src = src.split("e" + rnd, 1)
+        dest += '<span class="res-highlight">'
+        dest += escape(content[headline_idx : headline_idx + len(match)])
+        headline_idx += len(match)
+        dest += "</span>"
+
+        if "s" + rnd not in src or "e" + rnd not in src:
+            dest += escape(content[headline_idx : headline_idx + len(src)])
+            break
+    return mark_safe(dest)  # nosec B308, B703 untrusted content is escaped above
 
 
 def add_headlines(paginated, query):
-    for res in paginated:
-        # rebuild the headline using non-normalized content
-        if query:
-            rnd = uuid.uuid1().hex
-            pg_headline = (
-                Document.objects.w_content()
-                .filter(id=res.id)
-                .annotate(
-                    headline=SearchHeadline(
-                        "normalized_content",
-                        query,
-                        start_sel="s" + rnd,
-                        stop_sel="e" + rnd,
-                    )
-                )
-                .first()
-            )
-
-            # find the location of the headline in the normalized content
-            headline = pg_headline.headline.replace("s" + rnd, "")
-            headline = headline.replace("e" + rnd, "")
-
-            if (
-                headline not in res.normalized_content
-                or "s" + rnd not in pg_headline.headline
-                or "e" + rnd not in pg_headline.headline
-            ):
-                res.headline = fallback_headline(res)
-                continue
-
-            headline_idx = res.normalized_content.index(headline)
-            src = pg_headline.headline
-            dest = escape("")
-            while src:
-                txt, src = src.split("s" + rnd, 1)
-                dest += escape(res.content[headline_idx : headline_idx + len(txt)])
-                headline_idx += len(txt)
-
-                match, src = src.split("e" + rnd, 1)
-                dest += '<span class="res-highlight">'
-                dest += escape(res.content[headline_idx : headline_idx + len(match)])
-                headline_idx += len(match)
-                dest += "</span>"
-
-                if "s" + rnd not in src or "e" + rnd not in src:
-                    dest += res.content[headline_idx : len(src)]
-                    break
-            res.headline = mark_safe(dest)  # nosec B308, B703 untrusted content is escaped above
+    """Sets the headline of the documents of a page, the content of the
+    documents is not loaded."""
+    results = list(paginated)
+    if not results:
+        return paginated
+
+    rnd = uuid.uuid1().hex
+    if query:
+        headline = SearchHeadline("normalized_content", query, start_sel="s" + rnd, stop_sel="e" + rnd)
+    else:
+        headline = models.Value(None, output_field=models.TextField())
+
+    inner = (
+        Document.objects.w_content()
+        .filter(id__in=[res.id for res in results])
+        .annotate(
+            headline=headline,
+            # first line of the content, used when no headline is found
+            first_line=models.Func(
+                models.F("content"), models.Value("^[^\r\n]*"), function="SUBSTRING", output_field=models.TextField()
+            ),
+        )
+        .values("id", "headline", "first_line", "content", "normalized_content")
+    )
+    inner_sql, inner_params = inner.query.sql_with_params()
+    sql = HEADLINE_SQL.format(plain=HEADLINE_PLAIN_SQL, inner=inner_sql)
+    params = ["s" + rnd, "e" + rnd] * 2 + list(inner_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        headlines = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    for res in results:
+        pg_headline, first_line, content, res.has_content = headlines.get(res.id, (None, "", None, False))
+        if pg_headline is None:
+            res.headline = first_line or ""
         else:
-            res.headline = fallback_headline(res)
+            # rebuild the headline using non-normalized content
+            res.headline = build_headline(pg_headline, content, first_line, rnd)
     return paginated
 
 
@@ -311,6 +444,7 @@ class SearchView(UserView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         results = []
+        results_count = "0"
         paginated = None
         q = None
         has_query = False
@@ -327,9 +461,14 @@ class SearchView(UserView):
                     raise RedirectException(redirect_url)
 
             has_query, results, query = get_documents_from_request(self.request, form)
-            paginator = Paginator(results, form.cleaned_data["ps"])
+            results = results.prefetch_related(
+                models.Prefetch("tags", queryset=Tag.objects.order_by("name"), to_attr="ordered_tags"),
+                models.Prefetch("favicon", queryset=FavIcon.objects.only("id", "missing")),
+            )
+            paginator = SearchPaginator(results, form.cleaned_data["ps"])
             page_number = self.request.GET.get("p")
             paginated = paginator.get_page(page_number)
+            results_count = paginator.human_count()
             paginated = add_headlines(paginated, query)
         else:
             form = SearchForm({})
@@ -343,6 +482,24 @@ class SearchView(UserView):
         )
 
         if paginated:
+            # Previews of images are looked up for the whole page
+            image_urls = [
+                r.url
+                for r in paginated
+                if not r.has_thumbnail
+                and not r.screenshot_count
+                and r.mimetype
+                and r.mimetype.startswith("image/")
+                and r.has_html_snapshot
+            ]
+            image_assets = {}
+            if image_urls:
+                # Descending order, so that the first asset of each url is kept
+                for url, filename in (
+                    HTMLAsset.objects.filter(url__in=image_urls).order_by("-id").values_list("url", "filename")
+                ):
+                    image_assets[url] = filename
+
             for r in paginated:
                 # Set default link target and source / archive link
                 if form.cleaned_data["c"]:
@@ -357,15 +514,14 @@ class SearchView(UserView):
                     r.extra_link_flag = ""
 
                 if r.has_thumbnail:
-                    r.preview = f"{settings.SOSSE_THUMBNAILS_URL}{r.image_name()}.jpg"
+                    r.preview = r.thumbnail_url()
                 elif r.screenshot_count:
-                    r.preview = f"{settings.SOSSE_SCREENSHOTS_URL}{r.image_name()}_0.{r.screenshot_format}"
-                elif r.mimetype and r.mimetype.startswith("image/") and r.has_html_snapshot:
-                    asset = HTMLAsset.objects.filter(url=r.url).first()
-                    if asset:
-                        preview_url = self.request.build_absolute_uri(settings.SOSSE_HTML_SNAPSHOT_URL) + asset.filename
-                        r.preview = preview_url
-                r.ordered_tags = r.tags.order_by("name")
+                    r.preview = r.screenshot_urls()[0]
+                elif r.url in image_assets:
+                    preview_url = (
+                        self.request.build_absolute_uri(settings.SOSSE_HTML_SNAPSHOT_URL) + image_assets[r.url]
+                    )
+                    r.preview = preview_url
                 for tag in r.ordered_tags:
                     tag.href = add_query_param(self.request, "tag", str(tag.id))
 
@@ -383,8 +539,8 @@ class SearchView(UserView):
             home_entries = Document.objects.wo_content().filter(show_on_homepage=True, hidden=False)
             if tags:
                 for tag in tags:
-                    home_entries = home_entries.filter(tags__in=Tag.get_tree(tag))
-                if not home_entries:
+                    home_entries = home_entries.filter(Tag.tree_filter([tag]))
+                if not home_entries.exists():
                     has_query = True
             home_entries = home_entries.order_by("title").distinct()
 
@@ -410,7 +566,7 @@ class SearchView(UserView):
             "hide_title": True,
             "form": form,
             "results": results,
-            "results_count": human_nb(len(results)),
+            "results_count": results_count,
             "paginated": paginated,
             "has_query": has_query,
             "home_entries": home_entries,
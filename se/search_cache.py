@@ -0,0 +1,133 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger("web")
+
+# Sequence bumped when documents are changed, cache entries of previous generations are not used anymore
+GENERATION_SEQUENCE = "se_index_generation"
+# Cached for searches having too many results, so that the results are not fetched for the cache again
+TOO_MANY_RESULTS = "too_many_results"
+
+
+class SearchCache:
+    """Caches the ids and ranks of search results, in the ``search`` cache
+    configured with the ``search_cache_*`` options."""
+
+    _lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+
+    @staticmethod
+    def enabled():
+        return settings.SOSSE_SEARCH_CACHE_TTL > 0
+
+    @staticmethod
+    def _generation_enabled():
+        # The generation also keys the cached tag counts
+        return SearchCache.enabled() or settings.SOSSE_TAG_COUNTS_CACHE_TTL > 0
+
+    @staticmethod
+    def bump_generation():
+        if not SearchCache._generation_enabled():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT nextval('{GENERATION_SEQUENCE}')")
+
+    @staticmethod
+    def invalidate():
+        """Bumps the generation when the current transaction is committed, so
+        that results read before the change is visible are not cached under
+        the new generation."""
+        if SearchCache._generation_enabled():
+            transaction.on_commit(SearchCache.bump_generation)
+
+    @staticmethod
+    def generation():
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT last_value FROM {GENERATION_SEQUENCE}")
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def key(request, params, form):
+        include_hidden = bool(form.cleaned_data.get("i")) and request.user.has_perm("se.document_change")
+        tags = sorted(tag.id for tag in form.cleaned_data.get("tag", []))
+        search = [
+            form.cleaned_data.get("q", ""),
+            form.cleaned_data.get("l"),
+            list(form.cleaned_data.get("order_by", [])),
+            form.cleaned_data.get("doc_lang"),
+            form.cleaned_data.get("collection"),
+            tags,
+            include_hidden,
+            params,
+        ]
+        digest = sha256(json.dumps(search, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return f"search:{SearchCache.generation()}:{digest}"
+
+    @classmethod
+    def get(cls, key):
+        value = caches["search"].get(key)
+        with cls._lock:
+            if value is None or value == TOO_MANY_RESULTS:
+                cls._misses += 1
+            else:
+                cls._hits += 1
+        logger.debug(f"search cache {'miss' if value is None else 'hit'} {key}: {cls.stats()}")
+        return value
+
+    @staticmethod
+    def set(key, value, ttl=None):
+        if ttl is None:
+            ttl = settings.SOSSE_SEARCH_CACHE_TTL
+        caches["search"].set(key, value, ttl)
+
+    @staticmethod
+    def queryset(rows):
+        """Returns the documents of ``rows``, a list of (id, rank), in the
+        order of the list."""
+        from .document import Document
+
+        ids = [row[0] for row in rows]
+        ranks = [row[1] for row in rows]
+        position = RawSQL("array_position(%s::bigint[], se_document.id::bigint)", (ids,))
+        return (
+            Document.objects.wo_content()
+            .filter(id__in=ids)
+            .annotate(rank=RawSQL(f"(%s::float8[])[{position.sql}]", (ranks, ids), output_field=models.FloatField()))
+            .order_by(position)
+        )
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            lookups = cls._hits + cls._misses
+            hit_ratio = 0.0
+            if lookups:
+                hit_ratio = cls._hits / lookups
+            return {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "hit_ratio": hit_ratio,
+            }
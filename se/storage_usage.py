@@ -0,0 +1,114 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import models, transaction
+
+crawl_logger = logging.getLogger("crawler")
+
+
+def file_size(path):
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def dir_size(d):
+    # https://stackoverflow.com/questions/1392413/calculating-a-directorys-size-using-python
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(d):
+        for f in filenames:
+            fp = os.path.join(dirpath, f)
+            if not os.path.islink(fp):
+                size += os.path.getsize(fp)
+    return size
+
+
+class StorageUsage(models.Model):
+    """Number of bytes used on disk by a category of files, updated when
+    files are written or removed."""
+
+    SCREENSHOTS = "screenshots"
+    HTML = "html"
+    CATEGORY = (
+        (SCREENSHOTS, "Screenshots"),
+        (HTML, "HTML archive"),
+    )
+
+    category = models.CharField(max_length=16, choices=CATEGORY, unique=True)
+    size = models.BigIntegerField(default=0)
+
+    @staticmethod
+    def _update(category, size):
+        if not StorageUsage.objects.filter(category=category).update(size=models.F("size") + size):
+            StorageUsage.objects.get_or_create(category=category)
+            StorageUsage.objects.filter(category=category).update(size=models.F("size") + size)
+
+    @staticmethod
+    def add(category, size):
+        if size:
+            # Updated after the commit so that the row is not locked for the whole transaction
+            transaction.on_commit(lambda: StorageUsage._update(category, size))
+
+    @staticmethod
+    @contextmanager
+    def writing(category, path):
+        """Accounts the size of ``path`` written in the ``with`` block, a
+        file being overwritten is accounted for its size difference."""
+        prev_size = file_size(path)
+        try:
+            yield
+        finally:
+            StorageUsage.add(category, file_size(path) - prev_size)
+
+    @staticmethod
+    def unlink(category, path):
+        size = os.stat(path).st_size
+        os.unlink(path)
+        StorageUsage.add(category, -size)
+
+    @staticmethod
+    def dirs():
+        return {
+            StorageUsage.SCREENSHOTS: settings.SOSSE_SCREENSHOTS_DIR,
+            StorageUsage.HTML: settings.SOSSE_HTML_SNAPSHOT_DIR,
+        }
+
+    @staticmethod
+    def sizes():
+        sizes = dict.fromkeys(StorageUsage.dirs().keys(), 0)
+        sizes.update(StorageUsage.objects.values_list("category", "size"))
+        return sizes
+
+    @staticmethod
+    def reconcile():
+        """Sets the counters to the size of the directories, to correct the
+        drift caused by files changed outside of Sosse or by crawlers being
+        killed."""
+        sizes = {}
+        for category, d in StorageUsage.dirs().items():
+            counted = StorageUsage.objects.filter(category=category).values_list("size", flat=True).first()
+            # Files written during the walk may be miscounted, until the next reconciliation
+            size = dir_size(d)
+            StorageUsage.objects.update_or_create(category=category, defaults={"size": size})
+            if counted is not None and counted != size:
+                crawl_logger.info(f"{category} storage usage corrected from {counted} to {size} bytes")
+            sizes[category] = size
+        return sizes
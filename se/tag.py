@@ -15,9 +15,13 @@
 
 from colorsys import hsv_to_rgb
 
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from treebeard.mp_tree import MP_Node, MP_NodeManager
 
+from .search_cache import SearchCache
 from .utils import human_nb
 
 
@@ -50,33 +54,69 @@ class Tag(MP_Node):
         return self.name
 
     @staticmethod
-    def tree_doc_counts():
-        from .document import Document
-
-        all_tags = list(Tag.get_tree())
-        tag_to_count = {}
+    def tree_filter(tags, field="tags"):
+        """Returns a filter matching objects whose ``field`` relation
+        contains one of ``tags`` or their descendants.
+
+        Descendants are matched with a prefix match on the materialized
+        path, served by the ``varchar_pattern_ops`` index PostgreSQL creates
+        for the unique path column, instead of listing them."""
+        paths = [tag.path for tag in tags]
+        if not paths:
+            return models.Q(**{f"{field}__in": []})
+
+        qf = models.Q()
+        for path in paths:
+            qf |= models.Q(**{f"{field}__path__startswith": path})
+        return qf
 
-        for tag in reversed(all_tags):
-            docs = Document.objects.wo_content().filter(tags=tag.pk)
-
-            # Exclude documents that are tagged with any of the descendants of the current tags
-            # This is to avoid counting documents that are tagged with both the current tag and its
-            # descendants
-            descendant_ids = tag.get_descendants().values_list("pk", flat=True)
-            if descendant_ids:
-                docs = docs.exclude(tags__in=descendant_ids)
+    @staticmethod
+    def _doc_paths():
+        """Returns the tag paths of documents, as a list of (paths, number of
+        documents tagged with exactly these paths)."""
+        from .document import Document
 
-            tag_to_count[tag.pk] = docs.distinct().count()
+        doc_tags = Document.tags.through._meta.db_table
+        tags = Tag._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""SELECT paths, COUNT(*) FROM (
+                    SELECT ARRAY_AGG({tags}.path ORDER BY {tags}.path) AS paths
+                    FROM {doc_tags} JOIN {tags} ON {tags}.id = {doc_tags}.tag_id
+                    GROUP BY {doc_tags}.document_id
+                ) AS doc_paths GROUP BY paths"""
+            )
+            return cursor.fetchall()
 
-        _total_counts = dict(tag_to_count)
+    @staticmethod
+    def tree_doc_counts():
+        """Returns the number of documents tagged with each tag or one of its
+        descendants."""
+        if settings.SOSSE_TAG_COUNTS_CACHE_TTL > 0:
+            key = f"tag_doc_counts:{SearchCache.generation()}"
+            total_counts = SearchCache.get(key)
+            if total_counts is None:
+                total_counts = Tag._tree_doc_counts()
+                SearchCache.set(key, total_counts, settings.SOSSE_TAG_COUNTS_CACHE_TTL)
+            return total_counts
+        return Tag._tree_doc_counts()
 
-        for tag in reversed(all_tags):
-            parent = tag.get_parent()
-            if parent:
-                _total_counts[parent.pk] = _total_counts.get(parent.pk, 0) + _total_counts.get(tag.pk, 0)
+    @staticmethod
+    def _tree_doc_counts():
+        path_counts = {}
+
+        # Documents are grouped by their set of tags, then counted once for each tag that is one of the tags or one of
+        # their ancestors
+        for paths, count in Tag._doc_paths():
+            ancestors = set()
+            for path in paths:
+                ancestors |= {path[:i] for i in range(Tag.steplen, len(path) + 1, Tag.steplen)}
+            for ancestor in ancestors:
+                path_counts[ancestor] = path_counts.get(ancestor, 0) + count
 
         total_counts = {}
-        for tag_pk, count in _total_counts.items():
+        for tag_pk, path in Tag.objects.values_list("pk", "path"):
+            count = path_counts.get(path, 0)
             total_counts[tag_pk] = {
                 "count": count,
                 "human_count": human_nb(count),
@@ -125,3 +165,9 @@ class Tag(MP_Node):
 
     def js_add_tag_onclick(self):
         return f"switch_tag({self.pk})"
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    SearchCache.invalidate()
@@ -60,7 +60,7 @@ class AtomTest(ViewsTestMixin, TransactionTestCase):
     def _atom_get_parsed(self, url: str) -> list[dict]:
         response = self._atom_get(url)
         self.assertEqual(response.status_code, 200, response)
-        parsed = feedparser.parse(response.content)
+        parsed = feedparser.parse(response.getvalue())
         return parsed["entries"]
 
     def test_simple_feed(self):
@@ -102,3 +102,48 @@ class AtomTest(ViewsTestMixin, TransactionTestCase):
                 self.assertEqual(entries[1]["link"], "http://127.0.0.1/snap/bin")
             else:
                 self.assertEqual(entries[1]["link"], "http://127.0.0.1/download/http://127.0.0.1/bin")
+
+    def test_conditional_get(self):
+        url = "/atom/?ft1=inc&ff1=doc&fo1=contain&fv1=content"
+        response = self._atom_get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+
+        request = self._request_from_factory(url, self.admin_user)
+        request.META["HTTP_IF_NONE_MATCH"] = etag
+        response = AtomView.as_view()(request)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        request = self._request_from_factory(url, self.admin_user)
+        request.META["HTTP_IF_MODIFIED_SINCE"] = last_modified
+        response = AtomView.as_view()(request)
+        self.assertEqual(response.status_code, 304)
+
+        # A newly crawled document changes the validators
+        Document.objects.wo_content().filter(url="http://127.0.0.1/bin").update(
+            crawl_last=timezone.now() + timedelta(minutes=1)
+        )
+        request = self._request_from_factory(url, self.admin_user)
+        request.META["HTTP_IF_NONE_MATCH"] = etag
+        response = AtomView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(feedparser.parse(response.getvalue())["entries"]), 2)
+
+    @override_settings(SOSSE_ATOM_FEED_SIZE=1)
+    def test_conditional_get_feed_window(self):
+        url = "/atom/?ft1=inc&ff1=doc&fo1=contain&fv1=content"
+        response = self._atom_get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # Documents past the end of the feed do not change the validators
+        Document.objects.wo_content().filter(url="http://127.0.0.1/bin").update(
+            crawl_last=timezone.now() + timedelta(minutes=1)
+        )
+        request = self._request_from_factory(url, self.admin_user)
+        request.META["HTTP_IF_NONE_MATCH"] = etag
+        response = AtomView.as_view()(request)
+        self.assertEqual(response.status_code, 304)
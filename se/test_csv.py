@@ -16,6 +16,7 @@
 import csv
 import io
 from datetime import timedelta
+from unittest import mock
 
 from django.core.exceptions import PermissionDenied
 from django.test import TransactionTestCase, override_settings
@@ -50,7 +51,7 @@ class CsvTest(ViewsTestMixin, TransactionTestCase):
     def _check_response(self, response):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "text/csv")
-        content = response.content.decode("utf-8")
+        content = response.getvalue().decode("utf-8")
 
         csv_reader = csv.reader(io.StringIO(content))
         csv_data = list(csv_reader)
@@ -72,7 +73,7 @@ class CsvTest(ViewsTestMixin, TransactionTestCase):
         response = CsvView.as_view()(request)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "text/csv")
-        content = response.content.decode("utf-8")
+        content = response.getvalue().decode("utf-8")
 
         csv_reader = csv.reader(io.StringIO(content))
         csv_data = list(csv_reader)
@@ -100,7 +101,7 @@ class CsvTest(ViewsTestMixin, TransactionTestCase):
         response = CsvView.as_view()(request)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "text/csv")
-        content = response.content.decode("utf-8")
+        content = response.getvalue().decode("utf-8")
 
         csv_reader = csv.reader(io.StringIO(content))
         csv_data = list(csv_reader)
@@ -114,6 +115,32 @@ class CsvTest(ViewsTestMixin, TransactionTestCase):
         self.assertEqual(csv_data[1]["metadata key2"], "value2")
         self.assertEqual(csv_data[1]["metadata key3"], "")
 
+    @override_settings(SOSSE_CSV_EXPORT_SIZE=0)
+    @mock.patch("se.csv.METADATA_SCAN_SIZE", 1)
+    def test_metadata_scan(self):
+        self.doc.metadata = {"key1": "value1"}
+        self.doc.save()
+        Document.objects.wo_content().create(
+            url="http://127.0.0.1/other",
+            title="title",
+            content="content new",
+            mimetype="text/html",
+            crawl_first=timezone.now() - timedelta(days=2),
+            crawl_last=timezone.now(),
+            metadata={"key1": "value2", "key2": "ignored"},
+            collection=self.collection,
+        )
+
+        request = self._request_from_factory("/csv/?ft1=inc&ff1=doc&fo1=contain&fv1=content", self.admin_user)
+        response = CsvView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        csv_data = list(csv.reader(io.StringIO(response.getvalue().decode("utf-8"))))
+        self.assertNotIn("metadata key2", csv_data[0])
+        csv_data = self._csv_to_dict(csv_data)
+        self.assertEqual([row["metadata key1"] for row in csv_data], ["value1", "value2"])
+
     @override_settings(SOSSE_CSV_EXPORT=False)
     def test_csv_disabled(self):
         request = self._request_from_factory("/csv/?ft1=inc&ff1=doc&fo1=contain&fv1=content", self.admin_user)
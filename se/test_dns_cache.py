@@ -0,0 +1,116 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import socket
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+
+from .dns_cache import DNSCache, create_connection
+
+
+class StubResolver:
+    def __init__(self, entries):
+        self.entries = entries
+        self.calls = []
+
+    def __call__(self, host, port):
+        self.calls.append(host)
+        entry = self.entries.get(host)
+        if entry is None:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (entry, port))]
+
+
+@override_settings(SOSSE_DNS_CACHE=True, SOSSE_DNS_CACHE_EXPIRY=300, SOSSE_DNS_CACHE_NEGATIVE_EXPIRY=30)
+class DNSCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.resolver = StubResolver(
+            {
+                "example.com": "127.0.0.2",
+                "other.example.com": "127.0.0.3",
+            }
+        )
+        self.orig_resolver = DNSCache.resolver
+        DNSCache.resolver = self.resolver
+        DNSCache.clear()
+
+    def tearDown(self):
+        DNSCache.resolver = self.orig_resolver
+        DNSCache.clear()
+
+    def _resolve(self, host):
+        return DNSCache.resolve(host, 80)[0][4][0]
+
+    def test_010_hit(self):
+        self.assertEqual(self._resolve("example.com"), "127.0.0.2")
+        self.assertEqual(self._resolve("example.com"), "127.0.0.2")
+        self.assertEqual(self.resolver.calls, ["example.com"])
+
+        stats = DNSCache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_020_expiry(self):
+        with mock.patch("se.dns_cache.monotonic") as monotonic:
+            monotonic.return_value = 1000
+            self._resolve("example.com")
+            monotonic.return_value = 1299
+            self._resolve("example.com")
+            self.assertEqual(self.resolver.calls, ["example.com"])
+
+            monotonic.return_value = 1301
+            self._resolve("example.com")
+            self.assertEqual(self.resolver.calls, ["example.com", "example.com"])
+
+    @mock.patch("se.dns_cache.DNS_CACHE_MAX_ENTRIES", 2)
+    def test_025_lru_eviction(self):
+        self._resolve("example.com")
+        self._resolve("other.example.com")
+        # example.com becomes the most recently used entry
+        self._resolve("example.com")
+        with self.assertRaises(socket.gaierror):
+            self._resolve("missing.example.com")
+
+        self.assertEqual(list(DNSCache._entries.keys()), [("example.com", 80), ("missing.example.com", 80)])
+
+    def test_030_negative_cache(self):
+        with mock.patch("se.dns_cache.monotonic") as monotonic:
+            monotonic.return_value = 1000
+            for _ in range(2):
+                with self.assertRaises(socket.gaierror):
+                    self._resolve("missing.example.com")
+            self.assertEqual(self.resolver.calls, ["missing.example.com"])
+            self.assertEqual(DNSCache.stats()["negative_hits"], 1)
+
+            monotonic.return_value = 1031
+            with self.assertRaises(socket.gaierror):
+                self._resolve("missing.example.com")
+            self.assertEqual(self.resolver.calls, ["missing.example.com", "missing.example.com"])
+
+    @mock.patch("se.dns_cache._create_connection")
+    def test_040_create_connection(self, _create_connection):
+        create_connection(("example.com", 80), timeout=10)
+        create_connection(("example.com", 80), timeout=10)
+        self.assertEqual(self.resolver.calls, ["example.com"])
+        _create_connection.assert_called_with(("127.0.0.2", 80), timeout=10)
+
+    @override_settings(SOSSE_DNS_CACHE=False)
+    @mock.patch("se.dns_cache._create_connection")
+    def test_050_disabled(self, _create_connection):
+        create_connection(("example.com", 80), timeout=10)
+        self.assertEqual(self.resolver.calls, [])
+        _create_connection.assert_called_with(("example.com", 80), timeout=10)
@@ -73,3 +73,21 @@ class DocumentTest(TransactionTestCase):
         Document.objects.wo_content().first().delete_all()
 
         self.assertEqual(HTMLAsset.objects.count(), 0)
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    def test_030_archive_route(self, BrowserRequest):
+        BrowserRequest.side_effect = BrowserMock({})
+
+        self._crawl("http://127.0.0.1/page.html")
+        self._crawl("http://127.0.0.1/image.png")
+
+        doc = Document.objects.wo_content().get(url="http://127.0.0.1/page.html")
+        self.assertEqual(doc.archive_route, "html")
+        with self.assertNumQueries(0):
+            self.assertEqual(doc.get_absolute_url(), f"/html/{self.collection.id}/http://127.0.0.1/page.html")
+
+        doc = Document.objects.wo_content().get(url="http://127.0.0.1/image.png")
+        self.assertEqual(doc.archive_route, "download")
+
+        doc.delete_all()
+        self.assertIsNone(doc.archive_route)
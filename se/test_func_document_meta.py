@@ -14,9 +14,7 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 import os
-from hashlib import md5
 
-from django.conf import settings
 from django.test import TransactionTestCase
 from PIL import Image
 
@@ -29,21 +27,7 @@ from .domain import Domain
 
 TEST_SERVER_DOMAIN = "127.0.0.1:8000"
 TEST_SERVER_URL = f"http://{TEST_SERVER_DOMAIN}/"
-TEST_SERVER_URL_MD5 = md5(TEST_SERVER_URL.encode("utf-8")).hexdigest()
-TEST_SERVER_THUMBNAIL_FILE = (
-    os.path.join(settings.SOSSE_THUMBNAILS_DIR, TEST_SERVER_URL_MD5[:2], TEST_SERVER_URL_MD5) + ".jpg"
-)
-
 TEST_SERVER_OGP_URL = f"{TEST_SERVER_URL}ogp/"
-TEST_SERVER_OGP_URL_MD5 = md5(TEST_SERVER_OGP_URL.encode("utf-8")).hexdigest()
-TEST_SERVER_OGP_THUMBNAIL_FILE = (
-    os.path.join(
-        settings.SOSSE_THUMBNAILS_DIR,
-        TEST_SERVER_OGP_URL_MD5[:2],
-        TEST_SERVER_OGP_URL_MD5,
-    )
-    + ".jpg"
-)
 
 
 class BaseFunctionalTest:
@@ -66,9 +50,8 @@ class BaseFunctionalTest:
         )
 
     def tearDown(self):
-        for f in (TEST_SERVER_THUMBNAIL_FILE, TEST_SERVER_OGP_THUMBNAIL_FILE):
-            if os.path.isfile(f):
-                os.unlink(f)
+        for doc in Document.objects.wo_content():
+            doc.delete_thumbnail()
 
     def _crawl(self):
         while Document.crawl(0):
@@ -94,7 +77,7 @@ class FunctionalTest(BaseFunctionalTest):
         self.assertEqual(doc.url, TEST_SERVER_OGP_URL)
         self.assertEqual(doc.error, "")
         self.assertTrue(doc.has_thumbnail)
-        self._assertCornerColorEqual(TEST_SERVER_OGP_THUMBNAIL_FILE, color)
+        self._assertCornerColorEqual(doc.thumbnail_file(), color)
 
     def test_10_thumbnail_preview(self):
         self.collection.thumbnail_mode = Collection.THUMBNAIL_MODE_PREVIEW
@@ -130,7 +113,7 @@ class BrowserBasedFunctionalTest(BaseFunctionalTest):
         self.assertEqual(doc.url, TEST_SERVER_OGP_URL)
         self.assertEqual(doc.error, "")
         self.assertTrue(doc.has_thumbnail)
-        self._assertCornerColorEqual(TEST_SERVER_OGP_THUMBNAIL_FILE, (255, 255, 255))
+        self._assertCornerColorEqual(doc.thumbnail_file(), (255, 255, 255))
 
     def test_20_thumbnail_fallback_preview(self):
         self.collection.thumbnail_mode = Collection.THUMBNAIL_MODE_PREV_OR_SCREEN
@@ -150,7 +133,7 @@ class BrowserBasedFunctionalTest(BaseFunctionalTest):
         self.assertEqual(doc.url, TEST_SERVER_URL)
         self.assertEqual(doc.error, "")
         self.assertTrue(doc.has_thumbnail)
-        self._assertCornerColorEqual(TEST_SERVER_THUMBNAIL_FILE, (255, 255, 255))
+        self._assertCornerColorEqual(doc.thumbnail_file(), (255, 255, 255))
 
 
 class RequestsFunctionalTest(FunctionalTest, TransactionTestCase):
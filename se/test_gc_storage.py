@@ -0,0 +1,100 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+
+from .collection import Collection
+from .document import Document
+from .html_asset import HTMLBlob
+from .image_blob import ImageBlob
+
+
+class GCStorageTest(TransactionTestCase):
+    def setUp(self):
+        self.html_dir = TemporaryDirectory()
+        self.screenshots_dir = TemporaryDirectory()
+        self.settings = override_settings(
+            SOSSE_HTML_SNAPSHOT_DIR=self.html_dir.name + "/",
+            SOSSE_SCREENSHOTS_DIR=self.screenshots_dir.name + "/",
+            SOSSE_THUMBNAILS_DIR=self.screenshots_dir.name + "/thumb/",
+        )
+        self.settings.enable()
+        self.collection = Collection.create_default()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.html_dir.cleanup()
+        self.screenshots_dir.cleanup()
+
+    def _write(self, path, content=b"content"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fd:
+            fd.write(content)
+        return path
+
+    def _gc(self, *args):
+        call_command("gc_storage", "--min-age", "0", *args, stdout=StringIO())
+
+    def test_010_html_archive(self):
+        HTMLBlob.objects.create(filename="http,3A/127.0.0.1/used.css", ref_count=1)
+        HTMLBlob.objects.create(filename="http,3A/127.0.0.1/archive.gz", ref_count=1)
+        used = self._write(settings.SOSSE_HTML_SNAPSHOT_DIR + "http,3A/127.0.0.1/used.css")
+        used_gz = self._write(settings.SOSSE_HTML_SNAPSHOT_DIR + "http,3A/127.0.0.1/used.css.gz")
+        archive = self._write(settings.SOSSE_HTML_SNAPSHOT_DIR + "http,3A/127.0.0.1/archive.gz")
+        orphan = self._write(settings.SOSSE_HTML_SNAPSHOT_DIR + "http,3A/127.0.0.1/orphan.css.gz")
+
+        self._gc("--dry-run")
+        self.assertTrue(os.path.exists(orphan))
+
+        self._gc()
+        self.assertTrue(os.path.exists(used))
+        self.assertTrue(os.path.exists(used_gz))
+        self.assertTrue(os.path.exists(archive))
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_020_images(self):
+        doc = Document.objects.wo_content().create(
+            url="http://127.0.0.1/",
+            collection=self.collection,
+            screenshot_count=1,
+            screenshot_format=Document.SCREENSHOT_JPG,
+            has_thumbnail=True,
+        )
+        legacy = self._write(f"{settings.SOSSE_SCREENSHOTS_DIR}{doc.image_name()}_0.jpg")
+        legacy_thumb = self._write(f"{settings.SOSSE_THUMBNAILS_DIR}{doc.image_name()}.jpg")
+        legacy_orphan = self._write(f"{settings.SOSSE_SCREENSHOTS_DIR}{doc.image_name()}_1.jpg")
+        thumb_orphan = self._write(f"{settings.SOSSE_THUMBNAILS_DIR}00/00{'0' * 30}.jpg")
+
+        blob = ImageBlob.blob_filename("blob/", "ab" * 32, "jpg")
+        ImageBlob.objects.create(filename=blob, ref_count=1)
+        blob = self._write(settings.SOSSE_SCREENSHOTS_DIR + blob)
+        blob_orphan = self._write(settings.SOSSE_SCREENSHOTS_DIR + ImageBlob.blob_filename("blob/", "cd" * 32, "jpg"))
+
+        self._gc()
+        for path in (legacy, legacy_thumb, blob):
+            self.assertTrue(os.path.exists(path), path)
+        for path in (legacy_orphan, thumb_orphan, blob_orphan):
+            self.assertFalse(os.path.exists(path), path)
+
+    def test_030_min_age(self):
+        orphan = self._write(settings.SOSSE_HTML_SNAPSHOT_DIR + "http,3A/127.0.0.1/orphan.css")
+        call_command("gc_storage", stdout=StringIO())
+        self.assertTrue(os.path.exists(orphan))
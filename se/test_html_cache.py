@@ -13,15 +13,18 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import gzip
+import os
 from datetime import timedelta
+from tempfile import TemporaryDirectory
 from unittest import mock
 
 from django.conf import settings
-from django.test import TransactionTestCase
+from django.test import TransactionTestCase, override_settings
 from django.utils import timezone
 
 from .collection import Collection
-from .html_asset import HTMLAsset
+from .html_asset import HTMLAsset, html_asset_path, html_asset_size, read_html_asset
 from .html_cache import CacheHit, CacheMiss, HTMLCache
 from .page import Page
 from .test_html_snapshot import GET_EXPECTED_HEADERS
@@ -482,3 +485,52 @@ class HTMLCacheTest(TransactionTestCase):
             _max_age_check.call_args_list,
         )
         self.assertTrue(_heuristic_check.call_args_list == [], _heuristic_check.call_args_list)
+
+    def test_110_cache_entries(self):
+        old = HTMLAsset.objects.create(url="http://127.0.0.1/a.png", filename="a1", download_date=timezone.now())
+        new = HTMLAsset.objects.create(
+            url="http://127.0.0.1/a.png", filename="a2", download_date=timezone.now() + timedelta(seconds=1)
+        )
+        HTMLAsset.objects.create(url="http://127.0.0.1/b.png", filename="b")
+
+        with self.assertNumQueries(1):
+            entries = HTMLCache.cache_entries(["http://127.0.0.1/a.png", "http://127.0.0.1/c.png"])
+        self.assertEqual(entries, {"http://127.0.0.1/a.png": new, "http://127.0.0.1/c.png": None})
+        self.assertNotEqual(entries["http://127.0.0.1/a.png"], old)
+
+        # Preloaded entries are used instead of querying the database
+        with self.assertNumQueries(0), self.assertRaises(CacheMiss):
+            HTMLCache._cache_check("http://127.0.0.1/c.png", self.collection, "http://127.0.0.1/", 0, entries)
+
+    def test_120_gzip(self):
+        with (
+            TemporaryDirectory() as tmp_dir,
+            override_settings(SOSSE_HTML_SNAPSHOT_DIR=tmp_dir + "/", SOSSE_HTML_GZIP=True),
+        ):
+            css = HTMLCache.write_asset(
+                "http://127.0.0.1/style.css", b"body { top: 0 }", None, mimetype="text/css", content_addressed=True
+            )
+            png = HTMLCache.write_asset(
+                "http://127.0.0.1/image.png", b"PNG", None, mimetype="image/png", content_addressed=True
+            )
+
+            css_path = tmp_dir + "/" + css.filename
+            self.assertFalse(os.path.exists(css_path))
+            self.assertEqual(html_asset_path(css.filename), css_path + ".gz")
+            with gzip.open(css_path + ".gz", "rb") as fd:
+                self.assertEqual(fd.read(), b"body { top: 0 }")
+            self.assertEqual(read_html_asset(css.filename), b"body { top: 0 }")
+            self.assertEqual(html_asset_size(css_path + ".gz"), len(b"body { top: 0 }"))
+
+            self.assertEqual(html_asset_path(png.filename), tmp_dir + "/" + png.filename)
+            self.assertEqual(read_html_asset(png.filename), b"PNG")
+            self.assertEqual(html_asset_size(tmp_dir + "/" + png.filename), len(b"PNG"))
+
+            # The same content is not written twice
+            HTMLCache.write_asset(
+                "http://127.0.0.1/style2.css", b"body { top: 0 }", None, mimetype="text/css", content_addressed=True
+            )
+            self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/style2.css").filename, css.filename)
+
+            HTMLAsset.remove_file_refs([css.filename, css.filename])
+            self.assertIsNone(html_asset_path(css.filename))
@@ -0,0 +1,138 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+
+from .html_asset import HTMLAsset, HTMLBlob
+from .html_cache import HTMLCache
+from .html_pack import HTMLPack
+
+
+class HTMLPackTest(TransactionTestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.settings = override_settings(
+            SOSSE_HTML_SNAPSHOT_DIR=self.tmp_dir.name + "/",
+            SOSSE_HTML_PACK_MAX_SIZE=16,
+            SOSSE_HTML_PACK_SEGMENT_SIZE=1,
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmp_dir.cleanup()
+
+    def _write(self, url, content, mimetype="image/png"):
+        return HTMLCache.write_asset(url, content, None, mimetype=mimetype, content_addressed=True)
+
+    def _url(self, asset):
+        return settings.SOSSE_HTML_SNAPSHOT_URL + asset.filename
+
+    def test_010_small_assets_packed(self):
+        small1 = self._write("http://127.0.0.1/small1.png", b"small content 1")
+        small2 = self._write("http://127.0.0.1/small2.png", b"small content 2")
+        large = self._write("http://127.0.0.1/large.png", b"larger than the pack max size")
+
+        self.assertEqual(HTMLPack.segments(), [1])
+        self.assertFalse(os.path.exists(settings.SOSSE_HTML_SNAPSHOT_DIR + small1.filename))
+        self.assertTrue(os.path.exists(settings.SOSSE_HTML_SNAPSHOT_DIR + large.filename))
+
+        blobs = list(
+            HTMLBlob.objects.order_by("id").values_list("pack_segment", "pack_offset", "pack_length", "mimetype")
+        )
+        self.assertEqual(blobs, [(1, 0, 15, "image/png"), (1, 15, 15, "image/png"), (None, None, None, None)])
+
+        self.assertEqual(HTMLPack.read(HTMLBlob.objects.get(filename=small2.filename)), b"small content 2")
+
+    def test_020_view(self):
+        asset = self._write("http://127.0.0.1/style.css", b"body { top: 0 }", "text/css")
+
+        response = self.client.get(self._url(asset))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"body { top: 0 }")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(self._url(asset), HTTP_RANGE="bytes=5-7")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b"{ t")
+        self.assertEqual(response["Content-Range"], "bytes 5-7/15")
+
+        response = self.client.get(self._url(asset), HTTP_RANGE="bytes=-3")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b"0 }")
+
+        response = self.client.get(self._url(asset), HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get(settings.SOSSE_HTML_SNAPSHOT_URL + "http,3A/127.0.0.1/missing.css")
+        self.assertEqual(response.status_code, 404)
+
+    def test_030_content_deduplicated(self):
+        asset1 = self._write("http://127.0.0.1/icon1.png", b"same content")
+        asset2 = self._write("http://127.0.0.1/icon2.png", b"same content")
+
+        self.assertEqual(asset1.filename, asset2.filename)
+        self.assertEqual(os.path.getsize(HTMLPack.segment_path(1)), 12)
+        self.assertEqual(HTMLBlob.objects.get().ref_count, 2)
+
+    @override_settings(SOSSE_HTML_PACK_SEGMENT_SIZE=0)
+    def test_040_unused_segment_removed(self):
+        # Each asset fills its pack file
+        asset1 = self._write("http://127.0.0.1/icon1.png", b"content 1")
+        asset2 = self._write("http://127.0.0.1/icon2.png", b"content 2")
+        self.assertEqual(HTMLPack.segments(), [1, 2])
+
+        HTMLAsset.remove_file_ref(asset1.filename)
+        self.assertEqual(HTMLPack.segments(), [2])
+        self.assertEqual(HTMLBlob.objects.get().filename, asset2.filename)
+
+    @override_settings(SOSSE_HTML_PACK_SEGMENT_SIZE=0)
+    def test_045_segment_being_appended(self):
+        self._write("http://127.0.0.1/icon1.png", b"content 1")
+
+        def _record(segment, offset):
+            # The pack file is sealed, but its content is not recorded yet
+            HTMLPack.remove_unused_segments([segment])
+            self.assertTrue(os.path.exists(HTMLPack.segment_path(segment)))
+
+        self.assertEqual(HTMLPack.append(b"content 2", _record), (2, 0))
+        self.assertEqual(HTMLPack.segments(), [1, 2])
+
+    def test_050_compaction(self):
+        assets = [self._write(f"http://127.0.0.1/icon{no}.png", f"content {no}".encode()) for no in range(3)]
+
+        # Seal the pack file
+        with open(HTMLPack.segment_path(1), "ab") as fd:
+            fd.truncate(1024 * 1024)
+        self.assertEqual(HTMLPack.current_segment(), 2)
+
+        HTMLAsset.remove_file_ref(assets[0].filename)
+        HTMLAsset.remove_file_ref(assets[2].filename)
+        self.assertEqual(HTMLPack.segments(), [1])
+
+        self.assertEqual(HTMLPack.compact(0.5, dry_run=True), 1024 * 1024 - 9)
+        self.assertEqual(HTMLPack.segments(), [1])
+
+        self.assertEqual(HTMLPack.compact(0.5), 1024 * 1024 - 9)
+        self.assertEqual(HTMLPack.segments(), [2])
+
+        blob = HTMLBlob.objects.get()
+        self.assertEqual((blob.pack_segment, blob.pack_offset), (2, 0))
+        self.assertEqual(HTMLPack.read(blob), b"content 1")
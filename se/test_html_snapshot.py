@@ -14,23 +14,27 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 import sys
+from base64 import b64decode
+from hashlib import sha256
 from unittest import mock
 
 import cssutils
 from django.conf import settings
 from django.shortcuts import reverse
 from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
 from django.utils.html import format_html
 from requests import HTTPError
 
 from .collection import Collection
 from .document import Document
 from .domain import Domain
-from .html_asset import HTMLAsset
+from .html_asset import HTMLAsset, HTMLBlob
 from .html_cache import HTML_SNAPSHOT_HASH_LEN, max_filename_size
-from .html_snapshot import HTMLSnapshot, css_parser, extract_css_url
+from .html_snapshot import HTMLSnapshot, css_parser, extract_css_url, stream_css_url
 from .page import Page
-from .test_mock import BrowserMock
+from .test_mock import PNG64, BrowserMock
+from .utils import http_date_format
 
 GET_EXPECTED_HEADERS = {
     "Accept": "*/*",
@@ -101,6 +105,30 @@ class HTMLSnapshotTest:
         dump = page.dump_html()
         self.assertEqual(dump, b"<html><head>\n            \n        </head><body>test</body></html>")
 
+    def test_045_sanitize_nav_elements(self):
+        HTML = b"""<html><head></head><body>
+            <nav><img src="/image.png"/></nav>
+            <div style="color: #fff">test</div>
+        </body></html>"""
+
+        for remove_nav, nav in (
+            (Collection.REMOVE_NAV_FROM_INDEX, '<nav><img src="/image.png"/></nav>'),
+            (Collection.REMOVE_NAV_FROM_ALL, ""),
+        ):
+            self.collection.remove_nav_elements = remove_nav
+            page = Page("http://127.0.0.1/", HTML, None)
+            snap = HTMLSnapshot(page, self.collection)
+            snap.sanitize()
+            self.assertEqual(
+                page.dump_html(),
+                f"""<html><head></head><body>
+            {nav}
+            <div style="color: #fff">test</div>
+        </body></html>""".encode(),
+            )
+            # Elements of the navigation are not handled when it is removed
+            self.assertEqual(len(snap.collect_assets()), 1 if nav else 0)
+
     def test_040_sanitize_attributes(self):
         HTML = b"""<html><head></head><body>
             <div data-test="other" onclick="console.log('test')"></div>
@@ -1190,7 +1218,7 @@ class HTMLSnapshotTest:
 
         HTMLAsset.remove_file_ref("filename")
         self.assertEqual(HTMLAsset.objects.count(), 2)
-        self.assertEqual(list(HTMLAsset.objects.values_list("ref_count", flat=True)), [1, 1])
+        self.assertEqual(list(HTMLAsset.objects.values_list("blob__ref_count", flat=True)), [1, 1])
         self.assertTrue(
             remove_html_asset_file.call_args_list == [],
             remove_html_asset_file.call_args_list,
@@ -1233,7 +1261,7 @@ class HTMLSnapshotTest:
 
         HTMLAsset.remove_file_ref("filename1")
         self.assertEqual(HTMLAsset.objects.count(), 1)
-        self.assertEqual(list(HTMLAsset.objects.values_list("ref_count", flat=True)), [1])
+        self.assertEqual(list(HTMLAsset.objects.values_list("blob__ref_count", flat=True)), [1])
         self.assertTrue(
             remove_html_asset_file.call_args_list == [mock.call(settings.SOSSE_HTML_SNAPSHOT_DIR + "filename1")],
             remove_html_asset_file.call_args_list,
@@ -1384,6 +1412,349 @@ class HTMLSnapshotTest:
             },
         )
 
+    def _snapshot_assets(self, HTML, BrowserRequest, cache_open):
+        BrowserRequest.reset_mock()
+        cache_open.reset_mock()
+        HTMLAsset.objects.all().delete()
+        page = Page("http://127.0.0.1/", HTML, None)
+        snap = HTMLSnapshot(page, self.collection)
+        snap.prefetch_assets()
+        snap.handle_assets()
+        self.assertEqual(snap._prefetched, {})
+        return page.dump_html(), snap.get_asset_urls()
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    @mock.patch("se.html_asset.open")
+    @mock.patch("se.html_cache.open")
+    def test_270_concurrent_download(self, cache_open, asset_open, makedirs, BrowserRequest):
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/nested.css": b'body {\n    background: url("/image3.png")\n    }',
+            }
+        )
+        makedirs.side_effect = None
+        cache_open.side_effect = lambda *args, **kwargs: open("/dev/null", *args[1:], **kwargs)
+        asset_open.side_effect = cache_open.side_effect
+
+        HTML = b"""<html><head>
+            <link rel="stylesheet" href="/nested.css"/>
+            <style>div { background: url('/image.jpg') }</style>
+        </head><body>
+            <img src="/image.png" srcset="/image2.png 2x"/>
+            <img src="/image.png"/>
+            <a href="/page.html">link</a>
+        </body></html>"""
+
+        dump, asset_urls = self._snapshot_assets(HTML, BrowserRequest, cache_open)
+        requests = sorted(BrowserRequest.call_args_list, key=lambda call: call.args[0])
+        writes = cache_open.call_args_list
+
+        with override_settings(SOSSE_HTML_ASSET_DOWNLOAD_THREADS=4):
+            self.assertEqual(self._snapshot_assets(HTML, BrowserRequest, cache_open), (dump, asset_urls))
+
+        # Requests are sent in any order, but with the same referers
+        self.assertEqual(sorted(BrowserRequest.call_args_list, key=lambda call: call.args[0]), requests)
+        self.assertEqual(len(requests), 5)
+        # Assets are written in the order of the page
+        self.assertEqual(cache_open.call_args_list, writes)
+
+    @override_settings(SOSSE_HTML_ASSET_DOWNLOAD_THREADS=4)
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    def test_280_concurrent_download_cache_hit(self, makedirs, BrowserRequest):
+        now = timezone.now().replace(microsecond=0)
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/image.png": (
+                    b"PNG",
+                    {"Date": http_date_format(now), "Cache-Control": "max-age=60"},
+                ),
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head></head><body>
+            <img src="/image.png"/>
+        </body></html>"""
+
+        for no in range(2):
+            page = Page(f"http://127.0.0.1/page{no}.html", HTML, None)
+            with (
+                mock.patch("se.html_asset.open", mock.mock_open()),
+                mock.patch("se.html_cache.open", mock.mock_open()),
+            ):
+                snap = HTMLSnapshot(page, self.collection)
+                snap.prefetch_assets()
+                # No reference is taken before the asset is used
+                if no == 1:
+                    self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/image.png").ref_count, 1)
+                snap.handle_assets()
+
+        self.assertEqual(len(BrowserRequest.call_args_list), 1)
+        self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/image.png").ref_count, 2)
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    def test_290_batched_cache_lookup(self, makedirs, BrowserRequest):
+        now = timezone.now().replace(microsecond=0)
+        headers = {"Date": http_date_format(now), "Cache-Control": "max-age=60"}
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/image.png": (b"PNG", headers),
+                "http://127.0.0.1/image2.png": (b"PNG test2", headers),
+                "http://127.0.0.1/image3.png": (b"PNG test3", headers),
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head></head><body>
+            <img src="/image.png"/>
+            <img src="/image2.png"/>
+            <img src="/image3.png"/>
+        </body></html>"""
+
+        for no in range(2):
+            page = Page(f"http://127.0.0.1/page{no}.html", HTML, None)
+            with (
+                mock.patch("se.html_asset.open", mock.mock_open()),
+                mock.patch("se.html_cache.open", mock.mock_open()),
+            ):
+                snap = HTMLSnapshot(page, self.collection)
+                if no == 0:
+                    snap.handle_assets()
+                else:
+                    # One query to look up the cache, two to lock the files and take the references
+                    with self.assertNumQueries(3):
+                        snap.handle_assets()
+
+        self.assertEqual(len(BrowserRequest.call_args_list), 3)
+        self.assertEqual(list(HTMLAsset.objects.values_list("blob__ref_count", flat=True)), [2, 2, 2])
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    @mock.patch("os.unlink")
+    @mock.patch("os.rmdir")
+    def test_300_pending_refs_cleared(self, rmdir, unlink, makedirs, BrowserRequest):
+        now = timezone.now().replace(microsecond=0)
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/image.png": (b"PNG", {"Date": http_date_format(now), "Cache-Control": "max-age=60"}),
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head></head><body>
+            <img src="/image.png"/>
+        </body></html>"""
+        with (
+            mock.patch("se.html_asset.open", mock.mock_open()),
+            mock.patch("se.html_cache.open", mock.mock_open()),
+        ):
+            HTMLSnapshot(Page("http://127.0.0.1/page1.html", HTML, None), self.collection).handle_assets()
+
+            # A failed snapshot drops the references that were not taken yet
+            snap = HTMLSnapshot(Page("http://127.0.0.1/page2.html", HTML, None), self.collection)
+            snap.download_asset("http://127.0.0.1/image.png", "http://127.0.0.1/")
+            self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/image.png").ref_count, 1)
+            snap._clear_assets()
+            snap._flush_refs()
+
+        self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/image.png").ref_count, 1)
+        self.assertEqual(unlink.call_args_list, [])
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    @mock.patch("os.unlink")
+    @mock.patch("os.rmdir")
+    def test_305_cache_hit_removed(self, rmdir, unlink, makedirs, BrowserRequest):
+        now = timezone.now().replace(microsecond=0)
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/image.png": (b"PNG", {"Date": http_date_format(now), "Cache-Control": "max-age=60"}),
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head></head><body>
+            <img src="/image.png"/>
+        </body></html>"""
+        with (
+            mock.patch("se.html_asset.open", mock.mock_open()),
+            mock.patch("se.html_cache.open", mock.mock_open()),
+        ):
+            HTMLSnapshot(Page("http://127.0.0.1/page1.html", HTML, None), self.collection).handle_assets()
+            filename = HTMLAsset.objects.get(url="http://127.0.0.1/image.png").filename
+
+            # The file is removed by another worker after the cache lookup
+            snap = HTMLSnapshot(Page("http://127.0.0.1/page2.html", HTML, None), self.collection)
+            snap._load_cache_entries()
+            HTMLAsset.remove_file_ref(filename)
+            self.assertEqual(HTMLBlob.objects.count(), 0)
+            snap.handle_assets()
+
+        # The asset is downloaded and written again, under the name the page points to
+        self.assertEqual(len(BrowserRequest.call_args_list), 2)
+        self.assertEqual(HTMLBlob.objects.get().filename, filename)
+        self.assertEqual(HTMLBlob.objects.get().ref_count, 1)
+        self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/image.png").ref_count, 1)
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    @mock.patch("os.unlink")
+    @mock.patch("os.rmdir")
+    def test_310_content_addressed_assets(self, rmdir, unlink, makedirs, BrowserRequest):
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/mirror/image.png": b64decode(PNG64),
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head></head><body>
+            <img src="/image.png"/>
+            <img src="/mirror/image.png"/>
+        </body></html>"""
+        page = Page("http://127.0.0.1/", HTML, None)
+        snap = HTMLSnapshot(page, self.collection)
+        mock_open = mock.mock_open()
+        with mock.patch("se.html_cache.open", mock_open):
+            snap.handle_assets()
+
+        # The content is stored once
+        PNG_FILENAME = "http,3A/127.0.0.1/image.png_62d75f74b8.png"
+        self.assertEqual(
+            {call.args[0] for call in mock_open.call_args_list}, {settings.SOSSE_HTML_SNAPSHOT_DIR + PNG_FILENAME}
+        )
+        self.assertEqual(page.dump_html().count(PNG_FILENAME.encode()), 2)
+        self.assertEqual(HTMLAsset.objects.count(), 2)
+        self.assertEqual(HTMLBlob.objects.count(), 1)
+        blob = HTMLBlob.objects.get()
+        self.assertEqual(blob.filename, PNG_FILENAME)
+        self.assertEqual(blob.content_hash, sha256(b64decode(PNG64)).hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+
+        HTMLAsset.objects.get(url="http://127.0.0.1/image.png").remove_ref()
+        self.assertEqual(HTMLBlob.objects.get().ref_count, 1)
+        self.assertEqual(unlink.call_args_list, [])
+
+        HTMLAsset.objects.get(url="http://127.0.0.1/mirror/image.png").remove_ref()
+        self.assertEqual(HTMLBlob.objects.count(), 0)
+        self.assertEqual(HTMLAsset.objects.count(), 0)
+        self.assertEqual(unlink.call_args_list, [mock.call(settings.SOSSE_HTML_SNAPSHOT_DIR + PNG_FILENAME)])
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    @mock.patch("os.unlink")
+    @mock.patch("os.rmdir")
+    def test_320_asset_manifest(self, rmdir, unlink, makedirs, BrowserRequest):
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/nested.css": b'body {\n    background: url("/image2.png")\n    }',
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head>
+            <link rel="stylesheet" href="/nested.css"/>
+        </head><body>
+            <img src="/image.png"/>
+        </body></html>"""
+        page = Page("http://127.0.0.1/", HTML, None)
+        with (
+            mock.patch("se.html_asset.open", mock.mock_open()),
+            mock.patch("se.html_cache.open", mock.mock_open()),
+        ):
+            HTMLSnapshot(page, self.collection).snapshot()
+
+        page_asset = HTMLAsset.objects.get(url="http://127.0.0.1/")
+        filenames = list(HTMLAsset.objects.exclude(id=page_asset.id).values_list("filename", flat=True))
+        self.assertEqual(len(filenames), 3)
+        self.assertEqual(page_asset.manifest, sorted(filenames))
+
+        # Deleting the snapshot does not read back the archived files
+        with (
+            mock.patch("se.html_asset.open") as _open,
+            mock.patch("se.html_asset.HTMLAsset.html_extract_assets") as html_extract_assets,
+        ):
+            HTMLAsset.html_delete_url("http://127.0.0.1/")
+            self.assertEqual(_open.call_args_list, [])
+            self.assertEqual(html_extract_assets.call_args_list, [])
+
+        self.assertEqual(HTMLAsset.objects.count(), 0)
+        self.assertEqual(HTMLBlob.objects.count(), 0)
+        self.assertEqual(
+            sorted(call.args[0] for call in unlink.call_args_list),
+            sorted(settings.SOSSE_HTML_SNAPSHOT_DIR + filename for filename in filenames + [page_asset.filename]),
+        )
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    @mock.patch("os.unlink")
+    @mock.patch("os.rmdir")
+    def test_325_cached_stylesheet_manifest(self, rmdir, unlink, makedirs, BrowserRequest):
+        now = timezone.now().replace(microsecond=0)
+        headers = {"Date": http_date_format(now), "Cache-Control": "max-age=60"}
+        BrowserRequest.side_effect = BrowserMock(
+            {
+                "http://127.0.0.1/nested.css": (b'body {\n    background: url("/image2.png")\n    }', headers),
+                "http://127.0.0.1/image2.png": (b"PNG", headers),
+            }
+        )
+        makedirs.side_effect = None
+
+        HTML = b"""<html><head>
+            <link rel="stylesheet" href="/nested.css"/>
+        </head><body></body></html>"""
+        with (
+            mock.patch("se.html_asset.open", mock.mock_open()),
+            mock.patch("se.html_cache.open", mock.mock_open()),
+        ):
+            for no in range(2):
+                HTMLSnapshot(Page(f"http://127.0.0.1/page{no}.html", HTML, None), self.collection).snapshot()
+
+        self.assertEqual(len(BrowserRequest.call_args_list), 2)
+        css = HTMLAsset.objects.get(url="http://127.0.0.1/nested.css")
+        image = HTMLAsset.objects.get(url="http://127.0.0.1/image2.png")
+        self.assertEqual(css.nested, [image.filename])
+
+        # The page using the cached stylesheet references its image too
+        page1 = HTMLAsset.objects.get(url="http://127.0.0.1/page1.html")
+        self.assertEqual(page1.manifest, sorted([css.filename, image.filename]))
+        self.assertEqual(image.ref_count, 2)
+
+        HTMLAsset.html_delete_url("http://127.0.0.1/page0.html")
+        self.assertEqual(HTMLAsset.objects.get(url="http://127.0.0.1/image2.png").ref_count, 1)
+        self.assertNotIn(mock.call(settings.SOSSE_HTML_SNAPSHOT_DIR + image.filename), unlink.call_args_list)
+
+        HTMLAsset.html_delete_url("http://127.0.0.1/page1.html")
+        self.assertEqual(HTMLAsset.objects.count(), 0)
+        self.assertEqual(HTMLBlob.objects.count(), 0)
+
+    def test_330_collect_assets_malformed_css(self):
+        HTML = b"""<html><head></head><body>
+            <div style="background: url(a.png">test</div>
+            <img src="/image.png"/>
+        </body></html>"""
+        snap = HTMLSnapshot(Page("http://127.0.0.1/", HTML, None), self.collection)
+
+        # The stylesheet that cannot be parsed is skipped
+        self.assertIn(("http://127.0.0.1/image.png", None), snap.collect_assets())
+
+    @mock.patch("se.browser_request.BrowserRequest.get")
+    @mock.patch("os.makedirs")
+    def test_340_prefetch_css_error(self, makedirs, BrowserRequest):
+        BrowserRequest.side_effect = BrowserMock({"http://127.0.0.1/style.css": b"body { color: #fff }"})
+        makedirs.side_effect = None
+        snap = HTMLSnapshot(Page("http://127.0.0.1/", b"<html></html>", None), self.collection)
+
+        # The error is returned to be handled by download_asset(), like other download errors
+        with mock.patch.object(HTMLSnapshot, "_css_asset_urls", side_effect=ValueError("invalid css")):
+            url, result, nested = snap._prefetch_asset("http://127.0.0.1/style.css", "http://127.0.0.1/", "text/css")
+        self.assertEqual(url, "http://127.0.0.1/style.css")
+        self.assertIsInstance(result, ValueError)
+        self.assertEqual(nested, [])
+
 
 class HTMLSnapshotCSSUtilsParser(HTMLSnapshotTest, TransactionTestCase):
     @classmethod
@@ -1404,6 +1775,21 @@ class HTMLSnapshotInternalCSSParser(HTMLSnapshotTest, TransactionTestCase):
     pass
 
 
+class HTMLSnapshotStreamCSSParser(HTMLSnapshotTest, TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        import se.html_snapshot
+
+        cls.InternalCSSParser = se.html_snapshot.InternalCSSParser
+        se.html_snapshot.InternalCSSParser = se.html_snapshot.StreamCSSParser
+
+    @classmethod
+    def tearDownClass(cls):
+        import se.html_snapshot
+
+        se.html_snapshot.InternalCSSParser = cls.InternalCSSParser
+
+
 class CSSUrlExtractor(TransactionTestCase):
     def test_css_url_extract(self):
         CSS = """@font-url { url('test'); }"""
@@ -1442,3 +1828,36 @@ class CSSUrlExtractor(TransactionTestCase):
 
         for no, segment in enumerate(extract_css_url(CSS)):
             self.assertEqual(segment, PARSED[no])
+
+
+class StreamCSSUrlExtractor(TransactionTestCase):
+    def _assert_parsed(self, css, parsed):
+        self.assertEqual(tuple(stream_css_url(css)), parsed)
+
+    def test_css_url_extract(self):
+        self._assert_parsed("""@font-url { url('test'); }""", ((False, "@font-url { "), (True, "test"), (False, "; }")))
+
+    def test_css_url_extract_quote(self):
+        self._assert_parsed(
+            """@font-url { url('te"st'); }""", ((False, "@font-url { "), (True, 'te"st'), (False, "; }"))
+        )
+
+    def test_css_url_extract_non_url(self):
+        CSS = """@font-url { url('data:image/png;base64,iV'); }"""
+        self._assert_parsed(CSS, ((False, CSS),))
+
+    def test_css_url_extract_escape(self):
+        self._assert_parsed(
+            r"""a { background: url('test\'plop'), url(te\2e st\ 2) }""",
+            ((False, "a { background: "), (True, "test'plop"), (False, ", "), (True, "te.st 2"), (False, " }")),
+        )
+
+    def test_css_url_extract_import(self):
+        self._assert_parsed(
+            """@import "a.css"; @import url(b.css) screen;""",
+            ((False, "@import "), (True, "a.css"), (False, "; @import "), (True, "b.css"), (False, " screen;")),
+        )
+
+    def test_css_url_extract_comments_strings(self):
+        CSS = """/* url(a.png) */ a { content: "url(b.png)" }"""
+        self._assert_parsed(CSS, ((False, CSS),))
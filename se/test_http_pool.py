@@ -0,0 +1,89 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+
+from .http_pool import HTTPPool
+
+
+class HTTPPoolTest(TransactionTestCase):
+    def setUp(self):
+        HTTPPool.close_all()
+
+    def tearDown(self):
+        HTTPPool.close_all()
+
+    def test_010_session_per_host(self):
+        s1 = HTTPPool.get_session("http://127.0.0.1/page1.html")
+        s2 = HTTPPool.get_session("http://127.0.0.1/page2.html")
+        s3 = HTTPPool.get_session("http://127.0.0.2/page1.html")
+        self.assertIs(s1, s2)
+        self.assertIsNot(s1, s3)
+        self.assertEqual(HTTPPool.stats()["hosts"], 2)
+
+        HTTPPool.close_all()
+        self.assertFalse(HTTPPool.has_sessions())
+
+    @override_settings(SOSSE_HTTP_POOL_MAXSIZE=42)
+    def test_020_pool_maxsize(self):
+        session = HTTPPool.get_session("http://127.0.0.1/")
+        self.assertEqual(session.get_adapter("http://127.0.0.1/")._pool_maxsize, 42)
+
+    @override_settings(SOSSE_HTTP_POOL_MAX_HOSTS=2)
+    def test_030_lru_eviction(self):
+        s1 = HTTPPool.get_session("http://127.0.0.1/")
+        HTTPPool.get_session("http://127.0.0.2/")
+        # Refresh 127.0.0.1 so that 127.0.0.2 becomes the least recently used
+        HTTPPool.get_session("http://127.0.0.1/")
+        HTTPPool.get_session("http://127.0.0.3/")
+
+        self.assertEqual(list(HTTPPool._sessions.keys()), ["127.0.0.1", "127.0.0.3"])
+        self.assertIs(HTTPPool.get_session("http://127.0.0.1/"), s1)
+
+    @override_settings(SOSSE_HTTP_POOL_IDLE_TIMEOUT=10)
+    def test_040_idle_eviction(self):
+        with mock.patch("se.http_pool.monotonic") as monotonic:
+            monotonic.return_value = 100
+            s1 = HTTPPool.get_session("http://127.0.0.1/")
+            monotonic.return_value = 105
+            HTTPPool.get_session("http://127.0.0.2/")
+            monotonic.return_value = 112
+            HTTPPool.get_session("http://127.0.0.2/")
+
+        self.assertEqual(list(HTTPPool._sessions.keys()), ["127.0.0.2"])
+        self.assertIsNot(HTTPPool.get_session("http://127.0.0.1/"), s1)
+
+    @override_settings(SOSSE_HTTP_POOL_MAX_HOSTS=1)
+    def test_045_in_use_eviction(self):
+        with mock.patch("requests.Session.close") as close:
+            with HTTPPool.use_session("http://127.0.0.1/"):
+                # The session is evicted while in use
+                HTTPPool.get_session("http://127.0.0.2/")
+                self.assertNotIn("127.0.0.1", HTTPPool._sessions)
+                close.assert_not_called()
+            close.assert_called_once()
+        self.assertEqual(HTTPPool._users, {})
+        self.assertEqual(HTTPPool._closing, {})
+
+    def test_050_stats(self):
+        HTTPPool.get_session("http://127.0.0.1/")
+        stats = HTTPPool.stats()
+        self.assertEqual(stats["hosts"], 1)
+        self.assertEqual(stats["requests"], 0)
+        self.assertEqual(stats["connections"], 0)
+        self.assertEqual(stats["reuse_ratio"], 0.0)
+        self.assertEqual(stats["open_sockets"], 0)
@@ -0,0 +1,136 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+from PIL import Image
+
+from .collection import Collection
+from .document import Document
+from .image_blob import ImageBlob
+
+
+class ImageBlobTest(TransactionTestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.settings = override_settings(
+            SOSSE_SCREENSHOTS_DIR=self.tmp_dir.name + "/",
+            SOSSE_THUMBNAILS_DIR=self.tmp_dir.name + "/thumb/",
+        )
+        self.settings.enable()
+        self.collection = Collection.create_default()
+        self.docs = [
+            Document.objects.wo_content().create(url=f"http://127.0.0.1/page{no}", collection=self.collection)
+            for no in range(2)
+        ]
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmp_dir.cleanup()
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fd:
+            fd.write(content)
+
+    def test_010_thumbnail_dedup(self):
+        for doc in self.docs:
+            self._write(os.path.join(settings.SOSSE_THUMBNAILS_DIR, doc.image_name()) + ".jpg", b"login wall")
+            doc.has_thumbnail = True
+            doc.store_thumbnail()
+
+        self.assertEqual(self.docs[0].thumbnail_digest, self.docs[1].thumbnail_digest)
+        self.assertEqual(self.docs[0].thumbnail_file(), self.docs[1].thumbnail_file())
+        self.assertFalse(
+            os.path.exists(os.path.join(settings.SOSSE_THUMBNAILS_DIR, self.docs[0].image_name()) + ".jpg")
+        )
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+        thumbnail = self.docs[0].thumbnail_file()
+        self.assertTrue(os.path.exists(thumbnail))
+        self.assertTrue(self.docs[0].thumbnail_url().startswith(settings.SOSSE_SCREENSHOTS_URL + "thumb/blob/"))
+
+        self.docs[0].delete_thumbnail()
+        self.assertIsNone(self.docs[0].thumbnail_digest)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(thumbnail))
+
+        self.docs[1].delete_thumbnail()
+        self.assertEqual(ImageBlob.objects.count(), 0)
+        self.assertFalse(os.path.exists(thumbnail))
+
+    def test_020_screenshot_dedup(self):
+        for doc in self.docs:
+            base_name = os.path.join(settings.SOSSE_SCREENSHOTS_DIR, doc.image_name())
+            self._write(f"{base_name}_0.png", b"header")
+            self._write(f"{base_name}_1.png", b"error page")
+            doc.screenshot_count = 2
+            doc.screenshot_format = Document.SCREENSHOT_PNG
+            doc._store_screenshots()
+
+        self.assertEqual(self.docs[0].screenshot_digests, self.docs[1].screenshot_digests)
+        self.assertEqual(ImageBlob.objects.count(), 2)
+        self.assertEqual(set(ImageBlob.objects.values_list("ref_count", flat=True)), {2})
+
+        urls = self.docs[0].screenshot_urls()
+        self.assertEqual(len(urls), 2)
+        for url in urls:
+            filename = url[len(settings.SOSSE_SCREENSHOTS_URL) :]
+            self.assertTrue(os.path.exists(settings.SOSSE_SCREENSHOTS_DIR + filename))
+
+        for doc in self.docs:
+            doc.delete_screenshot()
+            self.assertEqual(doc.screenshot_digests, [])
+        self.assertEqual(ImageBlob.objects.count(), 0)
+        for url in urls:
+            filename = url[len(settings.SOSSE_SCREENSHOTS_URL) :]
+            self.assertFalse(os.path.exists(settings.SOSSE_SCREENSHOTS_DIR + filename))
+
+    def test_030_legacy_screenshots(self):
+        doc = self.docs[0]
+        doc.screenshot_count = 1
+        doc.screenshot_format = Document.SCREENSHOT_JPG
+        self.assertEqual(doc.screenshot_urls(), [f"{settings.SOSSE_SCREENSHOTS_URL}{doc.image_name()}_0.jpg"])
+
+    def test_040_screenshot_index_jpg(self):
+        doc = self.docs[0]
+        self.assertEqual(self.collection.screenshot_format, Document.SCREENSHOT_JPG)
+        base_name = os.path.join(settings.SOSSE_SCREENSHOTS_DIR, doc.image_name())
+
+        def take_screenshots(collection, image_name):
+            os.makedirs(os.path.dirname(base_name), exist_ok=True)
+            for i in range(2):
+                Image.new("RGBA", (16, 16), (i, 0, 0, 255)).save(f"{base_name}_{i}.png", "png")
+            return 2
+
+        browser = mock.Mock()
+        browser.take_screenshots.side_effect = take_screenshots
+        browser.screen_size.return_value = (16, 16)
+        with mock.patch.object(Collection, "get_browser", return_value=browser):
+            doc.screenshot_index([])
+
+        self.assertEqual(doc.screenshot_format, Document.SCREENSHOT_JPG)
+        self.assertEqual(doc.screenshot_count, 2)
+        self.assertEqual(len(doc.screenshot_digests), 2)
+        for url in doc.screenshot_urls():
+            self.assertTrue(url.endswith(".jpg"))
+            self.assertTrue(os.path.exists(settings.SOSSE_SCREENSHOTS_DIR + url[len(settings.SOSSE_SCREENSHOTS_URL) :]))
+        for i in range(2):
+            self.assertFalse(os.path.exists(f"{base_name}_{i}.png"))
+            self.assertFalse(os.path.exists(f"{base_name}_{i}.jpg"))
@@ -14,17 +14,21 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 import json
+from base64 import urlsafe_b64encode
 from collections import namedtuple
 from unittest import mock
 
 from django.contrib.auth.models import User
+from django.db import models
 from django.test import Client, TransactionTestCase
 from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 
 from .collection import Collection
 from .document import Document
 from .mime_plugin import MimePlugin
 from .models import CrawlerStats
+from .rest_pagination import ScrollPagination
 from .tag import Tag
 from .webhook import Webhook
 
@@ -42,6 +46,7 @@ SERIALIZED_DOC1 = {
     "error_hash": "",
     "favicon": None,
     "has_html_snapshot": False,
+    "archive_route": None,
     "has_thumbnail": False,
     "hidden": False,
     "lang_iso_639_1": "en",
@@ -57,11 +62,13 @@ SERIALIZED_DOC1 = {
     "retries": 0,
     "robotstxt_rejected": False,
     "screenshot_count": 0,
+    "screenshot_digests": [],
     "screenshot_format": "",
     "screenshot_size": "",
     "show_on_homepage": False,
     "tags": [],
     "tags_str": "",
+    "thumbnail_digest": None,
     "title": "Title",
     "too_many_redirects": False,
     "url": "http://127.0.0.1/test",
@@ -192,6 +199,29 @@ class APIQueryTest(RestAPITest, TransactionTestCase):
         self.assertIn(self.doc2.id, doc_ids)
         self.assertIn(self.doc3.id, doc_ids)
 
+    def test_document_scroll(self):
+        response = self.client.get("/api/document/?scroll=1&limit=2")
+        self.assertEqual(response.status_code, 200, response.content)
+        data = json.loads(response.content)
+        self.assertEqual(set(data.keys()), {"next", "results"})
+        self.assertEqual([result["id"] for result in data["results"]], [self.doc1.id, self.doc2.id])
+
+        # Documents removed before the cursor do not shift the results
+        Document.objects.filter(id=self.doc1.id).delete()
+        response = self.client.get(data["next"])
+        self.assertEqual(response.status_code, 200, response.content)
+        data = json.loads(response.content)
+        self.assertEqual([result["id"] for result in data["results"]], [self.doc3.id])
+        self.assertIsNone(data["next"])
+
+        response = self.client.get("/api/document/?scroll=1&cursor=invalid")
+        self.assertEqual(response.status_code, 404, response.content)
+
+    def test_document_scroll_expression_ordering(self):
+        queryset = Document.objects.wo_content().order_by(models.F("title").desc())
+        with self.assertRaises(ValidationError):
+            ScrollPagination._get_ordering(queryset)
+
     def test_document_detail(self):
         response = self.client.get(f"/api/document/{self.doc1.id}/")
         self.assertEqual(response.status_code, 200, response.content)
@@ -316,6 +346,68 @@ class APIQueryTest(RestAPITest, TransactionTestCase):
             },
         )
 
+    def test_search_fields(self):
+        response = self.client.post("/api/search/?fields=id,url,title,score", {"query": "content"})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            json.loads(response.content)["results"],
+            [
+                {
+                    "id": self.doc1.id,
+                    "url": SERIALIZED_DOC1["url"],
+                    "title": SERIALIZED_DOC1["title"],
+                    "score": 0.12158542,
+                }
+            ],
+        )
+
+        response = self.client.post("/api/search/?fields=id,unknown", {"query": "content"})
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(json.loads(response.content), {"fields": "Unknown fields: unknown"})
+
+    def _search_scroll(self, url, query):
+        ids = []
+        for _ in range(10):
+            if not url:
+                break
+            response = self.client.post(url, query, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            data = json.loads(response.content)
+            self.assertLessEqual(len(data["results"]), 1)
+            ids += [result["id"] for result in data["results"]]
+            url = data["next"]
+        else:
+            self.fail(f"Scroll did not end: {ids}")
+        return ids
+
+    def test_search_scroll(self):
+        adv_params = [{"field": "url", "term": "test"}]
+        ids = self._search_scroll("/api/search/?scroll=1&limit=1", {"adv_params": adv_params, "sort": "crawl_last"})
+        self.assertEqual(ids, [self.doc1.id, self.doc2.id, self.doc3.id])
+
+        ids = self._search_scroll("/api/search/?scroll=1&limit=1", {"adv_params": adv_params, "sort": "-title"})
+        self.assertEqual(ids, [self.doc3.id, self.doc2.id, self.doc1.id])
+
+        # NULL values are part of the cursor
+        ids = self._search_scroll("/api/search/?scroll=1&limit=1", {"adv_params": adv_params, "sort": "modified_date"})
+        self.assertEqual(ids, [self.doc1.id, self.doc2.id, self.doc3.id])
+
+        # Default sort on the rank of the query
+        ids = self._search_scroll("/api/search/?scroll=1&limit=1", {"query": "content"})
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(set(ids), {self.doc1.id, self.doc2.id, self.doc3.id})
+
+    def test_search_scroll_invalid_cursor(self):
+        for values in ([{"a": 1}, "title", 1], [["a"], "title", 1], ["not a date", "title", 1]):
+            cursor = {"o": ["crawl_last", "title", "id"], "v": values}
+            cursor = urlsafe_b64encode(json.dumps(cursor).encode("utf-8"))
+            response = self.client.post(
+                f"/api/search/?scroll=1&cursor={cursor.decode('ascii')}",
+                {"adv_params": [{"field": "url", "term": "test"}], "sort": "crawl_last"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 404, response.content)
+
     def test_search_has_params(self):
         response = self.client.post("/api/search/", {})
         self.assertEqual(response.status_code, 400)
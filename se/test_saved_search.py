@@ -0,0 +1,159 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import feedparser
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .admin import clear_tags, switch_hidden, update_doc_tags
+from .atom import AtomView
+from .collection import Collection
+from .document import Document
+from .saved_search import SavedSearch, SavedSearchMatch
+from .tag import Tag
+from .test_views_mixin import ViewsTestMixin
+
+
+class SavedSearchTest(ViewsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.saved_search = SavedSearch.objects.create(
+            name="Cats", user=self.admin_user, querystring="q=cat&ft1=inc&ff1=url&fo1=contain&fv1=127.0.0.1"
+        )
+
+    def _index(self, url, content, **kwargs):
+        doc = Document.objects.wo_content().create(
+            url=url,
+            title=url,
+            content=content,
+            normalized_content=content,
+            crawl_first=timezone.now(),
+            crawl_last=timezone.now(),
+            collection=self.collection,
+            **kwargs,
+        )
+        SavedSearch.percolate(doc)
+        return doc
+
+    def test_010_percolate(self):
+        doc = self._index("http://127.0.0.1/cats", "The cat sat")
+        self._index("http://127.0.0.1/dogs", "The dog barked")
+        self._index("http://example.com/cats", "The cat sat")
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+        # Documents indexed again are matched only once
+        SavedSearch.percolate(doc)
+        self.assertEqual(SavedSearchMatch.objects.count(), 1)
+
+    def test_015_no_longer_matching(self):
+        doc = self._index("http://127.0.0.1/page", "The cat sat")
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+        # The document is indexed again with a content that does not match anymore
+        Document.objects.filter(pk=doc.pk).update(content="The dog barked", normalized_content="The dog barked")
+        SavedSearch.percolate(doc)
+        self.assertEqual(list(self.saved_search.documents()), [])
+
+    def test_020_disabled(self):
+        self.saved_search.enabled = False
+        self.saved_search.save()
+        self._index("http://127.0.0.1/cats", "The cat sat")
+        self.assertEqual(SavedSearchMatch.objects.count(), 0)
+
+    def test_030_hidden(self):
+        self.saved_search.user = self.simple_user
+        self.saved_search.querystring += "&i=on"
+        self.saved_search.save()
+        self._index("http://127.0.0.1/cats", "The cat sat", hidden=True)
+        self.assertEqual(SavedSearchMatch.objects.count(), 0)
+
+    def test_040_tags(self):
+        tag = Tag.objects.create(name="pets")
+        subtag = Tag.objects.create(name="felines", parent=tag)
+        self.saved_search.querystring = f"tag={tag.pk}"
+        self.saved_search.save()
+
+        doc = Document.objects.wo_content().create(
+            url="http://127.0.0.1/cats", crawl_last=timezone.now(), collection=self.collection
+        )
+        doc.tags.add(subtag)
+        SavedSearch.percolate(doc)
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+    def test_045_batch(self):
+        docs = [self._index(f"http://127.0.0.1/cat{i}", "The cat sat") for i in range(3)]
+        Document.objects.filter(pk=docs[0].pk).update(content="The dog barked", normalized_content="The dog barked")
+        SavedSearch.objects.create(name="Dogs", user=self.admin_user, querystring="q=dog")
+
+        with CaptureQueriesContext(connection) as queries:
+            SavedSearch.percolate_documents([doc.pk for doc in docs])
+        # The saved searches are checked with one query each for the whole batch
+        searches = [query for query in queries.captured_queries if 'FROM "se_document"' in query["sql"]]
+        self.assertEqual(len(searches), 2)
+
+        self.assertEqual(list(self.saved_search.documents().order_by("id")), docs[1:])
+        self.assertEqual(list(SavedSearch.objects.get(name="Dogs").documents()), [docs[0]])
+
+    def test_050_atom(self):
+        doc = self._index("http://127.0.0.1/cats", "The cat sat")
+        request = self._request_from_factory(f"/atom/?saved_search={self.saved_search.pk}", self.admin_user)
+        response = AtomView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        entries = feedparser.parse(response.getvalue())["entries"]
+        self.assertEqual([entry["link"] for entry in entries], [doc.url])
+
+        request = self._request_from_factory(f"/atom/?saved_search={self.saved_search.pk}", self.simple_user)
+        with self.assertRaises(PermissionDenied):
+            AtomView.as_view()(request)
+
+    def test_060_admin_actions(self):
+        self.saved_search.user = self.simple_user
+        self.saved_search.save()
+        doc = self._index("http://127.0.0.1/cats", "The cat sat")
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+        switch_hidden(None, None, Document.objects.wo_content().filter(pk=doc.pk))
+        self.assertEqual(list(self.saved_search.documents()), [])
+        switch_hidden(None, None, Document.objects.wo_content().filter(pk=doc.pk))
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+        tag = Tag.objects.create(name="pets")
+        self.saved_search.querystring = f"tag={tag.pk}"
+        self.saved_search.save()
+        doc.tags.add(tag)
+        SavedSearch.percolate(doc)
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+        clear_tags(None, None, Document.objects.wo_content().filter(pk=doc.pk))
+        self.assertEqual(list(self.saved_search.documents()), [])
+
+        self.collection.unlimited_regex = "http://127.0.0.1/.*"
+        self.collection.save()
+        self.collection.tags.add(tag)
+        update_doc_tags(None, None, Collection.objects.filter(pk=self.collection.pk))
+        self.assertEqual(list(self.saved_search.documents()), [doc])
+
+    def test_070_api_update(self):
+        doc = self._index("http://127.0.0.1/page", "The dog barked")
+        self.assertEqual(list(self.saved_search.documents()), [])
+
+        response = self.admin_client.patch(
+            f"/api/document/{doc.pk}/", {"content": "The cat sat"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(self.saved_search.documents()), [doc])
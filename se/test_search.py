@@ -15,15 +15,20 @@
 
 from io import StringIO
 
+from django.contrib import admin
 from django.contrib.auth.models import User
 from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
 from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from .admin import DocumentAdmin, clear_tags, clear_update_doc_tags, update_doc_tags
 from .collection import Collection
 from .document import Document
 from .models import Link, SearchEngine
-from .search import add_headlines, get_documents_from_request
+from .search import SearchPaginator, add_headlines, get_documents_from_request
+from .search_cache import SearchCache
 from .search_form import SearchForm
 from .tag import Tag
 
@@ -217,7 +222,114 @@ class SearchTest(TransactionTestCase):
         docs = add_headlines(docs, query)
         self.assertEqual(docs.count(), 1)
         self.assertEqual(docs[0], self.page)
-        self.assertEqual(docs[0].headline, 'Page1, World <span class="res-highlight">Télé</span>')
+        self.assertEqual(docs[0].headline, 'Page1, World <span class="res-highlight">Télé</span> one three')
+
+    def test_022_headline_single_query(self):
+        request = WSGIRequest({"REQUEST_METHOD": "GET", "QUERY_STRING": "q=one", "wsgi.input": StringIO("")})
+        request.user = self.admin
+        form = SearchForm(request.GET)
+        self.assertTrue(form.is_valid())
+        _, docs, query = get_documents_from_request(request, form)
+        docs = list(docs)
+        self.assertEqual(len(docs), 4)
+
+        with self.assertNumQueries(1):
+            add_headlines(docs, query)
+        for doc in docs:
+            self.assertIn('<span class="res-highlight">one</span>', doc.headline)
+
+    @override_settings(SOSSE_SEARCH_COUNT_LIMIT=2)
+    def test_023_capped_count(self):
+        docs = self._search_docs("q=one")
+        paginator = SearchPaginator(docs, 1)
+        self.assertEqual(paginator.count, 2)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(paginator.human_count(), "2+")
+
+        with override_settings(SOSSE_SEARCH_COUNT_LIMIT=0):
+            paginator = SearchPaginator(docs, 1)
+            self.assertEqual(paginator.count, 4)
+            self.assertEqual(paginator.human_count(), "4")
+
+    @override_settings(SOSSE_SEARCH_CACHE_TTL=60)
+    def test_024_cache(self):
+        hits = SearchCache.stats()["hits"]
+        docs = self._search_docs("q=one")
+        expected = list(docs.values_list("id", "rank"))
+        self.assertEqual(len(expected), 4)
+
+        docs = self._search_docs("q=one")
+        self.assertEqual(SearchCache.stats()["hits"], hits + 1)
+        self.assertEqual(list(docs.values_list("id", "rank")), expected)
+
+        # Modified documents invalidate the cache
+        self.root.title = "Root page"
+        self.root.save()
+        docs = self._search_docs("q=one")
+        self.assertEqual(SearchCache.stats()["hits"], hits + 1)
+
+        # Changes of the crawler bookkeeping do not
+        self.root.crawl_next = timezone.now()
+        self.root.save()
+        Document.objects.wo_content().get(id=self.root.id).save()
+        self._search_docs("q=one")
+        self.assertEqual(SearchCache.stats()["hits"], hits + 2)
+
+        with override_settings(SOSSE_SEARCH_CACHE_MAX_RESULTS=2):
+            self.page.title = "Page"
+            self.page.save()
+            with CaptureQueriesContext(connection) as first:
+                self._search_docs("q=one")
+            with CaptureQueriesContext(connection) as second:
+                self._search_docs("q=one")
+            self.assertEqual(SearchCache.stats()["hits"], hits + 2)
+            # The results are not fetched for the cache again
+            self.assertEqual(len(second), len(first) - 1)
+
+    @override_settings(SOSSE_SEARCH_CACHE_TTL=60)
+    def test_024_cache_admin_actions(self):
+        docs = self._search_docs(f"tag={self.tag1.id}")
+        self.assertEqual(docs.count(), 2)
+
+        clear_tags(None, None, Document.objects.filter(id=self.tagged_page.id))
+        docs = self._search_docs(f"tag={self.tag1.id}")
+        self.assertEqual(list(docs), [self.tagged_page2])
+
+        self.collection.unlimited_regex = "http://127.0.0.1/tagged$"
+        self.collection.save()
+        self.collection.tags.set([self.tag3])
+        update_doc_tags(None, None, Collection.objects.filter(id=self.collection.id))
+        docs = self._search_docs(f"tag={self.tag3.id}")
+        self.assertEqual(list(docs), [self.tagged_page])
+
+        clear_update_doc_tags(None, None, Collection.objects.filter(id=self.collection.id))
+        docs = self._search_docs(f"tag={self.tag1.id}")
+        self.assertEqual(list(docs), [self.tagged_page2])
+
+        DocumentAdmin(Document, admin.site).delete_queryset(None, Document.objects.filter(id=self.tagged_page2.id))
+        docs = self._search_docs(f"tag={self.tag1.id}")
+        self.assertEqual(docs.count(), 0)
+
+    def test_025_filter_normalized(self):
+        # Case-insensitive matches ignore accents
+        docs = self._search_docs("ft1=inc&ff1=content&fo1=contain&fv1=tele")
+        self.assertEqual(list(docs), [self.page])
+        docs = self._search_docs("ft1=inc&ff1=doc&fo1=equal&fv1=page1, world tele one three")
+        self.assertEqual(list(docs), [self.page])
+
+        # Case-sensitive matches keep them
+        docs = self._search_docs("ft1=inc&ff1=content&fo1=contain&fv1=Tele&fc1=on")
+        self.assertEqual(docs.count(), 0)
+        docs = self._search_docs("ft1=inc&ff1=content&fo1=contain&fv1=Télé&fc1=on")
+        self.assertEqual(list(docs), [self.page])
+        docs = self._search_docs("ft1=inc&ff1=content&fo1=regexp&fv1=T.l.&fc1=on")
+        self.assertEqual(list(docs), [self.page])
+
+        # Regexp characters are matched literally
+        docs = self._search_docs("ft1=inc&ff1=url&fo1=contain&fv1=127.0.0.1/page")
+        self.assertEqual(list(docs), [self.page])
+        docs = self._search_docs("ft1=inc&ff1=url&fo1=contain&fv1=127.0.0.1/pag.")
+        self.assertEqual(docs.count(), 0)
 
     def test_030_hidden(self):
         self.root.hidden = True
@@ -0,0 +1,73 @@
+# Copyright 2025 Laurent Defert
+#
+#  This file is part of Sosse.
+#
+# Sosse is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Sosse is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Sosse.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+
+from .html_asset import HTMLAsset
+from .html_cache import HTMLCache
+from .storage_usage import StorageUsage
+
+
+class StorageUsageTest(TransactionTestCase):
+    def setUp(self):
+        self.html_dir = TemporaryDirectory()
+        self.screenshots_dir = TemporaryDirectory()
+        self.settings = override_settings(
+            SOSSE_HTML_SNAPSHOT_DIR=self.html_dir.name + "/",
+            SOSSE_SCREENSHOTS_DIR=self.screenshots_dir.name + "/",
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.html_dir.cleanup()
+        self.screenshots_dir.cleanup()
+
+    def test_010_html_archive(self):
+        asset = HTMLCache.write_asset(
+            "http://127.0.0.1/style.css", b"body {}", None, mimetype="text/css", content_addressed=True
+        )
+        self.assertEqual(StorageUsage.sizes(), {StorageUsage.SCREENSHOTS: 0, StorageUsage.HTML: 7})
+
+        HTMLAsset.remove_file_ref(asset.filename)
+        self.assertEqual(StorageUsage.sizes(), {StorageUsage.SCREENSHOTS: 0, StorageUsage.HTML: 0})
+
+    def test_020_writing(self):
+        path = settings.SOSSE_SCREENSHOTS_DIR + "screen.png"
+        with StorageUsage.writing(StorageUsage.SCREENSHOTS, path), open(path, "wb") as fd:
+            fd.write(b"0123456789")
+        self.assertEqual(StorageUsage.sizes()[StorageUsage.SCREENSHOTS], 10)
+
+        # Overwritten files are accounted for the size difference
+        with StorageUsage.writing(StorageUsage.SCREENSHOTS, path), open(path, "wb") as fd:
+            fd.write(b"01234")
+        self.assertEqual(StorageUsage.sizes()[StorageUsage.SCREENSHOTS], 5)
+
+        StorageUsage.unlink(StorageUsage.SCREENSHOTS, path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(StorageUsage.sizes()[StorageUsage.SCREENSHOTS], 0)
+
+    def test_030_reconcile(self):
+        StorageUsage.add(StorageUsage.HTML, 1234)
+        os.makedirs(settings.SOSSE_SCREENSHOTS_DIR + "ab")
+        with open(settings.SOSSE_SCREENSHOTS_DIR + "ab/screen.png", "wb") as fd:
+            fd.write(b"012")
+
+        self.assertEqual(StorageUsage.reconcile(), {StorageUsage.SCREENSHOTS: 3, StorageUsage.HTML: 0})
+        self.assertEqual(StorageUsage.sizes(), {StorageUsage.SCREENSHOTS: 3, StorageUsage.HTML: 0})
@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License along with Sosse.
 # If not, see <https://www.gnu.org/licenses/>.
 
-from django.test import TransactionTestCase
+from django.test import TransactionTestCase, override_settings
 
 from .document import Document
 from .search import add_query_param, remove_query_param
@@ -72,3 +72,55 @@ class TagTest(ViewsTestMixin, TransactionTestCase):
                 tag4.pk: {"count": 1, "human_count": "1"},
             },
         )
+
+    @override_settings(SOSSE_TAG_COUNTS_CACHE_TTL=0)
+    def test_tree_doc_counts_siblings(self):
+        tag1 = Tag.objects.create(name="Tag 1")
+        tag2 = Tag.objects.create(name="Tag 2", parent=tag1)
+        tag3 = Tag.objects.create(name="Tag 3", parent=tag1)
+
+        doc = Document.objects.create(url="http://example.com/doc1", collection=self.collection)
+        doc.tags.set([tag2, tag3])
+
+        with self.assertNumQueries(2):
+            doc_counts = Tag.tree_doc_counts()
+        self.assertEqual(doc_counts[tag1.pk]["count"], 1)
+        self.assertEqual(doc_counts[tag2.pk]["count"], 1)
+        self.assertEqual(doc_counts[tag3.pk]["count"], 1)
+
+    @override_settings(SOSSE_SEARCH_CACHE_TTL=0, SOSSE_TAG_COUNTS_CACHE_TTL=60)
+    def test_tree_doc_counts_cache(self):
+        tag1 = Tag.objects.create(name="Tag 1")
+        tag2 = Tag.objects.create(name="Tag 2", parent=tag1)
+        doc = Document.objects.create(url="http://example.com/doc1", collection=self.collection)
+        doc.tags.add(tag2)
+
+        self.assertEqual(Tag.tree_doc_counts()[tag1.pk]["count"], 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(Tag.tree_doc_counts()[tag1.pk]["count"], 1)
+
+        # Document tag changes invalidate the cache
+        doc.tags.remove(tag2)
+        self.assertEqual(Tag.tree_doc_counts()[tag1.pk]["count"], 0)
+
+        # Tag changes invalidate the cache
+        tag3 = Tag.objects.create(name="Tag 3", parent=tag1)
+        self.assertEqual(Tag.tree_doc_counts()[tag3.pk]["count"], 0)
+
+    def test_tree_filter(self):
+        tag1 = Tag.objects.create(name="Tag 1")
+        tag2 = Tag.objects.create(name="Tag 2", parent=tag1)
+        tag3 = Tag.objects.create(name="Tag 3", parent=tag2)
+        tag4 = Tag.objects.create(name="Tag 4")
+
+        doc1 = Document.objects.create(url="http://example.com/doc1", collection=self.collection)
+        doc1.tags.add(tag3)
+        doc2 = Document.objects.create(url="http://example.com/doc2", collection=self.collection)
+        doc2.tags.add(tag4)
+        docs = Document.objects.wo_content().order_by("id")
+
+        self.assertEqual(list(docs.filter(Tag.tree_filter([tag1]))), [doc1])
+        self.assertEqual(list(docs.filter(Tag.tree_filter([tag3]))), [doc1])
+        self.assertEqual(list(docs.filter(Tag.tree_filter([tag2, tag4])).distinct()), [doc1, doc2])
+        self.assertEqual(list(docs.filter(Tag.tree_filter([]))), [])
+        self.assertEqual(list(docs.exclude(Tag.tree_filter([tag4]))), [doc1])
@@ -195,7 +195,7 @@ DEFAULTS: dict[str, dict[str, ConfOption]] = {
             type=bool,
         ),
         "csv_export_size": ConfOption(
-            comment="Number of results returned by CSV export.",
+            comment="Maximum number of results returned by CSV export, 0 for no limit.",
             default=200,
             type=int,
         ),
@@ -248,6 +248,36 @@ DEFAULTS: dict[str, dict[str, ConfOption]] = {
             default=3,
             type=int,
         ),
+        "search_count_limit": ConfOption(
+            comment='Maximum number of search results counted, when more results are found the count is displayed as a lower bound (like "10k+") and pages past this number of results are not browsable.\nSet to 0 to count all results.',
+            default=10000,
+            type=int,
+        ),
+        "search_count_estimate": ConfOption(
+            comment="When more than ``search_count_limit`` results are found, display the number of results estimated by the PostgreSQL query planner instead of the lower bound.",
+            default=False,
+            type=bool,
+        ),
+        "search_cache_ttl": ConfOption(
+            comment="Time in seconds the results of a search are kept in cache by each web server process, 0 disables the cache.\nCached results are discarded when a document is indexed or modified.",
+            default=0,
+            type=int,
+        ),
+        "search_cache_max_entries": ConfOption(
+            comment="Maximum number of searches kept in cache by each web server process.",
+            default=1000,
+            type=int,
+        ),
+        "search_cache_max_results": ConfOption(
+            comment="Searches returning more results than this number are not cached.",
+            default=1000,
+            type=int,
+        ),
+        "tag_counts_cache_ttl": ConfOption(
+            comment="Time in seconds the number of documents of each tag is kept in cache by each web server process, 0 disables the cache.\nCached counts are discarded when a document is indexed or modified.",
+            default=60,
+            type=int,
+        ),
     },
     "crawler": {
         "crawler_count": ConfOption(
@@ -291,6 +321,36 @@ The UA will be selected among the provided platform, specified as a comma-separa
             default=10,
             type=int,
         ),
+        "http_pool_max_hosts": ConfOption(
+            comment="Maximum number of hosts a crawler keeps connections open to, when the limit is reached connections to the least recently used host are closed.",
+            default=64,
+            type=int,
+        ),
+        "http_pool_maxsize": ConfOption(
+            comment="Maximum number of connections kept alive per host and per crawler.",
+            default=10,
+            type=int,
+        ),
+        "http_pool_idle_timeout": ConfOption(
+            comment="Close connections to a host after ``http_pool_idle_timeout`` seconds without request (never if 0).",
+            default=60,
+            type=int,
+        ),
+        "dns_cache": ConfOption(
+            comment="Cache DNS resolutions of hostnames inside each crawler, instead of querying the system resolver for every new connection.",
+            default=False,
+            type=bool,
+        ),
+        "dns_cache_expiry": ConfOption(
+            comment="Time in seconds a DNS resolution is kept in cache.\nThe TTL of DNS records is not known from the system resolver, resolutions are kept for this duration whatever their TTL.",
+            default=300,
+            type=int,
+        ),
+        "dns_cache_negative_expiry": ConfOption(
+            comment="Time in seconds a failed DNS resolution is kept in cache.",
+            default=30,
+            type=int,
+        ),
         "fail_over_lang": ConfOption(
             comment="Language used to parse web pages when the original language could not be detected.",
             default="english",
@@ -353,6 +413,31 @@ The UA will be selected among the provided platform, specified as a comma-separa
             default=50000,
             type=int,
         ),
+        "html_asset_download_threads": ConfOption(
+            comment="Number of threads used to download the assets of an HTML snapshot concurrently.\n1 downloads assets sequentially.",
+            default=1,
+            type=int,
+        ),
+        "html_asset_download_per_host": ConfOption(
+            comment="Maximum number of concurrent downloads of HTML snapshot assets from the same host.",
+            default=4,
+            type=int,
+        ),
+        "html_pack_max_size": ConfOption(
+            comment="HTML snapshot assets smaller than this size (in bytes) are appended to pack files instead of being written to individual files, pack files are served by Django.\n0 disables pack files.",
+            default=0,
+            type=int,
+        ),
+        "html_pack_segment_size": ConfOption(
+            comment="Size of a pack file (in MB), a new pack file is created once this size is reached.",
+            default=64,
+            type=int,
+        ),
+        "html_gzip": ConfOption(
+            comment="Store text files of HTML snapshots (HTML, CSS, etc.) compressed with gzip, with a ``.gz`` suffix.\nThe web server must serve them with ``gzip_static always`` and ``gunzip on``.",
+            default=False,
+            type=bool,
+        ),
         "max_redirects": ConfOption(
             comment="Maximum numbers of redirect before aborting.\n(this is accurate when using Requests only,\nsome redirects may be missed on Chromium)",
             default=5,
@@ -374,7 +459,7 @@ The UA will be selected among the provided platform, specified as a comma-separa
             type=int,
         ),
         "css_parser": ConfOption(
-            comment="Choose which CSS parser implementation to use. May be one of ``internal`` or ``cssutils``:\nYou may want to change this option when HTML snapshots have broken styles.",
+            comment="Choose which CSS parser implementation to use. May be one of ``internal``, ``stream`` or ``cssutils``:\nYou may want to change this option when HTML snapshots have broken styles.\n``stream`` is the fastest one on large stylesheets, it also rewrites ``@import`` rules.",
             default="internal",
         ),
         "worker_crash_retry": ConfOption(
@@ -517,9 +602,9 @@ class Conf:
             )
 
         css_parser = settings.get("SOSSE_CSS_PARSER")
-        if css_parser not in ("internal", "cssutils"):
+        if css_parser not in ("internal", "stream", "cssutils"):
             raise Exception(
-                f'Configuration parsing error: invalid css_parser value "{css_parser}", it must be either "internal" or "cssutils"'
+                f'Configuration parsing error: invalid css_parser value "{css_parser}", it must be either "internal", "stream" or "cssutils"'
             )
 
         crawler_count = settings.pop("SOSSE_CRAWLER_COUNT")
@@ -635,6 +720,16 @@ class Conf:
                     }
                 },
                 "ALLOWED_HOSTS": [settings.pop("SOSSE_ALLOWED_HOST")],
+                "CACHES": {
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    },
+                    "search": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                        "LOCATION": "search",
+                        "OPTIONS": {"MAX_ENTRIES": settings["SOSSE_SEARCH_CACHE_MAX_ENTRIES"]},
+                    },
+                },
                 "DATA_UPLOAD_MAX_MEMORY_SIZE": settings.pop("SOSSE_DATA_UPLOAD_MAX_MEMORY_SIZE"),
                 "DATA_UPLOAD_MAX_NUMBER_FIELDS": settings.pop("SOSSE_DATA_UPLOAD_MAX_NUMBER_FIELDS"),
                 "SOSSE_CRAWLER_COUNT": crawler_count,
@@ -28,6 +28,9 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.views import LogoutView
 from django.urls import include, path, re_path
@@ -41,6 +44,7 @@ from se.download import DownloadView
 from se.favicon import FavIconView
 from se.history import HistoryView
 from se.html import HTMLExcludedView, HTMLView
+from se.html_pack import HTMLPackView
 from se.login import SELoginView
 from se.online import OnlineCheckView
 from se.opensearch import OpensearchView
@@ -75,6 +79,11 @@ urlpatterns = [
     path("swagger/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
     re_path(r"^favicon/(?P<favicon_id>[0-9]+)", FavIconView.as_view(), name="favicon"),
     re_path(r"^html/.*", HTMLView.as_view(), name=HTMLView.view_name),
+    re_path(
+        r"^" + re.escape(settings.SOSSE_HTML_SNAPSHOT_URL.lstrip("/")) + r"(?P<filename>.+)$",
+        HTMLPackView.as_view(),
+        name="html_pack",
+    ),
     re_path(r"^screenshot/.*", ScreenshotView.as_view(), name=ScreenshotView.view_name),
     re_path(r"^screenshot_full/.*", ScreenshotFullView.as_view(), name="screenshot_full"),
     re_path(r"^www/.*", WWWView.as_view(), name=WWWView.view_name),